@@ -1,8 +1,16 @@
-from flask import Flask, request, jsonify
-from playwright.sync_api import sync_playwright
-from scraper import CornerStatsDataScraper, CornerStatsAuth
+from flask import Flask, Response, request, jsonify, g, url_for, stream_with_context
+from scraper import CornerStatsDataScraper
+from browser_pool import get_browser_pool, BrowserPoolTimeout
+from waits import WaitTelemetry
+from cache_store import get_catalog_cache, get_match_history, get_team_index, get_session_store
+from probability import CALCULATION_METHODS, MAX_SIMULATIONS, normalize_markets
+from async_scraper import AsyncCornerStatsDataScraper, get_async_engine
+from jobs import get_job_queue
+from singleflight import get_single_flight, compare_key
+from session_keeper import get_session_keeper
+from resource_filter import get_request_filter
 from functools import wraps
-import time, os
+import json, os, queue, threading, time
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 app = Flask(__name__)
@@ -16,6 +24,157 @@ app.config['TOKEN_EXPIRATION'] = 3600
 serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
 # --------------------------------
 
+# 'sync' = pooled sync Playwright browsers, 'async' = one event loop multiplexing many scrapes
+app.config['SCRAPER_ENGINE'] = os.environ.get('SCRAPER_ENGINE', 'sync')
+
+def run_scraper(method_name, *args, progress=None, email=None, **kwargs):
+    """Call a CornerStatsDataScraper API method on the configured engine as the user email
+
+    progress(stage, **info) follows its steps.
+    """
+    if app.config['SCRAPER_ENGINE'] == 'async':
+        scraper = AsyncCornerStatsDataScraper(email=email)
+        scraper.progress = progress
+        return get_async_engine().run(getattr(scraper, method_name)(*args, **kwargs))
+    scraper = CornerStatsDataScraper(email=email)
+    scraper.progress = progress
+    return getattr(scraper, method_name)(*args, **kwargs)
+
+def _succeeded(result):
+    return result[1] == 200
+
+def call_scraper(kind, args, kwargs, progress=None, email=None):
+    """run_scraper, with identical in-flight compares coalesced into one scrape and calculation
+
+    Coalesced callers share the first caller's result only when it succeeded; an error
+    (e.g. that caller's session expired) makes each of them run their own compare.
+    """
+    if kind != 'compare_and_calculate':
+        return run_scraper(kind, *args, progress=progress, email=email, **kwargs)
+    on_wait = (lambda: progress("waiting_for_identical_request")) if progress else None
+    result, shared = get_single_flight().do(
+        compare_key(*args, **kwargs), lambda: run_scraper(kind, *args, progress=progress, email=email, **kwargs), on_wait,
+        shareable=_succeeded)
+    if shared:
+        print(f"Compare {args[0]['name']} vs {args[1]['name']} shared an identical in-flight request")
+    return result
+
+# Scraper methods that can run as queued jobs ("async": true in the request body)
+JOB_TYPES = ('compare_and_calculate', 'compare_batch')
+
+def run_job(kind, params, progress, owner):
+    """Job queue runner: replay a validated API call on the configured engine, as the job's owner"""
+    if kind not in JOB_TYPES:
+        return {"error": f"Unknown job type: {kind}"}, 400
+    return call_scraper(kind, params['args'], params['kwargs'], progress, email=owner)
+
+def job_queue():
+    return get_job_queue(run_job)
+
+def session_keeper():
+    keeper = get_session_keeper()
+    # Log in and park pages on the engine that serves the scrapes
+    keeper.engine = app.config['SCRAPER_ENGINE']
+    return keeper
+
+def run_or_enqueue(kind, data, args, kwargs):
+    """Run a scraper call now, or queue it and answer 202 with the job id when the request asks for "async" """
+    if data.get('async'):
+        job_id = job_queue().submit(kind, {'args': args, 'kwargs': kwargs}, owner=g.email)
+        return jsonify({
+            "job_id": job_id,
+            "state": "queued",
+            "status_url": url_for('api_get_job', job_id=job_id),
+        }), 202
+    result_data, status_code = call_scraper(kind, args, kwargs, email=g.email)
+    return jsonify(result_data), status_code
+
+# Most fixtures accepted by one /api/compare_batch call
+MAX_BATCH_FIXTURES = int(os.environ.get("MAX_BATCH_FIXTURES", 300))
+# Seconds of silence after which a streamed compare sends a heartbeat line
+STREAM_HEARTBEAT_SECONDS = int(os.environ.get("STREAM_HEARTBEAT_SECONDS", 15))
+
+def normalize_team(field, team):
+    """Check a {'id'/'value': ..., 'name': ...} team and make it use 'id'. Returns an error message or None."""
+    if (not isinstance(team, dict) or
+        'name' not in team or
+        not ('id' in team or 'value' in team)):
+        return f"Invalid {field} format. Expected {{'id'/'value': '...', 'name': '...'}}"
+    # Normalize team data to use 'id' internally if 'value' is provided
+    if 'value' in team and 'id' not in team:
+        team['id'] = team.pop('value')
+    return None
+
+def parse_compare_request(data):
+    """Validate a compare request body. Returns (args, kwargs, error) for compare_and_calculate."""
+    if not isinstance(data, dict):
+        return None, None, "No JSON data provided"
+
+    # Validate input data
+    required_fields = ['host_team', 'guest_team', 'country_name', 'filters']
+    for field in required_fields:
+        if field not in data:
+            return None, None, f"Missing required field: {field}"
+
+    host_team = data['host_team']
+    guest_team = data['guest_team']
+    country_name = data['country_name']
+    filters = data['filters']
+
+    # Validate team data structure (accepting 'value' or 'id' for the ID field)
+    for field, team in (('host_team', host_team), ('guest_team', guest_team)):
+        error = normalize_team(field, team)
+        if error:
+            return None, None, error
+
+    # Validate filters data structure (basic)
+    if not isinstance(filters, dict):
+        return None, None, "Invalid filters format. Expected a JSON object."
+
+    calculation, error = parse_calculation_options(data)
+    if error:
+        return None, None, error
+
+    return ([host_team, guest_team, country_name, filters],
+            {'refresh': bool(data.get('refresh', False)), 'calculation': calculation}, None)
+
+def parse_calculation_options(data):
+    """Read the optional calculation settings of a compare request. Returns (options, error)."""
+    options = {}
+    if data.get('method') is not None:
+        if data['method'] not in CALCULATION_METHODS:
+            return None, f"Invalid method. Expected one of: {', '.join(CALCULATION_METHODS)}."
+        options['method'] = data['method']
+    if data.get('simulations') is not None:
+        simulations = data['simulations']
+        if isinstance(simulations, bool) or not isinstance(simulations, int) or not 1 <= simulations <= MAX_SIMULATIONS:
+            return None, f"Invalid simulations. Expected an integer between 1 and {MAX_SIMULATIONS}."
+        options['simulations'] = simulations
+    if data.get('seed') is not None:
+        if isinstance(data['seed'], bool) or not isinstance(data['seed'], int) or data['seed'] < 0:
+            return None, "Invalid seed. Expected a non-negative integer."
+        options['seed'] = data['seed']
+    if data.get('markets') is not None:
+        try:
+            options['markets'] = normalize_markets(data['markets'])
+        except ValueError as e:
+            return None, f"Invalid markets: {e}"
+    return options, None
+
+def cached_catalog(key, method_name, *args, on_success=None):
+    """Serve a catalog lookup from the persistent cache (?refresh=1 forces a new scrape)
+
+    Concurrent misses for the same key share a single scrape.
+    """
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+    email = g.email # The loader may run later, on a background refresh thread
+    loader = lambda: get_single_flight().do(f"catalog:{key}", lambda: run_scraper(method_name, *args, email=email),
+                                            shareable=_succeeded)[0]
+    data, status_code, cache_info = get_catalog_cache().fetch(key, loader, refresh=refresh, on_success=on_success)
+    if isinstance(data, dict):
+        data = dict(data, cache=cache_info)
+    return jsonify(data), status_code
+
 def generate_token(email):
     """Generate a time-limited token for a user."""
     return serializer.dumps({'email': email})
@@ -46,36 +205,33 @@ def api_login():
             app.logger.warning("Missing email or password")
             return jsonify({"error": "Email and password are required"}), 400
 
-        # --- Use CornerStatsAuth for login ---
-        auth = CornerStatsAuth() # Instantiate the auth class
+        # A stored session for these credentials that was verified recently (or passes a
+        # quick HTTP probe) answers at once; the browser login only runs otherwise
+        reused = session_keeper().reuse_for_login(email, password)
+        if reused:
+            app.logger.info(f"Login for {email} served from the stored session ({reused})")
+            return jsonify({"message": "Login successful", "token": generate_token(email), "session": reused}), 200
 
-        with sync_playwright() as p:
-            # Use headless=True for API calls
-            browser = p.chromium.launch(headless=True, channel="msedge")
-            page = browser.new_page()
+        try:
+            # Log in on the configured engine (a warm pooled browser with its cookies cleared,
+            # or a fresh async context); the logged-in page stays parked for this user
+            logged_in = session_keeper().login(email, password)
+        except BrowserPoolTimeout as e:
+            app.logger.warning(f"Browser pool exhausted during login for {email}: {e}")
+            return jsonify({"error": "All browsers are busy. Please retry shortly."}), 503
+        except Exception as e:
+            app.logger.error(f"Error during Playwright operations in login for {email}: {e}", exc_info=True)
+            return jsonify({"error": f"Login process error (Playwright): {str(e)}"}), 500
 
-            try:
-                page.goto("https://corner-stats.com") # URL can be hardcoded or passed
-                page.wait_for_load_state("networkidle")
-                time.sleep(2)
-
-                # --- Call the login method from CornerStatsAuth ---
-                if auth.login(page, email, password): # Call the method on the auth instance
-                    # Assuming CornerStatsAuth.login saves the session upon success
-                    # If not, you might need to call session.save manually here,
-                    # or ensure CornerStatsSession (used by CornerStatsDataScraper) loads it correctly later.
-                    token = generate_token(email)
-                    app.logger.info(f"Login successful for {email}")
-                    return jsonify({"message": "Login successful", "token": token}), 200
-                else:
-                    app.logger.info(f"Login failed for {email}")
-                    return jsonify({"error": "Login failed - Invalid credentials or site error"}), 401
-
-            except Exception as e:
-                app.logger.error(f"Error during Playwright operations in login for {email}: {e}", exc_info=True)
-                return jsonify({"error": f"Login process error (Playwright): {str(e)}"}), 500
-            finally:
-                browser.close()
+        if logged_in:
+            # The login saves the session upon success; pooled contexts
+            # pick up the new cookies the next time they are borrowed.
+            token = generate_token(email)
+            app.logger.info(f"Login successful for {email}")
+            return jsonify({"message": "Login successful", "token": token, "session": "new"}), 200
+        else:
+            app.logger.info(f"Login failed for {email}")
+            return jsonify({"error": "Login failed - Invalid credentials or site error"}), 401
 
     except Exception as e:
         app.logger.error(f"Unhandled error in /api/login endpoint: {e}", exc_info=True)
@@ -96,12 +252,41 @@ def token_required(f):
         if not email:
             return jsonify({'error': 'Token is invalid or expired!'}), 401
 
-        # Pass the email or user info to the function if needed
-        # For now, we just check validity
+        # The caller's email, e.g. to tie queued jobs to their owner
+        g.email = email
+        # Active users get their session kept verified and a logged-in page parked
+        session_keeper().touch(email)
         return f(*args, **kwargs)
     return decorated_function
 # ------------------------------------------------
 
+@app.route('/api/countries', methods=['GET'])
+@token_required
+def api_get_countries():
+    """List countries only (first level of the catalog)"""
+    return cached_catalog(get_catalog_cache().countries_key(), 'get_countries')
+
+@app.route('/api/leagues', methods=['GET'])
+@token_required
+def api_get_leagues():
+    """List the leagues of one country, without their teams"""
+    country_name = request.args.get('country_name')
+    if not country_name:
+        return jsonify({"error": "Missing required parameter: country_name"}), 400
+
+    return cached_catalog(get_catalog_cache().leagues_key(country_name), 'get_leagues', country_name)
+
+@app.route('/api/teams', methods=['GET'])
+@token_required
+def api_get_teams():
+    """List the teams of one league"""
+    country_name = request.args.get('country_name')
+    league_id = request.args.get('league_id')
+    if not country_name or not league_id:
+        return jsonify({"error": "Missing required parameters: country_name and league_id"}), 400
+
+    return cached_catalog(get_catalog_cache().teams_key(country_name, league_id), 'get_teams', country_name, league_id)
+
 @app.route('/api/leagues_teams', methods=['GET'])
 @token_required # Apply the decorator to protect this endpoint
 def api_get_leagues_teams():
@@ -111,11 +296,11 @@ def api_get_leagues_teams():
     if not country_name:
         return jsonify({"error": "Missing required parameter: country_name"}), 400
 
-    scraper = CornerStatsDataScraper()
-    data, status_code = scraper.get_leagues_and_teams(country_name)
-
-    # Return the data or error with the appropriate status code
-    return jsonify(data), status_code
+    # Served from the catalog cache; a full crawl also fills the per-league entries
+    catalog = get_catalog_cache()
+    return cached_catalog(
+        catalog.leagues_teams_key(country_name), 'get_leagues_and_teams', country_name,
+        on_success=lambda data: catalog.fill_from_leagues_and_teams(country_name, data))
 
 @app.route('/api/compare_and_calculate', methods=['POST'])
 @token_required # Apply the decorator to protect this endpoint
@@ -123,46 +308,133 @@ def api_compare_and_calculate():
     """API endpoint to compare teams, apply filters, and calculate win probability."""
     # Get JSON data from request
     data = request.get_json()
+    args, kwargs, error = parse_compare_request(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Validate input data
-    required_fields = ['host_team', 'guest_team', 'country_name', 'filters']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"error": f"Missing required field: {field}"}), 400
+    # Run the scrape and calculation on the configured engine ("refresh": true skips the match history),
+    # or queue it as a job when "async": true
+    return run_or_enqueue('compare_and_calculate', data, args, kwargs)
 
-    host_team = data['host_team']
-    guest_team = data['guest_team']
-    country_name = data['country_name']
-    filters = data['filters']
+@app.route('/api/compare_and_calculate/stream', methods=['POST'])
+@token_required
+def api_compare_and_calculate_stream():
+    """compare_and_calculate streamed as NDJSON: stage events, provisional estimates per table page, then the result.
 
-    # Validate team data structure (accepting 'value' or 'id' for the ID field)
-    if (not isinstance(host_team, dict) or
-        'name' not in host_team or
-        not ('id' in host_team or 'value' in host_team)):
-        return jsonify({"error": "Invalid host_team format. Expected {'id'/'value': '...', 'name': '...'}"}), 400
+    Each line is a JSON object with an "event" of "stage", "heartbeat" or "result".
+    """
+    data = request.get_json()
+    args, kwargs, error = parse_compare_request(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    if (not isinstance(guest_team, dict) or
-        'name' not in guest_team or
-        not ('id' in guest_team or 'value' in guest_team)):
-        return jsonify({"error": "Invalid guest_team format. Expected {'id'/'value': '...', 'name': '...'}"}), 400
+    events = queue.Queue()
+    def progress(stage, **info):
+        events.put(dict(info, event="stage", stage=stage))
 
-    # Normalize team data to use 'id' internally if 'value' is provided
-    if 'value' in host_team and 'id' not in host_team:
-        host_team['id'] = host_team.pop('value')
-    if 'value' in guest_team and 'id' not in guest_team:
-        guest_team['id'] = guest_team.pop('value')
+    email = g.email
+    def run():
+        try:
+            result_data, status_code = call_scraper('compare_and_calculate', args, kwargs, progress, email)
+        except Exception as e:
+            app.logger.error(f"Error in streamed compare: {e}", exc_info=True)
+            result_data, status_code = {"error": f"Scraping/calculation failed: {str(e)}"}, 500
+        events.put({"event": "result", "status": status_code, "result": result_data})
 
-    # Validate filters data structure (basic)
-    if not isinstance(filters, dict):
+    # The scrape keeps going (and fills the match history) even if the client disconnects
+    threading.Thread(target=run, name="compare-stream", daemon=True).start()
+    started = time.monotonic()
+
+    def generate():
+        while True:
+            try:
+                event = events.get(timeout=STREAM_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                event = {"event": "heartbeat"} # Keeps proxies from closing an idle stream
+            event["elapsed"] = round(time.monotonic() - started, 3)
+            yield json.dumps(event) + "\n"
+            if event["event"] == "result":
+                return
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/compare_batch', methods=['POST'])
+@token_required
+def api_compare_batch():
+    """Price a slate of fixtures sharing country_name and filters; one result (or error) per fixture."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No JSON data provided"}), 400
+
+    for field in ['fixtures', 'country_name', 'filters']:
+        if field not in data:
+            return jsonify({"error": f"Missing required field: {field}"}), 400
+
+    fixtures = data['fixtures']
+    if not isinstance(fixtures, list) or not fixtures or len(fixtures) > MAX_BATCH_FIXTURES:
+        return jsonify({"error": f"Invalid fixtures. Expected a list of 1 to {MAX_BATCH_FIXTURES} "
+                                 "{'host_team': {...}, 'guest_team': {...}} objects."}), 400
+    for index, fixture in enumerate(fixtures):
+        if not isinstance(fixture, dict):
+            return jsonify({"error": f"Invalid fixture {index}. Expected a JSON object."}), 400
+        for field in ('host_team', 'guest_team'):
+            error = normalize_team(field, fixture.get(field))
+            if error:
+                return jsonify({"error": f"Fixture {index}: {error}"}), 400
+
+    if not isinstance(data['filters'], dict):
         return jsonify({"error": "Invalid filters format. Expected a JSON object."}), 400
 
-    # Create scraper instance and call the method
-    scraper = CornerStatsDataScraper()
-    result_data, status_code = scraper.compare_and_calculate(host_team, guest_team, country_name, filters)
+    calculation, error = parse_calculation_options(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Return the result with the appropriate status code
-    return jsonify(result_data), status_code
+    return run_or_enqueue('compare_batch', data, [fixtures, data['country_name'], data['filters']],
+                          {'refresh': bool(data.get('refresh', False)), 'calculation': calculation})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@token_required
+def api_get_job(job_id):
+    """Status, current stage and (once finished) result of a queued job"""
+    job = job_queue().get(job_id)
+    # Jobs are only visible to the user who submitted them
+    if job is None or job.pop('owner') != g.email:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/api/metrics', methods=['GET'])
+@token_required
+def api_metrics():
+    """Operational metrics (browser pool, per-step wait times, catalog cache, job queue, blocked requests, async engine load)"""
+    metrics = {
+        "scraper_engine": app.config['SCRAPER_ENGINE'],
+        "browser_pool": get_browser_pool().stats(),
+        "waits": WaitTelemetry.global_stats(),
+        "catalog_cache": get_catalog_cache().stats(),
+        "match_history": get_match_history().stats(),
+        "team_index": get_team_index().stats(),
+        "jobs": job_queue().stats(),
+        "single_flight": get_single_flight().stats(),
+        "sessions": get_session_store().stats(),
+        "session_keeper": session_keeper().stats(),
+        "resource_filter": get_request_filter().stats(),
+    }
+    if app.config['SCRAPER_ENGINE'] == 'async':
+        metrics["async_engine"] = get_async_engine().stats()
+    return jsonify(metrics), 200
 
 if __name__ == '__main__':
+    use_reloader = os.environ.get('FLASK_RELOADER', '1') == '1'
+    # With the reloader the first process only watches files and the child (WERKZEUG_RUN_MAIN) serves;
+    # background work starts in the serving process only
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Launch the pooled browsers in the background so the first requests find them warm
+        if app.config['SCRAPER_ENGINE'] == 'sync' and os.environ.get('BROWSER_POOL_PREWARM', '1') == '1':
+            get_browser_pool().warm()
+        # Start the job workers now so jobs left over from the last run are picked up
+        job_queue()
+        # Keep stored sessions verified and refreshed, and active users' pages parked, in the background
+        session_keeper()
     # Make sure to run Flask in a production-like environment if exposing it beyond localhost
-    app.run(debug=True, host='127.0.0.1', port=5000) # Default host/port, adjust if needed
\ No newline at end of file
+    app.run(debug=True, use_reloader=use_reloader, host='127.0.0.1', port=5000) # Default host/port, adjust if needed
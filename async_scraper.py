@@ -0,0 +1,680 @@
+import asyncio, os, threading, traceback
+from contextlib import asynccontextmanager
+import playwright
+from playwright.async_api import async_playwright
+from browser_pool import BASE_URL, COMPARE_FORM, PRESET_RESULTS_JS
+from resource_filter import LEAN_LAUNCH_ARGS, LEAN_CONTEXT_OPTIONS, get_request_filter
+from scraper import CornerStatsSession, CornerStatsDataScraper, EXTRACT_TABLE_JS, READ_OPTIONS_JS, LOGIN_SETTLED_JS
+from waits import AsyncStepWaiter, COUNT_AT_LEAST_JS
+from xhr_client import cut_at_known
+from cache_store import get_match_history
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+class AsyncScrapeEngine:
+    """Background event loop that multiplexes many scrapes over one shared browser.
+
+    Each scrape gets its own lightweight browser context; ``max_concurrency``
+    (ASYNC_SCRAPE_CONCURRENCY) caps how many run at once, so throughput is bound
+    by browser capacity rather than by the number of Python threads.
+
+    Compares take a page already sitting on the compare form for their session when
+    there is one (``compare_page``); used pages are reset to the form in the
+    background and kept, up to ``positioned_pages`` (ASYNC_POSITIONED_PAGES).
+    """
+    def __init__(self, max_concurrency=None, headless=None, channel=None, positioned_pages=None):
+        self.max_concurrency = max_concurrency or _env_int("ASYNC_SCRAPE_CONCURRENCY", 24)
+        self.positioned_pages = positioned_pages if positioned_pages is not None else _env_int("ASYNC_POSITIONED_PAGES", 4)
+        self.headless = headless if headless is not None else _env_bool("BROWSER_HEADLESS", True)
+        self.channel = channel if channel is not None else os.environ.get("BROWSER_CHANNEL", "msedge")
+        self.loop = asyncio.new_event_loop()
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = None
+        self._semaphore = None
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        # (session stamp, context, page) on the compare form, most recently reset last; loop thread only
+        self._positioned = []
+        self._positioned_stats = {"hits": 0, "misses": 0, "resets": 0, "reset_failures": 0}
+        # Started last: the loop thread creates the loop-bound primitives set to None above
+        self._thread = threading.Thread(target=self._run_loop, name="async-scrape-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        # Loop-bound primitives have to be created on the loop thread
+        self._browser_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.loop.run_forever()
+
+    async def _get_browser(self):
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                launch_args = {"headless": self.headless, "args": LEAN_LAUNCH_ARGS}
+                if self.channel:
+                    launch_args["channel"] = self.channel
+                self._browser = await self._playwright.chromium.launch(**launch_args)
+                print("Async engine: browser launched")
+            return self._browser
+
+    async def _new_context(self, session_data=None):
+        """A fresh context carrying the session and its page, with unneeded requests blocked"""
+        browser = await self._get_browser()
+        context = await browser.new_context(**LEAN_CONTEXT_OPTIONS)
+        try:
+            await get_request_filter().install_async(context)
+            page = await context.new_page()
+            if session_data:
+                if 'cookies' in session_data:
+                    await context.add_cookies(session_data['cookies'])
+                if 'headers' in session_data:
+                    await page.set_extra_http_headers(session_data['headers'])
+        except BaseException:
+            await context.close()
+            raise
+        return context, page
+
+    @asynccontextmanager
+    async def page(self, session_data=None):
+        """Yield a page in a fresh context carrying the session; closes the context afterwards"""
+        async with self._semaphore:
+            context, page = await self._new_context(session_data)
+            try:
+                yield page
+            finally:
+                await context.close()
+
+    @staticmethod
+    def _stamp(session_data):
+        return (session_data.get("email"), session_data.get("timestamp")) if session_data else None
+
+    async def _position(self, page, url):
+        """Navigate to the compare form and preset the results per page"""
+        await page.goto(url)
+        await page.locator(COMPARE_FORM).wait_for(state="attached", timeout=10000)
+        await page.evaluate(PRESET_RESULTS_JS)
+
+    async def _take_positioned(self, stamp):
+        """Pop a positioned page of this session, closing pages of the user's older sessions"""
+        found = None
+        for entry in list(reversed(self._positioned)):
+            entry_stamp, context, page = entry
+            if entry_stamp == stamp and found is None and not page.is_closed():
+                found = entry
+            elif (entry_stamp[0] == stamp[0] and entry_stamp != stamp) or page.is_closed():
+                self._positioned.remove(entry)
+                await context.close()
+        if found is not None:
+            self._positioned.remove(found)
+        return found
+
+    async def _keep_positioned(self, stamp, context, page, url):
+        """Reset a page to the compare form and keep it for the session's next compare"""
+        try:
+            await self._position(page, url)
+        except Exception as e:
+            print(f"Async engine: failed to reset a compare page: {e}")
+            self._positioned_stats["reset_failures"] += 1
+            await context.close()
+            return
+        self._positioned_stats["resets"] += 1
+        self._positioned.append((stamp, context, page))
+        while len(self._positioned) > self.positioned_pages:
+            await self._positioned.pop(0)[1].close()
+
+    @asynccontextmanager
+    async def compare_page(self, session_data, url=BASE_URL):
+        """Yield a page on the compare form carrying the session, pre-positioned when possible.
+
+        Afterwards the page is reset in the background instead of being closed, so the
+        caller does not wait for the navigation.
+        """
+        async with self._semaphore:
+            stamp = self._stamp(session_data)
+            entry = await self._take_positioned(stamp) if stamp and self.positioned_pages else None
+            if entry is not None:
+                self._positioned_stats["hits"] += 1
+                _, context, page = entry
+            else:
+                self._positioned_stats["misses"] += 1
+                context, page = await self._new_context(session_data)
+                try:
+                    await self._position(page, url)
+                except BaseException:
+                    await context.close()
+                    raise
+            finished = False
+            try:
+                yield page
+                finished = True
+            finally:
+                if finished and stamp and self.positioned_pages:
+                    self.loop.create_task(self._keep_positioned(stamp, context, page, url))
+                else:
+                    await context.close()
+
+    async def _preposition(self, session_data, url):
+        stamp = self._stamp(session_data)
+        if any(entry[0] == stamp for entry in self._positioned):
+            return
+        async with self._semaphore:
+            context, page = await self._new_context(session_data)
+        await self._keep_positioned(stamp, context, page, url)
+
+    def preposition(self, session_data, url=BASE_URL):
+        """Have a page of this session wait on the compare form (non-blocking); False if one already does"""
+        stamp = self._stamp(session_data)
+        if not stamp or not self.positioned_pages or any(entry[0] == stamp for entry in list(self._positioned)):
+            return False
+        asyncio.run_coroutine_threadsafe(self._preposition(session_data, url), self.loop)
+        return True
+
+    async def login(self, fn, url=BASE_URL):
+        """Run fn(page) -> (logged_in, session_data) in a fresh context with request filtering lifted.
+
+        On success the logged-in page is reset to the compare form and kept for the user's
+        next compare, replacing pages of their older sessions. Returns logged_in.
+        """
+        async with self._semaphore:
+            context, page = await self._new_context()
+            try:
+                with get_request_filter().unfiltered(context):
+                    logged_in, session_data = await fn(page)
+            except BaseException:
+                await context.close()
+                raise
+        stamp = self._stamp(session_data) if logged_in else None
+        if stamp and self.positioned_pages:
+            await self._take_positioned(stamp) # Closes the user's older pages
+            await self._keep_positioned(stamp, context, page, url)
+        else:
+            await context.close()
+        return logged_in
+
+    async def _track(self, coro):
+        self._in_flight += 1
+        try:
+            result = await coro
+            self._completed += 1
+            return result
+        except BaseException:
+            self._failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop from any thread; returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(self._track(coro), self.loop)
+
+    def run(self, coro, timeout=None):
+        """Blocking helper for sync callers (e.g. Flask views)"""
+        return self.submit(coro).result(timeout)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "failed": self._failed,
+            "positioned_pages": self.positioned_pages,
+            "positioned_idle": len(self._positioned),
+            **{f"positioned_{k}": v for k, v in self._positioned_stats.items()},
+        }
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_async_engine():
+    """Return the process-wide async scrape engine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncScrapeEngine()
+        return _engine
+
+class AsyncCornerStatsAuth:
+    """CornerStatsAuth for the async engine: the login form runs in one of the engine's contexts"""
+    async def _is_logged_in(self, page):
+        return await page.locator('a.btn.btn-confirm:has-text("Login")').count() == 0
+
+    async def login(self, page, email, password):
+        try:
+            if await self._is_logged_in(page):
+                return True
+
+            await page.locator('a.btn.btn-confirm:has-text("Login")').click()
+            await page.wait_for_selector("#form_login", timeout=10000)
+            await page.locator("#email_login").fill(email)
+            await page.locator("#password_login").fill(password)
+            await page.locator("button.btn__button.sign-in").click()
+            await AsyncStepWaiter(page).until("login_result", LOGIN_SETTLED_JS)
+
+            if not await self._is_logged_in(page):
+                return False
+            cookies = await page.context.cookies()
+            await asyncio.to_thread(CornerStatsSession().save_cookies, cookies, email, password)
+            return True
+        except Exception as e:
+            print(f"Login error: {e}")
+            return False
+
+    async def _login_on_engine(self, engine, email, password):
+        async def do_login(page):
+            await page.goto(BASE_URL)
+            await page.wait_for_load_state("networkidle")
+            await AsyncStepWaiter(page).until_selector("login_ready", 'a.btn.btn-confirm:has-text("Login")')
+            if not await self.login(page, email, password):
+                return False, None
+            return True, await asyncio.to_thread(CornerStatsSession(email).load)
+        return await engine.login(do_login)
+
+    def login_with_engine(self, engine, email, password):
+        """Log in on the async engine (blocking, for sync callers); saves the session on success.
+
+        The logged-in page stays on the compare form for the user's next compare.
+        """
+        return engine.run(self._login_on_engine(engine, email, password))
+
+class AsyncCornerStatsDataScraper(CornerStatsDataScraper):
+    """asyncio version of CornerStatsDataScraper built on playwright.async_api.
+
+    ``get_leagues_and_teams`` and ``compare_and_calculate`` are coroutines with the
+    same inputs and (data, status_code) results as the sync scraper. DataFrame
+    creation and probability calculation are inherited unchanged.
+    """
+    def __init__(self, engine=None, email=None):
+        # The inherited state (wait budgets, recorder, page concurrency, ...) is shared with the
+        # sync scraper; the pool it holds launches nothing unless borrowed, which this class never does
+        super().__init__(mode="browser", email=email)
+        self.engine = engine or get_async_engine()
+
+    def _waiter(self, page):
+        return AsyncStepWaiter(page, self.wait_telemetry, self.wait_budgets)
+
+    async def _is_logged_in(self, page):
+        """Check if user is logged in"""
+        return await page.locator('a.btn.btn-confirm:has-text("Login")').count() == 0
+
+    async def _open_home(self, page):
+        await page.goto(self.url)
+        await page.wait_for_load_state("networkidle")
+
+    async def _read_options(self, select):
+        """Return [{'value', 'name'}] for the non-placeholder options of a select"""
+        options = await select.evaluate(READ_OPTIONS_JS)
+        return [o for o in options if o['value'] and o['value'] != "0"]
+
+    async def _open_catalog(self, page):
+        """Open the home page and wait for the team block; returns an error response or None"""
+        await self._open_home(page)
+        if not await self._is_logged_in(page):
+            return {"error": "Session invalid or expired. Please log in again."}, 401
+        await page.locator("#block1.team").first.wait_for(timeout=10000)
+        return None
+
+    async def _select_country(self, page, country_name):
+        country_select = page.locator("select.select-control_1").first
+        selected_country = next(
+            (c for c in await self._read_options(country_select) if c['name'].lower() == country_name.lower()), None)
+        if selected_country:
+            # Wait for the league select to be refilled via AJAX
+            await self._waiter(page).on_mutation("leagues_loaded", "select.select-control_2",
+                                                 lambda: country_select.select_option(selected_country['value']))
+        return selected_country
+
+    async def _read_leagues(self, page):
+        leagues = await self._read_options(page.locator("select.select-control_2").first)
+        return [{"id": league['value'], "name": league['name']} for league in leagues]
+
+    async def _read_league_teams(self, page, league_id):
+        league_select = page.locator("select.select-control_2").first
+        await self._waiter(page).on_mutation("teams_loaded", "select.select-control_3",
+                                             lambda: league_select.select_option(str(league_id)))
+        return await self._read_options(page.locator("select.select-control_3").first)
+
+    async def _catalog(self, label, work):
+        """Run work(page) on a fresh, logged-in page of the engine"""
+        session_data = await asyncio.to_thread(self.session.load)
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
+        try:
+            async with self.engine.page(session_data) as page:
+                return await self._open_catalog(page) or await work(page)
+        except Exception as e:
+            print(f"Error in async {label}: {e}")
+            traceback.print_exc()
+            return {"error": f"Scraping failed: {str(e)}"}, 500
+
+    # --- Methods for /api/countries, /api/leagues and /api/teams ---
+    async def get_countries(self):
+        async def work(page):
+            return {"countries": await self._read_options(page.locator("select.select-control_1").first)}, 200
+        return await self._catalog("get_countries", work)
+
+    async def get_leagues(self, country_name):
+        async def work(page):
+            country = await self._select_country(page, country_name)
+            if not country:
+                return {"error": f"Country '{country_name}' not found."}, 404
+            return {"country": country['name'], "leagues": await self._read_leagues(page)}, 200
+        return await self._catalog("get_leagues", work)
+
+    async def get_teams(self, country_name, league_id):
+        async def work(page):
+            country = await self._select_country(page, country_name)
+            if not country:
+                return {"error": f"Country '{country_name}' not found."}, 404
+            if not any(league['id'] == str(league_id) for league in await self._read_leagues(page)):
+                return {"error": f"League '{league_id}' not found in {country['name']}."}, 404
+            return {
+                "country": country['name'],
+                "league_id": str(league_id),
+                "teams": await self._read_league_teams(page, league_id)
+            }, 200
+        return await self._catalog("get_teams", work)
+
+    # --- Methods for API 2: /api/leagues_teams ---
+    async def get_leagues_and_teams(self, country_name):
+        """Get leagues and teams for a given country"""
+        async def work(page):
+            country = await self._select_country(page, country_name)
+            if not country:
+                return {"error": f"Country '{country_name}' not found."}, 404
+            result_data = {"country": country['name'], "leagues": []}
+            for league in await self._read_leagues(page):
+                league["teams"] = await self._read_league_teams(page, league['id'])
+                result_data["leagues"].append(league)
+            return result_data, 200
+        return await self._catalog("get_leagues_and_teams", work)
+
+    # --- Methods for API 3: /api/compare_and_calculate ---
+    async def _select_team_from_search_results(self, page, team_name, input_selector, results_container_selector, pick_text=None):
+        """Helper method to select a team from search results (no user interaction)"""
+        try:
+            print(f"Searching for team: {team_name}")
+            input_field = page.locator(input_selector)
+            await input_field.clear()
+            await input_field.fill(team_name)
+            # Trigger the search by typing (simulate keyup event)
+            await input_field.press("Space")
+            await input_field.press("Backspace")
+
+            item_selector = f"{results_container_selector} li.match-creator-selectblock-searchresult-item"
+            waiter = self._waiter(page)
+            await waiter.until("search_results", COUNT_AT_LEAST_JS, [item_selector, 1])
+            team_links = page.locator(item_selector).locator("a.team_row")
+            result_texts = [t.strip() for t in await team_links.all_text_contents()]
+
+            if not result_texts:
+                print(f"No search results found for team: {team_name}")
+                return False
+            if pick_text is not None and pick_text not in result_texts:
+                print(f"Indexed result '{pick_text}' not among the search results")
+                return False
+
+            index = result_texts.index(pick_text) if pick_text is not None else 0
+            print(f"Selected team: {result_texts[index]}")
+            await team_links.nth(index).click()
+            await waiter.until_selector("team_selected", item_selector, state="hidden")
+            return result_texts[index]
+        except Exception as e:
+            print(f"Error selecting team from search results: {e}")
+            traceback.print_exc()
+            return False
+
+    async def _enter_teams_in_compare_form(self, page, host_team, guest_team, country_name):
+        """Enter the selected teams in the Compare Teams form"""
+        try:
+            await page.locator("form#match-form_1").wait_for(timeout=10000)
+            for team, side in ((host_team, 1), (guest_team, 2)):
+                input_selector = f"#input_team_{side}_1"
+                results_selector = f"#div_input_team_{side}_1 .match-creator-selectblock-searchresult"
+                # Indexed exact pick first, then with the country suffix, then the bare name
+                # Team index lookups hit SQLite, so they run off the event loop
+                searches, indexed = await asyncio.to_thread(self._team_searches, team, country_name)
+                for query, pick_text in searches:
+                    selected = await self._select_team_from_search_results(
+                        page, query, input_selector, results_selector, pick_text)
+                    if selected:
+                        await asyncio.to_thread(self._team_resolved, team, country_name, indexed, query, pick_text, selected)
+                        break
+                else:
+                    print(f"Failed to select team: {team['name']}")
+                    return False
+            await self._waiter(page).until_selector("compare_ready", ".getmatches_filters", state="visible")
+            print("Teams entered successfully in compare form")
+            return True
+        except Exception as e:
+            print(f"Error entering teams in compare form: {e}")
+            return False
+
+    async def _ensure_unchecked(self, waiter, checkbox, label):
+        """Uncheck a filter checkbox if it is checked; tolerate slow state reads like the sync scraper"""
+        try:
+            if await checkbox.is_checked(timeout=2000):
+                print(f"   Unchecking {label}...")
+                await waiter.on_mutation("filter_applied", "table.data-table", checkbox.uncheck)
+            else:
+                print(f"   {label} already unchecked.")
+        except playwright._impl._errors.TimeoutError:
+            print(f"   Warning: Could not determine {label} checkbox state quickly, assuming unchecked or proceeding.")
+
+    async def _configure_filters(self, page, filters):
+        """Configure the filter options based on API input (no user interaction)"""
+        try:
+            print("\nConfiguring filters...")
+            await page.locator(".getmatches_filters").wait_for(timeout=15000, state='visible')
+            waiter = self._waiter(page)
+
+            show_select = page.locator("select.show_results")
+            if await show_select.count() > 0 and await show_select.input_value() != "100":
+                await waiter.on_mutation("results_per_page", "table.data-table", lambda: show_select.select_option("100"))
+
+            for name in ("filter_tourn[]", "filter_season[]", "filter_home[]"):
+                await page.locator(f'input[name="{name}"]').first.wait_for(timeout=10000, state='attached')
+
+            # 1. Tournament Type Filter
+            tournament_choice = filters.get('tournament_type', 's').lower().strip()
+            if tournament_choice in ['l', 'c', 'b']:
+                if tournament_choice == 'l':
+                    await self._ensure_unchecked(waiter, page.locator('input[name="filter_tourn[]"][value="2"]'), "Cups")
+                elif tournament_choice == 'c':
+                    await self._ensure_unchecked(waiter, page.locator('input[name="filter_tourn[]"][value="1"]'), "League")
+
+            # 2. Season Filter
+            season_choice = filters.get('seasons', 'skip')
+            if isinstance(season_choice, list) and season_choice:
+                season_checkboxes = page.locator('input[name="filter_season[]"]')
+                seasons_available = []
+                for i in range(await season_checkboxes.count()):
+                    checkbox = season_checkboxes.nth(i)
+                    value = await checkbox.get_attribute('value')
+                    label_span = checkbox.locator('xpath=following-sibling::span[@class="label-name"]')
+                    label = (await label_span.text_content()).strip() if await label_span.count() > 0 else f"Season {value}"
+                    seasons_available.append((value, label))
+                try:
+                    await self._ensure_unchecked(waiter, page.locator('input.filter_quick_all_seasons'), "'Select All' seasons")
+                    for season_value, _ in seasons_available:
+                        season_checkbox = page.locator(f'input[name="filter_season[]"][value="{season_value}"]')
+                        try:
+                            if await season_checkbox.is_checked(timeout=1500):
+                                await waiter.on_mutation("filter_applied", "table.data-table", season_checkbox.uncheck)
+                        except playwright._impl._errors.TimeoutError:
+                            pass
+                    selected_seasons = []
+                    for season_val_or_label in season_choice:
+                        for s_val, s_label in seasons_available:
+                            if str(season_val_or_label) == str(s_val) or str(season_val_or_label).lower() == s_label.lower():
+                                season_checkbox = page.locator(f'input[name="filter_season[]"][value="{s_val}"]')
+                                await waiter.on_mutation("filter_applied", "table.data-table", season_checkbox.check)
+                                selected_seasons.append(s_label)
+                                break
+                    print(f"   → Selected seasons: {', '.join(selected_seasons) or 'defaults'}")
+                except Exception as e:
+                    print(f"   → Error processing season selection list: {e}. Keeping defaults.")
+
+            # 3. Venue Filter
+            venue_choice = filters.get('venue', 's').lower().strip()
+            if venue_choice in ['h', 'a', 'b']:
+                if venue_choice == 'h':
+                    await self._ensure_unchecked(waiter, page.locator('input[name="filter_home[]"][value="2"]'), "Away")
+                elif venue_choice == 'a':
+                    await self._ensure_unchecked(waiter, page.locator('input[name="filter_home[]"][value="1"]'), "Home")
+
+            print("Filters configured successfully")
+            return True
+        except Exception as e:
+            print(f"Error configuring filters: {e}")
+            traceback.print_exc()
+            return False
+
+    async def _navigate_to_start_of_table(self, page):
+        """Navigate to the start of the data table by clicking Previous until disabled"""
+        try:
+            while True:
+                prev_button = page.locator("button.button_prev_table")
+                if await prev_button.count() == 0:
+                    print("Previous button not found")
+                    break
+                if "not_active" in (await prev_button.get_attribute("class") or ""):
+                    break
+                await self._waiter(page).on_mutation("table_page", "table.data-table", prev_button.click)
+            return True
+        except Exception as e:
+            print(f"Error navigating to start of table: {e}")
+            return False
+
+    async def _extract_table_data(self, page):
+        """Extract table data from current page"""
+        try:
+            table = page.locator("table.data-table")
+            await table.wait_for(timeout=10000)
+            data = await table.evaluate(EXTRACT_TABLE_JS)
+            return data["headers"], data["rows"]
+        except Exception as e:
+            print(f"Error extracting table data: {e}")
+            return [], []
+
+    async def _extract_all_table_data(self, page, known=None):
+        """Extract all table data by paginating through all pages (stopping at the first known row)"""
+        try:
+            all_headers = []
+            all_rows = []
+            page_num = 1
+            while True:
+                headers, rows_data = await self._extract_table_data(page)
+                if headers and not all_headers:
+                    all_headers = headers
+                new_rows, reached_known = cut_at_known(rows_data, known)
+                all_rows.extend(new_rows)
+                print(f"Extracted {len(new_rows)} rows from page {page_num}")
+                if new_rows:
+                    # The provisional estimate is NumPy work: keep it off the loop the other compares share
+                    await asyncio.to_thread(self._page_extracted, page_num, all_headers, new_rows)
+                if reached_known:
+                    print("Reached rows already in the match history")
+                    break
+                next_button = page.locator("button.button_next_table")
+                if await next_button.count() == 0:
+                    print("Next button not found")
+                    break
+                if "not_active" in (await next_button.get_attribute("class") or ""):
+                    print("Reached end of table")
+                    break
+                await self._waiter(page).on_mutation("table_page", "table.data-table", next_button.click)
+                page_num += 1
+            print(f"\nTotal rows extracted: {len(all_rows)}")
+            return all_headers, all_rows
+        except Exception as e:
+            print(f"Error extracting all table data: {e}")
+            return [], []
+
+    async def compare_and_calculate(self, host_team, guest_team, country_name, filters, refresh=False, calculation=None):
+        """API-facing coroutine to perform comparison and calculation"""
+        session_data = await asyncio.to_thread(self.session.load)
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
+
+        table, status_code = await self._match_table(session_data, host_team, guest_team, country_name, filters, refresh)
+        if status_code != 200:
+            return table, status_code
+        self._stage("calculating")
+        # CPU-bound work runs off the event loop so other scrapes keep progressing
+        return await asyncio.to_thread(self._build_result, host_team, guest_team, table["headers"], table["rows"], calculation,
+                                       table.get("outcome_state"))
+
+    async def compare_batch(self, fixtures, country_name, filters, refresh=False, calculation=None):
+        """API-facing coroutine to price a slate of fixtures (the engine caps concurrent scrapes)"""
+        session_data = await asyncio.to_thread(self.session.load)
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
+
+        pairs = self._unique_pairs(fixtures)
+        print(f"Batch of {len(fixtures)} fixtures needs {len(pairs)} match histories")
+        self._stage("fetching_match_histories")
+        scrapers = {key: self._fixture_scraper() for key in pairs}
+        tables = await asyncio.gather(*(
+            scrapers[key]._match_table(session_data, host_team, guest_team, country_name, filters, refresh, report=False)
+            for key, (host_team, guest_team) in pairs.items()))
+        self._stage("calculating")
+        telemetry = {key: scraper.wait_telemetry for key, scraper in scrapers.items()}
+        return await asyncio.to_thread(self._batch_results, fixtures, dict(zip(pairs, tables)), calculation, telemetry), 200
+
+    async def _match_table(self, session_data, host_team, guest_team, country_name, filters, refresh=False, report=True):
+        """Get the fixture's match-history table: ({"headers", "rows"}, 200) or (error, status)"""
+        stage = self._stage if report else (lambda name: None)
+        stage("match_history")
+        # Match-history reads and writes hit SQLite, so they run off the event loop
+        entry = await asyncio.to_thread(self._history_entry, host_team, guest_team, filters, refresh)
+        if entry and entry["fresh"]:
+            return await asyncio.to_thread(self._stored_table, host_team, guest_team, filters, entry), 200
+
+        try:
+            stage("waiting_for_browser")
+            if report:
+                self._start_pages(entry)
+            # Starts at the team search: the page is already on the compare form
+            async with self.engine.compare_page(session_data, self.url) as page:
+                resources = get_request_filter().track(page.context)
+                if not await self._is_logged_in(page):
+                     return {"error": "Session invalid or expired. Please log in again."}, 401
+
+                stage("entering_teams")
+                if not await self._enter_teams_in_compare_form(page, host_team, guest_team, country_name):
+                    return {"error": "Failed to enter teams in compare form"}, 500
+                stage("teams_resolved")
+                stage("configuring_filters")
+                if not await self._configure_filters(page, filters):
+                    return {"error": "Failed to configure filters"}, 500
+                stage("filters_applied")
+                if not await self._navigate_to_start_of_table(page):
+                    return {"error": "Failed to navigate to start of table"}, 500
+
+                stage("extracting_table")
+                headers, new_rows = await self._extract_all_table_data(page, get_match_history().known_row_test(entry))
+            print(f"Requests blocked: {resources.summary()}")
+
+            if not headers or not (new_rows or entry):
+                return {"error": "No data extracted from table"}, 404
+
+            return await asyncio.to_thread(self._update_history, host_team, guest_team, filters, headers, new_rows, entry), 200
+
+        except Exception as e:
+            print(f"Error in async compare_and_calculate: {e}")
+            traceback.print_exc()
+            return {"error": f"Scraping/calculation failed: {str(e)}"}, 500
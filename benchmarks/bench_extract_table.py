@@ -0,0 +1,96 @@
+"""Per-page table extraction time: per-cell locator walk vs one in-page evaluation.
+
+Renders a synthetic 100-row table.data-table shaped like the compare page
+(hidden header, td__exclude/td__details cells, linked team names) and times both
+extraction strategies on it.
+
+Usage: python benchmarks/bench_extract_table.py [--rows 100] [--repeat 5] [--channel msedge]
+"""
+import argparse, os, statistics, sys, time
+from playwright.sync_api import sync_playwright
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scraper import EXTRACT_TABLE_JS
+
+def build_table_html(n_rows):
+    header = ("<thead><tr><th>Date</th><th>Tournament</th><th>Round</th><th>Team1</th>"
+              "<th>T1_Stats</th><th>T2_Stats</th><th>Team2</th><th>Win</th><th>Draw</th>"
+              "<th>Loss</th><th style=\"display:none\">Hidden</th></tr></thead>")
+    rows = []
+    for i in range(n_rows):
+        rows.append(
+            f"<tr class=\"tr__main\"><td>{(i % 28) + 1:02d}/01/2024</td><td><a href=\"#\">League</a></td>"
+            f"<td>{i % 30}</td><td><a href=\"#\">Home {i}</a></td><td>{i % 9}</td><td>{i % 7}</td>"
+            f"<td><a href=\"#\">Away {i}</a></td><td>{1.5 + i % 5 / 10:.2f}</td><td>3.40</td><td>4.10</td>"
+            f"<td class=\"td__exclude\">x</td><td class=\"td__details\"><a href=\"#\">more</a></td></tr>"
+            f"<tr class=\"tr__details\"><td colspan=\"12\">details</td></tr>")
+    return f"<table class=\"data-table\">{header}<tbody class=\"tableData\">{''.join(rows)}</tbody></table>"
+
+def extract_with_locators(page):
+    """The previous implementation: one IPC round trip per count/attribute/text call"""
+    table = page.locator("table.data-table")
+    headers = []
+    header_cells = table.locator("thead tr").first.locator("th")
+    for i in range(header_cells.count()):
+        cell = header_cells.nth(i)
+        if "display:none" not in (cell.get_attribute("style") or ""):
+            headers.append(cell.text_content().strip())
+    rows_data = []
+    data_rows = table.locator("tbody.tableData").locator("tr.tr__main")
+    for i in range(data_rows.count()):
+        cells = data_rows.nth(i).locator("td")
+        row_data = []
+        for j in range(cells.count()):
+            cell = cells.nth(j)
+            cell_class = cell.get_attribute("class") or ""
+            if "td__exclude" not in cell_class and "td__details" not in cell_class:
+                if cell.locator("a").count() > 0:
+                    row_data.append(cell.locator("a").first.text_content().strip())
+                else:
+                    row_data.append(cell.text_content().strip())
+        if row_data:
+            rows_data.append(row_data)
+    return headers, rows_data
+
+def extract_with_evaluate(page):
+    data = page.locator("table.data-table").evaluate(EXTRACT_TABLE_JS)
+    return data["headers"], data["rows"]
+
+def time_it(fn, page, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(page)
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--channel", default=os.environ.get("BROWSER_CHANNEL"))
+    args = parser.parse_args()
+
+    with sync_playwright() as p:
+        launch_args = {"headless": True}
+        if args.channel:
+            launch_args["channel"] = args.channel
+        browser = p.chromium.launch(**launch_args)
+        page = browser.new_page()
+        page.set_content(build_table_html(args.rows))
+
+        old_result, old_times = time_it(extract_with_locators, page, args.repeat)
+        new_result, new_times = time_it(extract_with_evaluate, page, args.repeat)
+        browser.close()
+
+    assert old_result == new_result, "Extraction strategies disagree"
+    old_median = statistics.median(old_times)
+    new_median = statistics.median(new_times)
+    print(f"Rows per page: {args.rows}, repeats: {args.repeat}")
+    print(f"Locator walk:     median {old_median * 1000:9.1f} ms")
+    print(f"Single evaluate:  median {new_median * 1000:9.1f} ms")
+    print(f"Speed-up:         {old_median / new_median:9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""1X2 probability calculation: previous pandas column pipeline vs the NumPy kernel.
+
+Builds synthetic match histories of several sizes (with some unparseable dates and
+missing odds, like scraped tables have) and reports median latency and peak traced
+memory for the previous DataFrame implementation, the current pandas adapter plus
+kernel, and the kernel alone on prepared float64 arrays.
+
+Usage: python benchmarks/bench_probability_kernel.py [--sizes 100,10000,200000] [--repeat 5]
+"""
+import argparse, os, statistics, sys, time, tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from probability import date_ordinals, outcome_probabilities
+
+def build_history(n_rows, seed=0):
+    """Distinct match days (shuffled) so that both implementations agree on the recency order"""
+    rng = np.random.default_rng(seed)
+    days = pd.Timestamp("1680-01-01") + pd.to_timedelta(rng.permutation(n_rows), unit="D")
+    dates = days.strftime("%d/%m/%Y").to_numpy(dtype=object)
+    dates[rng.random(n_rows) < 0.01] = "-"
+    win = np.round(rng.uniform(1.2, 6.0, n_rows), 2)
+    win[rng.random(n_rows) < 0.01] = np.nan
+    return pd.DataFrame({"Date": dates, "Win": win,
+                         "Draw": np.round(rng.uniform(2.8, 4.5, n_rows), 2),
+                         "Loss": np.round(rng.uniform(1.2, 8.0, n_rows), 2)})
+
+def legacy_probabilities(df):
+    """The previous implementation: copies plus ten derived columns"""
+    df = df.copy()
+    df['Date'] = pd.to_datetime(df['Date'], format='%d/%m/%Y', errors='coerce')
+    df = df.dropna(subset=['Date']).sort_values('Date').reset_index(drop=True)
+    df['host_win_odds'] = pd.to_numeric(df['Win'], errors='coerce')
+    df['guest_win_odds'] = pd.to_numeric(df['Loss'], errors='coerce')
+    df['draw_odds'] = pd.to_numeric(df['Draw'], errors='coerce')
+    valid = df[(df['host_win_odds'] > 0) & (df['guest_win_odds'] > 0) & (df['draw_odds'] > 0)].copy()
+    valid['inv_host_win'] = 1 / valid['host_win_odds']
+    valid['inv_guest_win'] = 1 / valid['guest_win_odds']
+    valid['inv_draw'] = 1 / valid['draw_odds']
+    valid['total_inv'] = valid['inv_host_win'] + valid['inv_guest_win'] + valid['inv_draw']
+    valid['p_host_win'] = valid['inv_host_win'] / valid['total_inv']
+    valid['p_guest_win'] = valid['inv_guest_win'] / valid['total_inv']
+    valid['p_draw'] = valid['inv_draw'] / valid['total_inv']
+    valid = valid.sort_values('Date', ascending=False, kind='stable')
+    valid['weight'] = np.exp(-0.15 * np.arange(len(valid)))
+    total_weight = valid['weight'].sum()
+    probs = np.array([(valid['p_host_win'] * valid['weight']).sum(), (valid['p_draw'] * valid['weight']).sum(),
+                      (valid['p_guest_win'] * valid['weight']).sum()]) / total_weight
+    probs /= probs.sum()
+    win_std = valid['p_host_win'].std()
+    confidence = max(0.3, 1 - win_std) if not pd.isna(win_std) else 0.5
+    adjusted = probs * confidence + (1 / 3) * (1 - confidence)
+    return adjusted / adjusted.sum()
+
+def to_arrays(df):
+    """The pandas input adapter used by _calculate_win_probability"""
+    return (pd.to_numeric(df['Win'], errors='coerce').to_numpy(dtype=np.float64),
+            pd.to_numeric(df['Draw'], errors='coerce').to_numpy(dtype=np.float64),
+            pd.to_numeric(df['Loss'], errors='coerce').to_numpy(dtype=np.float64),
+            date_ordinals(df['Date'].to_numpy()))
+
+def kernel_probabilities(arrays):
+    result = outcome_probabilities(*arrays)
+    return np.array([result["host_win"], result["draw"], result["guest_win"]])
+
+def measure(fn, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arg)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, statistics.median(timings), peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,10000,200000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'variant':<18} {'median ms':>10} {'peak MiB':>9}")
+    for n_rows in (int(n) for n in args.sizes.split(",")):
+        df = build_history(n_rows)
+        arrays = to_arrays(df)
+        variants = [
+            ("pandas columns", legacy_probabilities, df),
+            ("adapter + kernel", lambda d: kernel_probabilities(to_arrays(d)), df),
+            ("kernel only", kernel_probabilities, arrays),
+        ]
+        results = []
+        for name, fn, arg in variants:
+            result, median, peak = measure(fn, arg, args.repeat)
+            results.append(result)
+            print(f"{n_rows:>9} {name:<18} {median * 1000:>10.2f} {peak / 2**20:>9.2f}")
+        assert all(np.allclose(results[0], r, rtol=0, atol=1e-12) for r in results[1:]), "Variants disagree"
+
+if __name__ == "__main__":
+    main()
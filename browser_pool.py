@@ -0,0 +1,427 @@
+import os, queue, threading, time
+from concurrent.futures import Future
+from playwright.sync_api import sync_playwright
+from resource_filter import LEAN_LAUNCH_ARGS, LEAN_CONTEXT_OPTIONS, get_request_filter
+
+BASE_URL = "https://corner-stats.com"
+COMPARE_FORM = "form#match-form_1"
+# Sets the results-per-page select to 100 ahead of the compare, if the page has it;
+# true if it had to change it
+PRESET_RESULTS_JS = """
+() => {
+    const select = document.querySelector('select.show_results');
+    if (!select || select.value === '100') return false;
+    select.value = '100';
+    select.dispatchEvent(new Event('change', {bubbles: true}));
+    return true;
+}
+"""
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+class BrowserPoolTimeout(Exception):
+    """Raised when no browser could be borrowed within the acquire timeout"""
+
+class _BrowserSlot:
+    """One warm browser owned by a dedicated thread.
+
+    Sync Playwright objects may only be used from the thread that created them,
+    so every job borrowed from this slot is executed on the slot's own thread.
+    """
+    def __init__(self, pool, slot_id):
+        self.pool = pool
+        self.slot_id = slot_id
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.session_stamp = None # (email, timestamp) of the session applied to the context
+        self.positioned = False # Page is on the compare form, untouched since
+        self.uses = 0
+        self.launched_at = None
+        self.broken = False
+        self._playwright = None
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=f"browser-slot-{slot_id}", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._jobs.put((fn, args, future))
+        return future
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def _loop(self):
+        with sync_playwright() as p:
+            self._playwright = p
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                fn, args, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            self._close_browser()
+
+    # --- Lifecycle helpers, always called on the slot thread ---
+    def _launch(self):
+        launch_args = {"headless": self.pool.headless, "args": LEAN_LAUNCH_ARGS}
+        if self.pool.channel:
+            launch_args["channel"] = self.pool.channel
+        self.browser = self._playwright.chromium.launch(**launch_args)
+        self.context = self.browser.new_context(**LEAN_CONTEXT_OPTIONS)
+        # Scrapes only load what extraction needs (see resource_filter.py); login() lifts the filter
+        # for its own duration so third-party login scripts (captcha, consent, SSO) still load
+        get_request_filter().install(self.context)
+        self.page = self.context.new_page()
+        self.session_stamp = None
+        self.positioned = False
+        self.uses = 0
+        self.broken = False
+        self.launched_at = time.monotonic()
+        self.pool._count("launches")
+        print(f"Browser slot {self.slot_id}: launched")
+
+    def _close_browser(self):
+        try:
+            if self.browser is not None:
+                self.browser.close()
+        except Exception as e:
+            print(f"Browser slot {self.slot_id}: error while closing browser: {e}")
+        self.browser = self.context = self.page = None
+        self.positioned = False
+
+    def _is_healthy(self):
+        try:
+            return (self.browser.is_connected()
+                    and not self.page.is_closed()
+                    and self.page.evaluate("1") == 1)
+        except Exception:
+            return False
+
+    def _needs_recycle(self):
+        if self.pool.max_uses and self.uses >= self.pool.max_uses:
+            return True
+        if self.pool.max_age and time.monotonic() - self.launched_at >= self.pool.max_age:
+            return True
+        return False
+
+    def _park(self):
+        """Put the slot page on the home page's compare form so the next borrower starts at the team search"""
+        self.positioned = False
+        self.page.goto(self.pool.url)
+        try:
+            self.page.locator(COMPARE_FORM).wait_for(state="attached", timeout=self.pool.position_timeout)
+        except Exception:
+            # Still usable: the borrower waits for the form itself
+            print(f"Browser slot {self.slot_id}: compare form did not show up after navigation")
+            return
+        time.sleep(self.pool.settle_delay)
+        self.page.evaluate(PRESET_RESULTS_JS)
+        self.positioned = True
+
+    def prepare(self, session_data=None):
+        """Ensure the browser is live, fresh enough and carries the given session"""
+        if self.browser is None:
+            self._launch()
+        elif self.broken or self._needs_recycle():
+            self._close_browser()
+            self._launch()
+            self.pool._count("recycles")
+        elif self.pool.health_check and not self._is_healthy():
+            print(f"Browser slot {self.slot_id}: health check failed, relaunching")
+            self.pool._count("health_failures")
+            self._close_browser()
+            self._launch()
+
+        if session_data:
+            stamp = (session_data.get("email"), session_data.get("timestamp"))
+            if stamp != self.session_stamp:
+                self.context.clear_cookies()
+                if "cookies" in session_data:
+                    self.context.add_cookies(session_data["cookies"])
+                if "headers" in session_data:
+                    self.page.set_extra_http_headers(session_data["headers"])
+                self._park()
+                self.session_stamp = stamp
+        return self.page
+
+    def execute(self, fn, session_data=None, fresh_context=False):
+        """Run fn(page) on this slot; reset() puts the page back afterwards"""
+        page = self.prepare(session_data)
+        self.uses += 1
+        if not fresh_context:
+            self.pool._count("positioned_hits" if self.positioned else "positioned_misses")
+            self.positioned = False
+            return fn(page)
+        # Throwaway context on the warm browser (e.g. for logging in)
+        context = self.browser.new_context()
+        try:
+            return fn(context.new_page())
+        finally:
+            context.close()
+
+    def login(self, fn):
+        """Run fn(page) -> (logged_in, session_data) in the slot's context from an empty cookie jar,
+        with request filtering lifted; on success the slot carries that session (reset() then parks it)"""
+        self.prepare()
+        self.uses += 1
+        self.positioned = False
+        self.session_stamp = None
+        self.context.clear_cookies()
+        with get_request_filter().unfiltered(self.context):
+            logged_in, session_data = fn(self.page)
+        if logged_in and session_data:
+            self.session_stamp = (session_data.get("email"), session_data.get("timestamp"))
+        return logged_in
+
+    def reset(self):
+        """Put a used page back on the compare form, then go idle"""
+        try:
+            if not self.positioned:
+                start = time.monotonic()
+                self._park()
+                self.pool._count("reset_seconds_total", time.monotonic() - start)
+        except Exception as e:
+            print(f"Browser slot {self.slot_id}: failed to reset page: {e}")
+            self.broken = True
+        finally:
+            self.pool._release(self)
+
+class BrowserPool:
+    """Process-wide pool of already-launched browsers with pre-authenticated contexts.
+
+    Requests borrow a slot with ``run(fn, session_data)``; ``fn`` receives a page
+    that is already on the home page's compare form with the session cookies applied
+    and the results per page preset to 100. After fn returns, the page is reset to
+    the compare form on the slot's thread while the caller already has its result.
+    Settings default to the BROWSER_POOL_* environment variables.
+    """
+    def __init__(self, size=None, max_uses=None, max_age=None, health_check=None,
+                 acquire_timeout=None, headless=None, channel=None, url=BASE_URL, settle_delay=0,
+                 position_timeout=None):
+        self.size = size if size is not None else _env_int("BROWSER_POOL_SIZE", 2)
+        self.max_uses = max_uses if max_uses is not None else _env_int("BROWSER_POOL_MAX_USES", 50)
+        self.max_age = max_age if max_age is not None else _env_int("BROWSER_POOL_MAX_AGE", 1800)
+        self.health_check = health_check if health_check is not None else _env_bool("BROWSER_POOL_HEALTH_CHECK", True)
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else _env_int("BROWSER_POOL_ACQUIRE_TIMEOUT", 120)
+        self.headless = headless if headless is not None else _env_bool("BROWSER_HEADLESS", True)
+        self.channel = channel if channel is not None else os.environ.get("BROWSER_CHANNEL", "msedge")
+        self.url = url
+        self.settle_delay = settle_delay
+        self.position_timeout = position_timeout if position_timeout is not None else _env_int("BROWSER_POOL_POSITION_TIMEOUT", 10000)
+        self._slots = []
+        self._idle = [] # Idle slots, most recently used last: the warmest browser is reused first
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._parked_users = set() # Users whose parked pages should not be handed to others
+        self._closed = False
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "affinity_hits": 0,
+            "parks": 0,
+            "positioned_hits": 0,
+            "positioned_misses": 0,
+            "reset_seconds_total": 0.0,
+            "launches": 0,
+            "recycles": 0,
+            "health_failures": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._metrics[key] += amount
+
+    def _release(self, slot):
+        if self._closed:
+            slot.stop()
+        else:
+            with self._available:
+                self._idle.append(slot)
+                self._available.notify()
+
+    @staticmethod
+    def _slot_user(slot):
+        return (slot.session_stamp[0] or "").strip().lower() if slot.session_stamp else None
+
+    def _pick_idle(self, user=None, spare_only=False):
+        """Pop an idle slot (lock held): one already carrying user's session, else the most
+        recently used one not parked for another user. None if there is none to take."""
+        if user:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._slot_user(self._idle[i]) == user:
+                    self._metrics["affinity_hits"] += 1
+                    return self._idle.pop(i)
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._slot_user(self._idle[i]) not in self._parked_users:
+                return self._idle.pop(i)
+        if self._idle and not spare_only:
+            return self._idle.pop()
+        return None
+
+    def _new_slot(self):
+        """Add a slot if the pool is not full yet (lock held)"""
+        if len(self._slots) >= self.size:
+            return None
+        slot = _BrowserSlot(self, len(self._slots) + 1)
+        self._slots.append(slot)
+        return slot
+
+    def _acquire(self, user=None):
+        start = time.monotonic()
+        hit = True
+        with self._available:
+            slot = self._pick_idle(user)
+            if slot is None:
+                hit = False
+                slot = self._new_slot()
+            deadline = start + self.acquire_timeout
+            while slot is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise BrowserPoolTimeout(f"No browser available after {self.acquire_timeout}s")
+                self._available.wait(remaining)
+                slot = self._pick_idle(user)
+            waited = time.monotonic() - start
+            self._metrics["hits" if hit else "misses"] += 1
+            self._metrics["wait_seconds_total"] += waited
+            self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], waited)
+        return slot
+
+    def run(self, fn, session_data=None, fresh_context=False):
+        """Borrow a browser, run fn(page) on it and return the result.
+
+        Exceptions raised by fn are re-raised in the caller's thread. A slot already
+        carrying session_data's user is preferred, so that user's parked page is reused.
+        With fresh_context=True fn gets a page in a new, empty context on the warm browser.
+        """
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        user = (session_data.get("email") or "").strip().lower() if session_data and not fresh_context else None
+        slot = self._acquire(user)
+        future = slot.submit(slot.execute, fn, session_data, fresh_context)
+        # Queued behind fn on the slot thread: the caller does not wait for the reset
+        slot.submit(slot.reset)
+        return future.result()
+
+    def login(self, fn, email):
+        """Log a user in on a slot (theirs if they have one) and keep the logged-in page parked there.
+
+        fn(page) -> (logged_in, session_data) drives the login form; returns logged_in.
+        """
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        slot = self._acquire((email or "").strip().lower())
+        future = slot.submit(slot.login, fn)
+        slot.submit(slot.reset)
+        return future.result()
+
+    def set_parked_users(self, emails):
+        """Users whose parked pages other users' requests should leave alone while possible"""
+        with self._lock:
+            self._parked_users = {(e or "").strip().lower() for e in emails}
+
+    def park(self, session_data):
+        """Have a spare slot carry session_data's session, parked on the home page (compare form).
+
+        Non-blocking; returns False if the user already has a slot or none is spare.
+        """
+        if self._closed:
+            return False
+        stamp = (session_data.get("email"), session_data.get("timestamp"))
+        with self._available:
+            if any(slot.session_stamp == stamp for slot in self._slots):
+                return False
+            # The user's own slot (carrying an older login) first, then a spare one
+            user = (stamp[0] or "").strip().lower()
+            slot = self._pick_idle(user, spare_only=True) or self._new_slot()
+            if slot is None:
+                return False
+            self._metrics["parks"] += 1
+        future = slot.submit(slot.prepare, session_data)
+        future.add_done_callback(lambda f, s=slot: self._after_warm(f, s))
+        return True
+
+    def warm(self, session_data=None):
+        """Launch every slot up front (non-blocking) so the first requests are hits"""
+        with self._lock:
+            new_slots = []
+            while len(self._slots) < self.size:
+                slot = _BrowserSlot(self, len(self._slots) + 1)
+                self._slots.append(slot)
+                new_slots.append(slot)
+        for slot in new_slots:
+            future = slot.submit(slot.prepare, session_data)
+            future.add_done_callback(lambda f, s=slot: self._after_warm(f, s))
+
+    def _after_warm(self, future, slot):
+        if future.exception() is not None:
+            print(f"Browser slot {slot.slot_id}: warm-up failed: {future.exception()}")
+            slot.broken = True
+        self._release(slot)
+
+    def stats(self):
+        """Snapshot of pool configuration and hit/miss/wait metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            size = len(self._slots)
+            idle = len(self._idle)
+            parked = sorted({self._slot_user(slot) for slot in self._slots} & self._parked_users)
+        borrows = metrics["hits"] + metrics["misses"]
+        positioned = metrics["positioned_hits"] + metrics["positioned_misses"]
+        metrics.update({
+            "configured_size": self.size,
+            "launched_slots": size,
+            "idle_slots": idle,
+            "in_use_slots": size - idle,
+            "parked_users": len(parked),
+            "hit_rate": round(metrics["hits"] / borrows, 4) if borrows else None,
+            "wait_seconds_avg": round(metrics["wait_seconds_total"] / borrows, 4) if borrows else None,
+            "positioned_rate": round(metrics["positioned_hits"] / positioned, 4) if positioned else None,
+            "max_uses": self.max_uses,
+            "max_age": self.max_age,
+            "health_check": self.health_check,
+        })
+        metrics["wait_seconds_total"] = round(metrics["wait_seconds_total"], 4)
+        metrics["wait_seconds_max"] = round(metrics["wait_seconds_max"], 4)
+        metrics["reset_seconds_total"] = round(metrics["reset_seconds_total"], 4)
+        return metrics
+
+    def close(self):
+        """Stop all slots; browsers are closed on their own threads"""
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for slot in idle:
+            slot.stop()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    """Return the process-wide browser pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
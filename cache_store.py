@@ -0,0 +1,598 @@
+import json, os, sqlite3, threading, time, traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from xhr_client import merge_pages
+
+DATA_DIR = os.environ.get("CORNER_STATS_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+class _SqliteStore:
+    """Small base for the local SQLite stores: one short-lived connection per operation"""
+    filename = None
+    schema = ""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, self.filename)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.schema)
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+class CatalogCache(_SqliteStore):
+    """Persistent cache of the country/league/team catalog with per-entry TTL.
+
+    ``fetch`` serves fresh entries straight from SQLite, serves stale ones while a
+    background refresh runs, and only blocks on the scraper for misses or when a
+    refresh is forced.
+    """
+    filename = "catalog.sqlite3"
+    schema = """
+        CREATE TABLE IF NOT EXISTS catalog (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            ttl REAL NOT NULL
+        );
+    """
+    # Default TTLs in seconds per key kind; CATALOG_TTL overrides them all
+    DEFAULT_TTLS = {"countries": 7 * 86400, "leagues": 86400, "teams": 86400, "leagues_teams": 86400}
+
+    def __init__(self, path=None, ttl=None):
+        super().__init__(path)
+        env_ttl = os.environ.get("CATALOG_TTL")
+        self.ttl = ttl if ttl is not None else (float(env_ttl) if env_ttl else None)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "forced_refreshes": 0,
+                       "background_refreshes": 0, "refresh_failures": 0}
+
+    # --- Keys ---
+    @staticmethod
+    def countries_key():
+        return "countries"
+
+    @staticmethod
+    def leagues_key(country_name):
+        return f"leagues:{country_name.strip().lower()}"
+
+    @staticmethod
+    def teams_key(country_name, league_id):
+        return f"teams:{country_name.strip().lower()}:{league_id}"
+
+    @staticmethod
+    def leagues_teams_key(country_name):
+        return f"leagues_teams:{country_name.strip().lower()}"
+
+    def _ttl_for(self, key):
+        if self.ttl is not None:
+            return self.ttl
+        return self.DEFAULT_TTLS.get(key.split(":", 1)[0], 86400)
+
+    # --- Storage ---
+    def get(self, key):
+        """Return (value, age_seconds, stale) or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, fetched_at, ttl FROM catalog WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row["fetched_at"]
+        return json.loads(row["value"]), age, age > row["ttl"]
+
+    def put(self, key, value, ttl=None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog (key, value, fetched_at, ttl) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), time.time(), ttl if ttl is not None else self._ttl_for(key)))
+
+    def fill_from_leagues_and_teams(self, country_name, data):
+        """A full country crawl also answers the finer-grained leagues/teams lookups"""
+        self.put(self.leagues_teams_key(country_name), data)
+        self.put(self.leagues_key(country_name), {
+            "country": data["country"],
+            "leagues": [{"id": l["id"], "name": l["name"]} for l in data.get("leagues", [])],
+        })
+        for league in data.get("leagues", []):
+            self.put(self.teams_key(country_name, league["id"]), {
+                "country": data["country"], "league_id": str(league["id"]), "teams": league.get("teams", []),
+            })
+
+    # --- Read-through ---
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _load(self, key, loader, on_success):
+        data, status_code = loader()
+        if status_code == 200:
+            if on_success:
+                on_success(data)
+            else:
+                self.put(key, data)
+        return data, status_code
+
+    def _refresh_in_background(self, key, loader, on_success):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                _, status_code = self._load(key, loader, on_success)
+                if status_code != 200:
+                    self._count("refresh_failures")
+            except Exception as e:
+                print(f"Background catalog refresh failed for {key}: {e}")
+                traceback.print_exc()
+                self._count("refresh_failures")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._count("background_refreshes")
+        threading.Thread(target=refresh, name=f"catalog-refresh-{key}", daemon=True).start()
+
+    def fetch(self, key, loader, refresh=False, on_success=None):
+        """Serve key from the cache, calling loader() -> (data, status) when needed.
+
+        Returns (data, status_code, cache_info) where cache_info reports whether the
+        answer came from the cache and how old it is. on_success(data) replaces the
+        default put() so one load can fill several entries.
+        """
+        cached = None if refresh else self.get(key)
+        if cached is not None:
+            value, age, stale = cached
+            if stale:
+                self._count("stale_hits")
+                self._refresh_in_background(key, loader, on_success)
+            else:
+                self._count("hits")
+            return value, 200, {"hit": True, "stale": stale, "age_seconds": round(age, 1)}
+
+        self._count("forced_refreshes" if refresh else "misses")
+        data, status_code = self._load(key, loader, on_success)
+        return data, status_code, {"hit": False, "stale": False, "age_seconds": 0.0}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        served = stats["hits"] + stats["stale_hits"] + stats["misses"] + stats["forced_refreshes"]
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n, MIN(fetched_at) AS oldest, MAX(fetched_at) AS newest FROM catalog").fetchone()
+        now = time.time()
+        stats.update({
+            "hit_rate": round((stats["hits"] + stats["stale_hits"]) / served, 4) if served else None,
+            "entries": row["n"],
+            "oldest_entry_age_seconds": round(now - row["oldest"], 1) if row["oldest"] else None,
+            "newest_entry_age_seconds": round(now - row["newest"], 1) if row["newest"] else None,
+        })
+        return stats
+
+DATE_FORMATS = ("%d/%m/%Y", "%d.%m.%Y", "%Y-%m-%d", "%d/%m/%y", "%d.%m.%y")
+
+def parse_match_date(value):
+    """Parse a table Date cell; None if it is in none of the site's formats"""
+    value = (value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _date_index(headers):
+    return headers.index("Date") if "Date" in headers else 0
+
+class MatchHistoryStore(_SqliteStore):
+    """Scraped compare-table rows per (host id, guest id, tournament_type, seasons, venue).
+
+    Entries younger than the TTL answer a repeat prediction without any scraping;
+    older ones are topped up with a delta scrape that stops at the first stored row.
+    Each entry also keeps the incremental outcome estimator state (probability.outcome_state)
+    for its rows, so a prediction never has to reprocess the whole history.
+    """
+    filename = "match_history.sqlite3"
+    schema = """
+        CREATE TABLE IF NOT EXISTS history (
+            key TEXT PRIMARY KEY,
+            host_id TEXT NOT NULL,
+            guest_id TEXT NOT NULL,
+            tournament_type TEXT NOT NULL,
+            seasons TEXT NOT NULL,
+            venue TEXT NOT NULL,
+            headers TEXT NOT NULL,
+            rows TEXT NOT NULL,
+            latest_date TEXT,
+            fetched_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS outcome_state (
+            key TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            rows INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path=None, ttl=None):
+        super().__init__(path)
+        self.ttl = ttl if ttl is not None else float(os.environ.get("MATCH_HISTORY_TTL", 3600))
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "delta_refreshes": 0, "full_scrapes": 0,
+                       "rows_reused": 0, "rows_fetched": 0, "estimates_extended": 0, "estimates_rebuilt": 0}
+
+    @staticmethod
+    def key_parts(host_id, guest_id, filters):
+        """The filter values that change which rows the compare table shows (defaults as in _configure_filters)"""
+        filters = filters or {}
+        return (
+            str(host_id),
+            str(guest_id),
+            str(filters.get("tournament_type", "s")).lower().strip(),
+            json.dumps(filters.get("seasons", "skip"), sort_keys=True),
+            str(filters.get("venue", "s")).lower().strip(),
+        )
+
+    def history_key(self, host_id, guest_id, filters):
+        return "|".join(self.key_parts(host_id, guest_id, filters))
+
+    def get(self, host_id, guest_id, filters):
+        """Return the stored entry as a dict (headers, rows, latest_date, age_seconds, fresh,
+        outcome_state) or None; outcome_state is None unless it covers exactly the stored rows"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT h.headers, h.rows, h.latest_date, h.fetched_at, s.state, s.rows AS state_rows "
+                "FROM history h LEFT JOIN outcome_state s ON s.key = h.key WHERE h.key = ?",
+                (self.history_key(host_id, guest_id, filters),)).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row["fetched_at"]
+        rows = json.loads(row["rows"])
+        return {
+            "headers": json.loads(row["headers"]),
+            "rows": rows,
+            "latest_date": row["latest_date"],
+            "age_seconds": round(age, 1),
+            "fresh": age <= self.ttl,
+            "outcome_state": json.loads(row["state"]) if row["state"] and row["state_rows"] == len(rows) else None,
+        }
+
+    def put_outcome_state(self, host_id, guest_id, filters, state, rows, extended=False):
+        """Store the outcome estimator state covering the entry's rows (rows = how many);
+        extended says whether it was updated incrementally or rebuilt from every row"""
+        self._count("estimates_extended" if extended else "estimates_rebuilt")
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO outcome_state (key, state, rows) VALUES (?, ?, ?)",
+                         (self.history_key(host_id, guest_id, filters), json.dumps(state), rows))
+
+    def put(self, host_id, guest_id, filters, headers, rows):
+        index = _date_index(headers)
+        dates = [d for d in (parse_match_date(r[index]) for r in rows if len(r) > index) if d is not None]
+        latest = max(dates).strftime("%Y-%m-%d") if dates else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO history (key, host_id, guest_id, tournament_type, seasons, venue, "
+                "headers, rows, latest_date, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.history_key(host_id, guest_id, filters), *self.key_parts(host_id, guest_id, filters),
+                 json.dumps(headers), json.dumps(rows), latest, time.time()))
+
+    @staticmethod
+    def known_row_test(entry):
+        """Return known(row) for a delta scrape of entry, or None for a full scrape.
+
+        A row is known if it is stored already or played before the latest stored date.
+        """
+        if not entry:
+            return None
+        stored = {tuple(r) for r in entry["rows"]}
+        index = _date_index(entry["headers"])
+        latest = datetime.strptime(entry["latest_date"], "%Y-%m-%d") if entry["latest_date"] else None
+
+        def known(row):
+            if tuple(row) in stored:
+                return True
+            played = parse_match_date(row[index]) if len(row) > index else None
+            return latest is not None and played is not None and played < latest
+        return known
+
+    def update(self, host_id, guest_id, filters, headers, new_rows, entry=None):
+        """Store a scrape (full, or a delta on top of entry) and return (headers, all_rows)"""
+        if entry and entry["headers"] == headers:
+            all_rows = merge_pages([new_rows, entry["rows"]])
+            self._count("delta_refreshes")
+            self._count("rows_reused", len(all_rows) - len(new_rows))
+        else:
+            if entry:
+                print("Match history headers changed, replacing the stored rows")
+            all_rows = new_rows
+            self._count("full_scrapes")
+        self._count("rows_fetched", len(new_rows))
+        if headers and all_rows:
+            self.put(host_id, guest_id, filters, headers, all_rows)
+        return headers, all_rows
+
+    def record_hit(self, entry):
+        self._count("hits")
+        self._count("rows_reused", len(entry["rows"]))
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n FROM history").fetchone()
+        stats["entries"] = row["n"]
+        return stats
+
+class TeamIndex(_SqliteStore):
+    """Remembers which compare-form search picked each team, so later compares type
+    that exact query and click that exact result instead of searching by trial."""
+    filename = "team_index.sqlite3"
+    schema = """
+        CREATE TABLE IF NOT EXISTS team_index (
+            country TEXT NOT NULL,
+            name TEXT NOT NULL,
+            team_id TEXT,
+            query TEXT NOT NULL,
+            result_text TEXT NOT NULL,
+            resolved_at REAL NOT NULL,
+            PRIMARY KEY (country, name)
+        );
+        CREATE INDEX IF NOT EXISTS team_index_id ON team_index (team_id);
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    @staticmethod
+    def _norm(value):
+        return (value or "").strip().lower()
+
+    def lookup(self, team, country_name):
+        """Return {"query", "result_text"} for team ({'id', 'name'}) or None; counts a hit or miss"""
+        with self._connect() as conn:
+            row = None
+            if team.get("id"):
+                row = conn.execute("SELECT query, result_text FROM team_index WHERE team_id = ? AND country = ?",
+                                   (str(team["id"]), self._norm(country_name))).fetchone()
+            if row is None:
+                row = conn.execute("SELECT query, result_text FROM team_index WHERE country = ? AND name = ?",
+                                   (self._norm(country_name), self._norm(team.get("name")))).fetchone()
+        self._count("hits" if row else "misses")
+        return dict(row) if row else None
+
+    def remember(self, team, country_name, query, result_text):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO team_index (country, name, team_id, query, result_text, resolved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self._norm(country_name), self._norm(team.get("name")),
+                 str(team["id"]) if team.get("id") else None, query, result_text, time.time()))
+
+    def forget_stale(self, team, country_name):
+        """The stored pick no longer shows up in the search results"""
+        self._count("stale")
+        with self._connect() as conn:
+            conn.execute("DELETE FROM team_index WHERE country = ? AND name = ?",
+                         (self._norm(country_name), self._norm(team.get("name"))))
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        looked_up = stats["hits"] + stats["misses"]
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n FROM team_index").fetchone()
+        stats.update({"hit_rate": round(stats["hits"] / looked_up, 4) if looked_up else None, "entries": row["n"]})
+        return stats
+
+class SessionStore(_SqliteStore):
+    """Corner-stats.com login sessions per user (email), shared by every worker process.
+
+    SQLite holds the sessions (one transaction per save, so writers never see a
+    half-written session); an in-memory LRU in front answers the hot path. A cached
+    session is trusted for SESSION_RECHECK_SECONDS, after which only its version is
+    compared with the stored one, so a login in another worker is picked up without
+    re-parsing unchanged sessions.
+    """
+    filename = "sessions.sqlite3"
+    schema = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            email TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+    DEFAULT_LIFETIME = 24 * 3600
+
+    def __init__(self, path=None, capacity=None, recheck=None):
+        super().__init__(path)
+        self.capacity = capacity or int(os.environ.get("SESSION_CACHE_SIZE", 256))
+        self.recheck = recheck if recheck is not None else float(os.environ.get("SESSION_RECHECK_SECONDS", 5))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict() # email -> (data, version, expires_at, checked_at)
+        self._stats = {"hits": 0, "revalidations": 0, "loads": 0, "misses": 0, "expired": 0, "saves": 0}
+
+    @staticmethod
+    def _norm(email):
+        return (email or "").strip().lower()
+
+    def _remember(self, email, data, version, expires_at):
+        with self._lock:
+            self._cache[email] = (data, version, expires_at, time.monotonic())
+            self._cache.move_to_end(email)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def _forget(self, email):
+        with self._lock:
+            self._cache.pop(email, None)
+
+    def save(self, email, data):
+        """Store (or replace) the user's session; expiry comes from data["expires"] if present"""
+        email = self._norm(email)
+        expires_at = time.time() + self.DEFAULT_LIFETIME
+        if data.get("expires"):
+            expires_at = datetime.fromisoformat(data["expires"]).timestamp()
+        version = time.time_ns()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (email, data, version, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                         (email, json.dumps(data), version, expires_at, time.time()))
+            # Expired sessions of other users are dropped on the way
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+        self._remember(email, data, version, expires_at)
+        self._count("saves")
+
+    def load(self, email):
+        """Return the user's unexpired session data or None"""
+        email = self._norm(email)
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(email)
+            if cached is not None:
+                self._cache.move_to_end(email)
+        if cached is not None:
+            data, version, expires_at, checked_at = cached
+            if expires_at < now:
+                return self._expired(email)
+            if time.monotonic() - checked_at < self.recheck:
+                self._count("hits")
+                return data
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT version, expires_at FROM sessions WHERE email = ?", (email,)).fetchone()
+            if row is None:
+                self._forget(email)
+                self._count("misses")
+                return None
+            if row["expires_at"] < now:
+                return self._expired(email)
+            if cached is not None and cached[1] == row["version"]:
+                self._remember(email, cached[0], cached[1], cached[2])
+                self._count("revalidations")
+                return cached[0]
+            row = conn.execute("SELECT data, version, expires_at FROM sessions WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row["data"])
+        self._remember(email, data, row["version"], row["expires_at"])
+        self._count("loads")
+        return data
+
+    def _expired(self, email):
+        print(f"Session expired for {email}")
+        self.delete(email)
+        self._count("expired")
+        return None
+
+    def delete(self, email):
+        email = self._norm(email)
+        self._forget(email)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE email = ?", (email,))
+
+    def expiring(self, within):
+        """[(email, data)] of the unexpired sessions that expire in the next `within` seconds"""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT email, data FROM sessions WHERE expires_at >= ? AND expires_at < ?",
+                                (now, now + within)).fetchall()
+        return [(row["email"], json.loads(row["data"])) for row in rows]
+
+    def import_legacy(self, path):
+        """One-off import of a single-user session_data.json written by older versions"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            email = data.get("email")
+            if not email:
+                return
+            with self._connect() as conn:
+                exists = conn.execute("SELECT 1 FROM sessions WHERE email = ?", (self._norm(email),)).fetchone()
+            if not exists:
+                self.save(email, data)
+                print(f"Imported the session of {email} from {path}")
+        except Exception as e:
+            print(f"Failed to import legacy session file {path}: {e}")
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._cache)
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*) AS n FROM sessions WHERE expires_at >= ?", (time.time(),)).fetchone()
+        stats.update({"capacity": self.capacity, "stored": row["n"]})
+        return stats
+
+_catalog_cache = None
+_catalog_lock = threading.Lock()
+
+def get_catalog_cache():
+    """Return the process-wide catalog cache, creating it on first use"""
+    global _catalog_cache
+    with _catalog_lock:
+        if _catalog_cache is None:
+            _catalog_cache = CatalogCache()
+        return _catalog_cache
+
+_match_history = None
+_match_history_lock = threading.Lock()
+
+def get_match_history():
+    """Return the process-wide match-history store, creating it on first use"""
+    global _match_history
+    with _match_history_lock:
+        if _match_history is None:
+            _match_history = MatchHistoryStore()
+        return _match_history
+
+_team_index = None
+_team_index_lock = threading.Lock()
+
+def get_team_index():
+    """Return the process-wide team resolution index, creating it on first use"""
+    global _team_index
+    with _team_index_lock:
+        if _team_index is None:
+            _team_index = TeamIndex()
+        return _team_index
+
+# Written by versions that kept one session for all users; imported once per user
+LEGACY_SESSION_FILE = os.environ.get("LEGACY_SESSION_FILE", "session_data.json")
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Return the process-wide session store, creating it on first use"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = SessionStore()
+            _session_store.import_legacy(LEGACY_SESSION_FILE)
+        return _session_store
@@ -0,0 +1,225 @@
+import json, os, socket, threading, time, traceback, uuid
+from cache_store import _SqliteStore
+
+# Scrape workers draining the job queue, and how long finished jobs stay retrievable
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 86400))
+# A running job's lease; the worker renews it while it runs, other processes reclaim it once lapsed
+JOB_LEASE = int(os.environ.get("JOB_LEASE", 60))
+
+class JobQueue(_SqliteStore):
+    """Persistent queue of long-running API calls served by a bounded pool of worker threads.
+
+    Submitting stores the job and returns its id at once; workers pick jobs up in
+    submission order and record the current stage and the final (data, status_code).
+    A claimed job carries this queue's worker id and a lease the queue keeps renewing;
+    a running job whose lease lapsed (its process stopped) is queued again, so several
+    processes can share the jobs file without running a job twice.
+    """
+    filename = "jobs.sqlite3"
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            owner TEXT,
+            state TEXT NOT NULL,
+            stage TEXT,
+            result TEXT,
+            status_code INTEGER,
+            submitted_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_until REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, submitted_at);
+    """
+
+    def __init__(self, runner, path=None, workers=None, retention=None, lease=None):
+        """runner(kind, params, progress, owner) -> (data, status_code); progress(stage, **info) records the stage"""
+        super().__init__(path)
+        self.runner = runner
+        self.workers = workers or JOB_WORKERS
+        self.retention = retention if retention is not None else JOB_RETENTION
+        self.lease = lease or JOB_LEASE
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stats = {"submitted": 0, "completed": 0, "failed": 0, "resumed": 0,
+                       "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+                       "run_seconds_total": 0.0, "run_seconds_max": 0.0}
+        with self._connect() as conn:
+            # Job files written before leases existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("worker", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def _reclaim_stale(self, conn):
+        """Queue running jobs whose lease lapsed (their process stopped) again"""
+        resumed = conn.execute("UPDATE jobs SET state = 'queued', stage = NULL, started_at = NULL, worker = NULL, "
+                               "lease_until = NULL WHERE state = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                               (time.time(),)).rowcount
+        if resumed:
+            print(f"Job queue: re-queued {resumed} interrupted jobs")
+            self._stats["resumed"] += resumed
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            thread = threading.Thread(target=self._renew_leases, name="job-leases", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        print(f"Job queue: {self.workers} workers started")
+
+    def submit(self, kind, params, owner=None):
+        """Store a job and wake a worker; returns the job id"""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, kind, params, owner, state, submitted_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                         (job_id, kind, json.dumps(params), owner, time.time()))
+        with self._cond:
+            self._stats["submitted"] += 1
+            self._cond.notify()
+        self.purge()
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict (without its params) or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            position = None
+            if row is not None and row["state"] == "queued":
+                position = conn.execute("SELECT COUNT(*) AS n FROM jobs WHERE state = 'queued' AND submitted_at < ?",
+                                        (row["submitted_at"],)).fetchone()["n"]
+        if row is None:
+            return None
+        now = time.time()
+        job = {
+            "id": row["id"],
+            "type": row["kind"],
+            "owner": row["owner"],
+            "state": row["state"],
+            "stage": row["stage"],
+            "queue_position": position,
+            "submitted_at": row["submitted_at"],
+            "wait_seconds": round((row["started_at"] or now) - row["submitted_at"], 3),
+            "run_seconds": round((row["finished_at"] or now) - row["started_at"], 3) if row["started_at"] else None,
+            "status_code": row["status_code"],
+            "result": json.loads(row["result"]) if row["result"] is not None else None,
+        }
+        return job
+
+    def _claim(self):
+        """Mark the oldest queued job as running under this queue's lease and return it, or None"""
+        now = time.time()
+        with self._connect() as conn:
+            self._reclaim_stale(conn)
+            row = conn.execute(
+                "UPDATE jobs SET state = 'running', stage = 'starting', started_at = ?, attempts = attempts + 1, "
+                "worker = ?, lease_until = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE state = 'queued' ORDER BY submitted_at LIMIT 1) "
+                "RETURNING id, kind, params, owner, submitted_at, started_at",
+                (now, self.worker_id, now + self.lease)).fetchone()
+        return dict(row) if row else None
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._connect() as conn:
+                    conn.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND state = 'running'",
+                                 (time.time() + self.lease, self.worker_id))
+            except Exception as e:
+                print(f"Job queue: failed to renew leases: {e}")
+
+    def _set_stage(self, job_id, stage):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET stage = ? WHERE id = ? AND worker = ?", (stage, job_id, self.worker_id))
+
+    def _finish(self, job_id, data, status_code):
+        # A job reclaimed after this queue lost its lease belongs to the new worker
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state = ?, stage = NULL, result = ?, status_code = ?, finished_at = ?, "
+                         "lease_until = NULL WHERE id = ? AND worker = ?",
+                         ("done" if status_code < 400 else "failed", json.dumps(data), status_code, time.time(),
+                          job_id, self.worker_id))
+
+    def _work(self):
+        while True:
+            with self._cond:
+                # Claim under the condition so two workers never take the same job
+                job = self._claim()
+                while job is None:
+                    self._cond.wait(timeout=30)
+                    job = self._claim()
+            self._run(job)
+
+    def _run(self, job):
+        wait = max(0.0, job["started_at"] - job["submitted_at"])
+        print(f"Job {job['id']} ({job['kind']}) started after {wait:.2f}s in the queue")
+        try:
+            data, status_code = self.runner(job["kind"], json.loads(job["params"]),
+                                            lambda stage, **info: self._set_stage(job["id"], stage), job["owner"])
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e}")
+            traceback.print_exc()
+            data, status_code = {"error": f"Job failed: {str(e)}"}, 500
+        self._finish(job["id"], data, status_code)
+        run = time.time() - job["started_at"]
+        with self._cond:
+            self._stats["completed" if status_code < 400 else "failed"] += 1
+            self._stats["wait_seconds_total"] += wait
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+            self._stats["run_seconds_total"] += run
+            self._stats["run_seconds_max"] = max(self._stats["run_seconds_max"], run)
+
+    def purge(self):
+        """Drop finished jobs older than the retention period"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?",
+                         (time.time() - self.retention,))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        with self._connect() as conn:
+            counts = {row["state"]: row["n"] for row in
+                      conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
+            oldest = conn.execute("SELECT MIN(submitted_at) AS t FROM jobs WHERE state = 'queued'").fetchone()["t"]
+        finished = stats["completed"] + stats["failed"]
+        return {
+            "workers": self.workers,
+            "queue_depth": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "stored": sum(counts.values()),
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else None,
+            "submitted": stats["submitted"],
+            "completed": stats["completed"],
+            "failed": stats["failed"],
+            "resumed": stats["resumed"],
+            "wait_seconds_avg": round(stats["wait_seconds_total"] / finished, 3) if finished else None,
+            "wait_seconds_max": round(stats["wait_seconds_max"], 3),
+            "run_seconds_avg": round(stats["run_seconds_total"] / finished, 3) if finished else None,
+            "run_seconds_max": round(stats["run_seconds_max"], 3),
+        }
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue(runner=None):
+    """Return the process-wide job queue, creating and starting it on first use (runner is required then)"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(runner)
+            _job_queue.start()
+        return _job_queue
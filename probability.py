@@ -0,0 +1,410 @@
+import os
+from datetime import date, datetime
+import numpy as np
+
+# "monte_carlo" simulates scorelines; "analytic" reads the markets off the exact scoreline matrix
+CALCULATION_METHODS = ("monte_carlo", "analytic")
+DEFAULT_METHOD = os.environ.get("CALCULATION_METHOD", "monte_carlo")
+
+DEFAULT_SIMULATIONS = 10000
+MAX_SIMULATIONS = 100_000_000
+
+# Scorelines are tracked up to MAX_GOALS per team; the Poisson tail beyond it is folded
+# into the last cell (its mass is below 1e-9 for the goal expectations used here)
+MAX_GOALS = 15
+
+# Poisson mean multipliers (home, away) for the simulated outcome: the winner scores more
+OUTCOME_GOAL_FACTORS = ((1.1, 0.9), (1.0, 1.0), (0.9, 1.1))
+
+# Recency weighting: the k-th most recent match weighs exp(-RECENCY_DECAY * k)
+RECENCY_DECAY = 0.15
+BAYESIAN_PRIOR = 1/3  # Neutral prior for 3 outcomes
+
+EPOCH = date(1970, 1, 1)
+
+def date_ordinals(values):
+    """Days since 1970-01-01 for dd/mm/yyyy strings as float64 (NaN where a value is not such a date).
+
+    A vectorized stand-in for pd.to_datetime(format='%d/%m/%Y', errors='coerce').
+    """
+    values = np.asarray(values, dtype=object)
+    text = values.astype(str)
+    lengths = np.char.str_len(text)
+    valid = lengths == 10
+    text = np.where(valid, text, "00/00/0000").astype("U10")
+    digits = text.view(np.uint32).reshape(-1, 10).astype(np.int32) - ord("0")
+    separators = (digits[:, 2] == ord("/") - ord("0")) & (digits[:, 5] == ord("/") - ord("0"))
+    numeric = np.delete(digits, [2, 5], axis=1)
+    valid &= separators & ((numeric >= 0) & (numeric <= 9)).all(axis=1)
+    day = numeric[:, 0] * 10 + numeric[:, 1]
+    month = numeric[:, 2] * 10 + numeric[:, 3]
+    year = numeric[:, 4] * 1000 + numeric[:, 5] * 100 + numeric[:, 6] * 10 + numeric[:, 7]
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (year >= 1)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype("datetime64[M]")
+    dates = months.astype("datetime64[D]") + np.where(valid, day - 1, 0)
+    valid &= dates.astype("datetime64[M]") == months # Rejects 31/04, 30/02, ...
+    ordinals = np.where(valid, dates.astype(np.int64), np.nan)
+    # Rare unpadded dates (1/2/2024) go through strptime
+    for i in np.flatnonzero(~valid & ((lengths == 8) | (lengths == 9))):
+        try:
+            ordinals[i] = (datetime.strptime(text[i], "%d/%m/%Y").date() - EPOCH).days
+        except ValueError:
+            pass
+    return ordinals
+
+def outcome_probabilities(win_odds, draw_odds, loss_odds, date_ordinals):
+    """Host win/draw/guest win probabilities from past 1X2 odds, without pandas.
+
+    Takes float64 arrays (one entry per match; NaN for unparseable odds or dates) and
+    returns a dict with host_win, draw, guest_win, confidence, matches_dated and
+    matches_valid. The probabilities are None when no match has valid odds.
+
+    Margin-free implied probabilities per match are averaged with exponential recency
+    weights (newest first), then shrunk towards 1/3 by the confidence, which drops as
+    the implied host-win probability varies across matches.
+    """
+    batch = batch_outcome_probabilities(win_odds, draw_odds, loss_odds, date_ordinals, [0, len(date_ordinals)])
+    result = {key: values[0].item() for key, values in batch.items()}
+    if result["matches_valid"] == 0:
+        result.update(host_win=None, draw=None, guest_win=None, confidence=None)
+    return result
+
+def batch_outcome_probabilities(win_odds, draw_odds, loss_odds, date_ordinals, offsets):
+    """outcome_probabilities for many fixtures at once.
+
+    The match arrays hold every fixture's history back to back; fixture i owns rows
+    offsets[i]:offsets[i + 1]. Returns a dict of per-fixture arrays (NaN probabilities
+    where a fixture has no valid match).
+    """
+    win_odds = np.asarray(win_odds, dtype=np.float64)
+    draw_odds = np.asarray(draw_odds, dtype=np.float64)
+    loss_odds = np.asarray(loss_odds, dtype=np.float64)
+    date_ordinals = np.asarray(date_ordinals, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_fixtures = offsets.size - 1
+    fixture = np.repeat(np.arange(n_fixtures), np.diff(offsets))
+
+    dated = ~np.isnan(date_ordinals)
+    # NaN odds compare False, so they drop out here too
+    valid = np.flatnonzero(dated & (win_odds > 0) & (draw_odds > 0) & (loss_odds > 0))
+    # Per fixture, most recent first; same-day matches keep their table order
+    order = valid[np.lexsort((valid, -date_ordinals[valid], fixture[valid]))]
+    fixture = fixture[order]
+    counts = np.bincount(fixture, minlength=n_fixtures)
+    rank = np.arange(order.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    implied = np.empty((3, order.size))
+    np.divide(1.0, win_odds[order], out=implied[0])
+    np.divide(1.0, draw_odds[order], out=implied[1])
+    np.divide(1.0, loss_odds[order], out=implied[2])
+    implied /= implied.sum(axis=0) # Remove the bookmaker margin
+
+    weights = np.exp(-RECENCY_DECAY * rank)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        probs = np.stack([np.bincount(fixture, weights=implied[k] * weights, minlength=n_fixtures)
+                          for k in range(3)]).astype(np.float64)
+        probs /= probs.sum(axis=0)
+
+        # Sample standard deviation of the implied host-win probability
+        mean = np.bincount(fixture, weights=implied[0], minlength=n_fixtures) / counts
+        squares = np.bincount(fixture, weights=(implied[0] - mean[fixture]) ** 2, minlength=n_fixtures)
+        win_std = np.where(counts > 1, np.sqrt(squares / np.maximum(counts - 1, 1)), np.nan)
+    confidence = np.where(np.isnan(win_std), 0.5, np.maximum(0.3, 1 - win_std))
+    confidence = np.where(counts > 0, confidence, np.nan)
+
+    adjusted = probs * confidence + BAYESIAN_PRIOR * (1 - confidence)
+    adjusted /= adjusted.sum(axis=0)
+    return {
+        "host_win": adjusted[0],
+        "draw": adjusted[1],
+        "guest_win": adjusted[2],
+        "confidence": confidence,
+        "matches_dated": np.bincount(np.repeat(np.arange(n_fixtures), np.diff(offsets))[dated], minlength=n_fixtures),
+        "matches_valid": counts,
+    }
+
+def outcome_state(win_odds, draw_odds, loss_odds, date_ordinals):
+    """Running sums behind outcome_probabilities for one match history (a JSON-friendly dict).
+
+    "weighted" holds the recency-weighted implied probability sums and "mean"/"m2" the
+    running moments of the implied host-win probability, so extend_outcome_state can
+    add newer matches without revisiting the stored ones.
+    """
+    win_odds, draw_odds, loss_odds, date_ordinals = (
+        np.asarray(a, dtype=np.float64) for a in (win_odds, draw_odds, loss_odds, date_ordinals))
+    dated = ~np.isnan(date_ordinals)
+    valid = np.flatnonzero(dated & (win_odds > 0) & (draw_odds > 0) & (loss_odds > 0))
+    # Most recent first; same-day matches keep their table order (as in batch_outcome_probabilities)
+    order = valid[np.lexsort((valid, -date_ordinals[valid]))]
+    implied = np.stack([1.0 / win_odds[order], 1.0 / draw_odds[order], 1.0 / loss_odds[order]])
+    implied /= implied.sum(axis=0)
+    weights = np.exp(-RECENCY_DECAY * np.arange(order.size))
+    return {
+        "decay": RECENCY_DECAY,
+        "matches_dated": int(dated.sum()),
+        "matches_valid": int(order.size),
+        "weighted": (implied * weights).sum(axis=1).tolist(),
+        "mean": float(implied[0].mean()) if order.size else 0.0,
+        "m2": float(((implied[0] - implied[0].mean()) ** 2).sum()) if order.size else 0.0,
+        "latest": float(date_ordinals[order[0]]) if order.size else None,
+        "oldest": float(date_ordinals[order[-1]]) if order.size else None,
+    }
+
+def merge_outcome_states(newer, older):
+    """The outcome_state of two sets of matches where every match of newer ranks ahead of older's, in O(1).
+
+    The older weighted sums just decay by exp(-RECENCY_DECAY * newer's valid matches) and
+    the moments merge pairwise (Chan et al.). Returns None when that does not hold (a
+    newer match is older than older's latest one, or the decay changed).
+    """
+    if newer.get("decay") != RECENCY_DECAY or older.get("decay") != RECENCY_DECAY:
+        return None
+    matches_dated = newer["matches_dated"] + older["matches_dated"]
+    if newer["matches_valid"] == 0:
+        return dict(older, matches_dated=matches_dated)
+    if older["matches_valid"] == 0:
+        return dict(newer, matches_dated=matches_dated)
+    if newer["oldest"] < older["latest"]:
+        return None
+
+    shift = np.exp(-RECENCY_DECAY * newer["matches_valid"])
+    n_old, n_new = older["matches_valid"], newer["matches_valid"]
+    n = n_old + n_new
+    delta = newer["mean"] - older["mean"]
+    return {
+        "decay": RECENCY_DECAY,
+        "matches_dated": matches_dated,
+        "matches_valid": n,
+        "weighted": [float(w_new + shift * w_old) for w_new, w_old in zip(newer["weighted"], older["weighted"])],
+        "mean": older["mean"] + delta * n_new / n,
+        "m2": older["m2"] + newer["m2"] + delta * delta * n_old * n_new / n,
+        "latest": newer["latest"],
+        "oldest": older["oldest"],
+    }
+
+def extend_outcome_state(state, win_odds, draw_odds, loss_odds, date_ordinals):
+    """Add newer matches to an outcome_state in O(new matches).
+
+    Returns None when they do not all rank ahead of the stored ones (see
+    merge_outcome_states); rebuild from the full history then.
+    """
+    return merge_outcome_states(outcome_state(win_odds, draw_odds, loss_odds, date_ordinals), state)
+
+def state_probabilities(state):
+    """outcome_probabilities' result from an outcome_state"""
+    result = {"matches_dated": state["matches_dated"], "matches_valid": state["matches_valid"],
+              "host_win": None, "draw": None, "guest_win": None, "confidence": None}
+    n = state["matches_valid"]
+    if n == 0:
+        return result
+    probs = np.asarray(state["weighted"]) / sum(state["weighted"])
+    confidence = max(0.3, 1 - np.sqrt(max(state["m2"], 0.0) / (n - 1))) if n > 1 else 0.5
+    adjusted = probs * confidence + BAYESIAN_PRIOR * (1 - confidence)
+    adjusted /= adjusted.sum()
+    result.update(host_win=float(adjusted[0]), draw=float(adjusted[1]), guest_win=float(adjusted[2]),
+                  confidence=float(confidence))
+    return result
+
+def expected_goals(p_home, p_draw, p_away):
+    """Heuristic goal expectations (home, away) from the 1X2 probabilities (scalars or arrays)"""
+    p_home, p_draw, p_away = (np.asarray(p, dtype=np.float64) for p in (p_home, p_draw, p_away))
+    total = p_home + p_draw + p_away
+    usable = total > 0
+    total = np.where(usable, total, 1.0)
+    p_home, p_draw, p_away = p_home / total, p_draw / total, p_away / total
+    # Ensure a minimum expectation
+    expected_home = np.maximum(1.2 + (p_home * 1.0) + (p_draw * 0.3), 0.5)
+    expected_away = np.maximum(1.0 + (p_away * 1.0) + (p_draw * 0.3), 0.5)
+    # Fallback if probabilities are somehow invalid
+    return np.where(usable, expected_home, 1.2), np.where(usable, expected_away, 1.0)
+
+def poisson_pmf(mu, max_goals=MAX_GOALS):
+    """P(0..max_goals goals) for Poisson means (last axis), with the tail added to the last entry"""
+    mu = np.asarray(mu, dtype=np.float64)[..., None]
+    terms = np.concatenate([np.exp(-mu), mu / np.arange(1, max_goals + 1)], axis=-1)
+    pmf = np.cumprod(terms, axis=-1)
+    pmf[..., -1] += np.maximum(0.0, 1.0 - pmf.sum(axis=-1))
+    return pmf
+
+def outcome_scoreline_matrices(p_home, p_draw, p_away, max_goals=MAX_GOALS):
+    """The three outcome-conditioned independent-Poisson scoreline matrices (home goals x away goals),
+    stacked on the first axis"""
+    mu_home, mu_away = expected_goals(p_home, p_draw, p_away)
+    return np.stack([
+        poisson_pmf(mu_home * home_factor, max_goals)[..., :, None] * poisson_pmf(mu_away * away_factor, max_goals)[..., None, :]
+        for home_factor, away_factor in OUTCOME_GOAL_FACTORS])
+
+def scoreline_matrix(p_home, p_draw, p_away, max_goals=MAX_GOALS):
+    """Exact joint scoreline probabilities: the outcome-weighted mixture of the Poisson grids.
+    With arrays of fixtures, returns one matrix per fixture."""
+    probs = np.stack([np.asarray(p, dtype=np.float64) for p in (p_home, p_draw, p_away)])
+    probs = probs / probs.sum(axis=0)
+    matrices = outcome_scoreline_matrices(p_home, p_draw, p_away, max_goals)
+    return (probs[..., None, None] * matrices).sum(axis=0)
+
+def simulate_scorelines(p_home, p_draw, p_away, num_simulations=DEFAULT_SIMULATIONS, seed=None):
+    """Monte Carlo scoreline counts: matrix[h, a] = simulated matches ending h-a.
+
+    Each simulated match draws its outcome from the 1X2 probabilities and then Poisson
+    goals with the outcome-conditioned means. Rather than drawing match by match, the
+    Generator draws how many matches land on each scoreline (a multinomial over the
+    outcome's scoreline grid), which has exactly the same distribution and costs the
+    same for 10^4 or 10^8 simulations. The same seed gives the same counts.
+    """
+    rng = np.random.default_rng(seed)
+    probs = np.array([p_home, p_draw, p_away], dtype=float)
+    outcome_counts = rng.multinomial(num_simulations, probs / probs.sum())
+    counts = np.zeros((MAX_GOALS + 1, MAX_GOALS + 1), dtype=np.int64)
+    for count, matrix in zip(outcome_counts, outcome_scoreline_matrices(p_home, p_draw, p_away)):
+        if count:
+            cells = matrix.ravel()
+            counts += rng.multinomial(count, cells / cells.sum()).reshape(matrix.shape)
+    return counts
+
+def goal_markets(matrix):
+    """Over 1.5/2.5/3.5 and BTTS probabilities from a scoreline matrix (counts or probabilities),
+    or from a stack of them (one value per matrix)"""
+    goals = np.arange(matrix.shape[-1])
+    totals = goals[:, None] + goals[None, :]
+    mass = matrix.sum(axis=(-2, -1))
+    return {
+        "over_15": matrix[..., totals > 1.5].sum(axis=-1) / mass,
+        "over_25": matrix[..., totals > 2.5].sum(axis=-1) / mass,
+        "over_35": matrix[..., totals > 3.5].sum(axis=-1) / mass,
+        "btts": matrix[..., 1:, 1:].sum(axis=(-2, -1)) / mass,
+    }
+
+def home_margin_above(matrix, line):
+    """P(home goals - away goals > line) from a scoreline matrix, or one value per matrix of a stack"""
+    goals = np.arange(matrix.shape[-1])
+    return matrix[..., (goals[:, None] - goals[None, :]) > line].sum(axis=-1) / matrix.sum(axis=(-2, -1))
+
+def simulate_goal_markets(p_home, p_draw, p_away, num_simulations=DEFAULT_SIMULATIONS, seed=None):
+    """Monte Carlo over 1.5/2.5/3.5 and BTTS probabilities"""
+    return goal_markets(simulate_scorelines(p_home, p_draw, p_away, num_simulations, seed))
+
+def analytic_goal_markets(p_home, p_draw, p_away):
+    """Exact over 1.5/2.5/3.5 and BTTS probabilities (the limit of simulate_goal_markets)"""
+    return goal_markets(scoreline_matrix(p_home, p_draw, p_away))
+
+def predict_batch(win_odds, draw_odds, loss_odds, date_ordinals, offsets):
+    """1X2, confidence and exact goal markets for many fixtures in one vectorized pass.
+
+    Inputs are packed as for batch_outcome_probabilities. Returns a dict of per-fixture
+    arrays plus "scorelines", the stack of scoreline matrices for pricing extra markets.
+    Fixtures without valid matches get NaN.
+    """
+    outcome = batch_outcome_probabilities(win_odds, draw_odds, loss_odds, date_ordinals, offsets)
+    scorelines = scoreline_matrix(outcome["host_win"], outcome["draw"], outcome["guest_win"])
+    return dict(outcome, **goal_markets(scorelines), scorelines=scorelines)
+
+# --- Arbitrary markets from one scoreline matrix ---
+MARKET_KINDS = ("over_under", "asian_handicap", "correct_score", "team_totals")
+MAX_LINES_PER_MARKET = 200
+
+def _parse_lines(values, kind):
+    if not isinstance(values, list) or len(values) > MAX_LINES_PER_MARKET:
+        raise ValueError(f"{kind} must be a list of at most {MAX_LINES_PER_MARKET} lines")
+    lines = []
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (value * 4) % 1:
+            raise ValueError(f"Invalid {kind} line {value!r}: lines are multiples of 0.25")
+        lines.append(float(value))
+    return lines
+
+def normalize_markets(spec):
+    """Validate a request's "markets" object; raises ValueError with a client-facing message.
+
+    {"over_under": [2.5, 2.75], "asian_handicap": [-0.25, -1.5],
+     "correct_score": ["1-0", "2-1"], "team_totals": {"home": [1.5], "away": [0.5]}}
+    """
+    if not isinstance(spec, dict) or set(spec) - set(MARKET_KINDS):
+        raise ValueError(f"markets must be an object with any of: {', '.join(MARKET_KINDS)}")
+    markets = {}
+    for kind in ("over_under", "asian_handicap"):
+        if kind in spec:
+            markets[kind] = _parse_lines(spec[kind], kind)
+    if "correct_score" in spec:
+        scores = spec["correct_score"]
+        if not isinstance(scores, list) or len(scores) > MAX_LINES_PER_MARKET:
+            raise ValueError(f"correct_score must be a list of at most {MAX_LINES_PER_MARKET} scores")
+        markets["correct_score"] = []
+        for score in scores:
+            parts = str(score).split("-")
+            if len(parts) != 2 or not all(p.strip().isdigit() for p in parts):
+                raise ValueError(f"Invalid correct_score {score!r}: expected 'home-away' like '2-1'")
+            markets["correct_score"].append((int(parts[0]), int(parts[1])))
+    if "team_totals" in spec:
+        totals = spec["team_totals"]
+        if not isinstance(totals, dict) or set(totals) - {"home", "away"}:
+            raise ValueError("team_totals must be an object with 'home' and/or 'away' line lists")
+        markets["team_totals"] = {side: _parse_lines(lines, f"team_totals.{side}") for side, lines in totals.items()}
+    return markets
+
+def _line_split(values, probs, lines):
+    """(above, push, below) probabilities of values against each line.
+
+    Quarter lines are settled as two half stakes on the neighbouring lines, so their
+    push column holds the half-refund mass.
+    """
+    lines = np.asarray(lines, dtype=float)
+    quarter = np.round(lines * 4) % 2 == 1
+    halves = np.stack([np.where(quarter, lines - 0.25, lines), np.where(quarter, lines + 0.25, lines)])
+    above = ((values > halves[..., None]) * probs).sum(axis=-1).mean(axis=0)
+    push = ((values == halves[..., None]) * probs).sum(axis=-1).mean(axis=0)
+    return above, push, np.clip(1.0 - above - push, 0.0, 1.0)
+
+def fair_odds(win, lose):
+    """Decimal odds with zero expected value for a bet that wins/loses with these probabilities (the rest pushes)"""
+    return round(1 + lose / win, 2) if win > 0 else float('inf')
+
+def _fair_odds_array(win, lose):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(win > 0, np.round(1 + lose / np.where(win > 0, win, 1), 2), np.inf).tolist()
+
+def _two_way(lines, above, push, below, over_name, under_name):
+    columns = zip(np.round(above, 4).tolist(), np.round(below, 4).tolist(), np.round(push, 4).tolist(),
+                  _fair_odds_array(above, below), _fair_odds_array(below, above))
+    return {
+        f"{line:g}": {over_name: a, under_name: b, "push": p, f"{over_name}_odds": a_odds, f"{under_name}_odds": b_odds}
+        for line, (a, b, p, a_odds, b_odds) in zip(lines, columns)
+    }
+
+def price_markets(matrix, markets):
+    """Price every requested market off one scoreline matrix (counts or probabilities).
+
+    The matrix is reduced once to the total-goals, goal-margin and per-team goal
+    distributions; each market kind is then one broadcast comparison over all its lines.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    matrix = matrix / matrix.sum()
+    n = matrix.shape[0]
+    goals = np.arange(n)
+    home_goals, away_goals = np.meshgrid(goals, goals, indexing="ij")
+    result = {}
+
+    if markets.get("over_under"):
+        totals = np.bincount((home_goals + away_goals).ravel(), weights=matrix.ravel())
+        lines = markets["over_under"]
+        result["over_under"] = _two_way(lines, *_line_split(np.arange(len(totals)), totals, lines), "over", "under")
+
+    if markets.get("asian_handicap"):
+        # Home covers handicap h when margin + h > 0, i.e. margin > -h; the away side takes -h
+        margins = np.bincount((home_goals - away_goals + n - 1).ravel(), weights=matrix.ravel())
+        lines = markets["asian_handicap"]
+        above, push, below = _line_split(np.arange(len(margins)) - (n - 1), margins, [-h for h in lines])
+        result["asian_handicap"] = _two_way(lines, above, push, below, "home", "away")
+
+    if markets.get("correct_score"):
+        result["correct_score"] = {}
+        for home, away in markets["correct_score"]:
+            prob = float(matrix[home, away]) if home < n - 1 and away < n - 1 else 0.0
+            result["correct_score"][f"{home}-{away}"] = {"prob": round(prob, 4), "odds": fair_odds(prob, 1 - prob)}
+
+    if markets.get("team_totals"):
+        result["team_totals"] = {}
+        for side, marginal in (("home", matrix.sum(axis=1)), ("away", matrix.sum(axis=0))):
+            lines = markets["team_totals"].get(side)
+            if lines:
+                result["team_totals"][side] = _two_way(lines, *_line_split(goals, marginal, lines), "over", "under")
+    return result
@@ -0,0 +1,174 @@
+import os, re, threading, weakref
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+def _env_list(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return list(default)
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+# Chromium flags for a lean scraping profile: no extensions, sync, update checks or audio
+LEAN_LAUNCH_ARGS = [
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+]
+# Service workers would fetch around the route handler, so scraping contexts never register them
+LEAN_CONTEXT_OPTIONS = {"service_workers": "block"}
+
+# Extraction reads the DOM and the site's own XHRs; none of these are needed for it.
+# Stylesheets stay: the waits rely on CSS visibility (result lists hiding, filters showing)
+DEFAULT_BLOCKED_TYPES = ("image", "media", "font", "manifest", "texttrack")
+DEFAULT_FIRST_PARTY = ("corner-stats.com",)
+# Third-party hosts let through (script CDNs the site's selects may be built on)
+DEFAULT_ALLOWED_DOMAINS = ("code.jquery.com", "ajax.googleapis.com", "cdnjs.cloudflare.com", "cdn.jsdelivr.net")
+
+# Typical transfer sizes by resource type. A blocked request never transfers, so bytes saved
+# can only be estimated from these; they are not measurements
+BLOCKED_SIZE_ESTIMATES = {"image": 20000, "media": 250000, "font": 35000, "stylesheet": 25000, "script": 40000}
+DEFAULT_SIZE_ESTIMATE = 5000
+
+class ResourceTally:
+    """Requests a scrape let through and blocked, with an estimate (not a measurement) of the bytes saved"""
+    def __init__(self):
+        self.allowed = 0
+        self.blocked = {} # resource type -> count
+
+    def record(self, resource_type, allowed):
+        if allowed:
+            self.allowed += 1
+        else:
+            self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+
+    def summary(self):
+        return {
+            "requests_allowed": self.allowed,
+            "requests_blocked": sum(self.blocked.values()),
+            "blocked_by_type": dict(sorted(self.blocked.items(), key=lambda kv: -kv[1])),
+            "bytes_saved_estimate": sum(BLOCKED_SIZE_ESTIMATES.get(t, DEFAULT_SIZE_ESTIMATE) * n
+                                        for t, n in self.blocked.items()),
+            "bytes_saved_basis": "estimated from typical sizes per resource type, not measured",
+        }
+
+class RequestFilter:
+    """Aborts the requests a scraping context does not need.
+
+    First-party requests of a blocked resource type (images, media, fonts, ...)
+    and every third-party request outside the allowed domains are aborted. The site's
+    own documents, scripts and XHR/fetch calls (what the selects and tables are filled
+    from) always go through, as does any URL matching an allowed pattern. Settings
+    default to the RESOURCE_* environment variables.
+    """
+    def __init__(self, enabled=None, blocked_types=None, first_party=None, allowed_domains=None, allowed_patterns=None):
+        self.enabled = enabled if enabled is not None else os.environ.get("RESOURCE_BLOCKING", "1") == "1"
+        self.blocked_types = set(blocked_types if blocked_types is not None
+                                 else _env_list("RESOURCE_BLOCKED_TYPES", DEFAULT_BLOCKED_TYPES))
+        self.first_party = tuple(first_party if first_party is not None
+                                 else _env_list("RESOURCE_FIRST_PARTY", DEFAULT_FIRST_PARTY))
+        self.allowed_domains = tuple(allowed_domains if allowed_domains is not None
+                                     else _env_list("RESOURCE_ALLOWED_DOMAINS", DEFAULT_ALLOWED_DOMAINS))
+        patterns = allowed_patterns if allowed_patterns is not None else _env_list("RESOURCE_ALLOWED_PATTERNS", ())
+        self.allowed_patterns = [re.compile(p, re.IGNORECASE) for p in patterns]
+        self._lock = threading.Lock()
+        self._totals = ResourceTally()
+        self._tallies = weakref.WeakKeyDictionary() # context -> tally of the scrape running in it
+        self._unfiltered = weakref.WeakSet() # Contexts currently letting every request through
+
+    @staticmethod
+    def _host_in(host, domains):
+        return any(host == d or host.endswith("." + d) for d in domains)
+
+    def allows(self, url, resource_type):
+        """Whether a request for url (of Playwright's resource_type) may go through"""
+        if any(p.search(url) for p in self.allowed_patterns):
+            return True
+        host = (urlsplit(url).hostname or "").lower()
+        if not host:
+            return True
+        if not self._host_in(host, self.first_party) and not self._host_in(host, self.allowed_domains):
+            return False
+        return resource_type not in self.blocked_types
+
+    def track(self, context):
+        """Start a new tally for the scrape about to run in context and return it"""
+        tally = ResourceTally()
+        with self._lock:
+            self._tallies[context] = tally
+        return tally
+
+    @contextmanager
+    def unfiltered(self, context):
+        """Let every request of context through while the block runs (e.g. a login form's
+        captcha, consent or SSO scripts on third-party hosts)"""
+        with self._lock:
+            self._unfiltered.add(context)
+        try:
+            yield context
+        finally:
+            with self._lock:
+                self._unfiltered.discard(context)
+
+    def _passes(self, context, request):
+        """Whether a routed request goes through; only filtered requests are tallied"""
+        with self._lock:
+            if context in self._unfiltered:
+                return True
+        allowed = self.allows(request.url, request.resource_type)
+        self._record(context, request.resource_type, allowed)
+        return allowed
+
+    def _record(self, context, resource_type, allowed):
+        with self._lock:
+            self._totals.record(resource_type, allowed)
+            tally = self._tallies.get(context)
+            if tally is not None:
+                tally.record(resource_type, allowed)
+
+    def install(self, context):
+        """Route every request of a sync Playwright context through the filter"""
+        if not self.enabled:
+            return
+        def handle(route):
+            if self._passes(context, route.request):
+                route.continue_()
+            else:
+                route.abort("blockedbyclient")
+        context.route("**/*", handle)
+
+    async def install_async(self, context):
+        """install() for an async Playwright context"""
+        if not self.enabled:
+            return
+        async def handle(route):
+            if self._passes(context, route.request):
+                await route.continue_()
+            else:
+                await route.abort("blockedbyclient")
+        await context.route("**/*", handle)
+
+    def stats(self):
+        with self._lock:
+            stats = self._totals.summary()
+        stats.update({
+            "enabled": self.enabled,
+            "blocked_types": sorted(self.blocked_types),
+            "allowed_domains": list(self.allowed_domains),
+            "allowed_patterns": [p.pattern for p in self.allowed_patterns],
+        })
+        return stats
+
+_filter = None
+_filter_lock = threading.Lock()
+
+def get_request_filter():
+    """Return the process-wide request filter, creating it on first use"""
+    global _filter
+    with _filter_lock:
+        if _filter is None:
+            _filter = RequestFilter()
+        return _filter
@@ -1,13 +1,83 @@
-import json, time, os, traceback
+import copy, json, time, os, traceback
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import playwright
-from playwright.sync_api import sync_playwright
+import requests
+from browser_pool import get_browser_pool, BrowserPoolTimeout
+from resource_filter import get_request_filter
+from xhr_client import (get_xhr_client, get_xhr_endpoints, XhrEndpointRecorder, XhrEndpointMissing,
+                        PAGINATION_CONCURRENCY, templatize_request, fill_template, changed_params, request_params,
+                        collect_pages, cut_at_known, merge_pages, parse_table)
+from waits import StepWaiter, WaitTelemetry, COUNT_AT_LEAST_JS
+from cache_store import get_match_history, get_team_index, get_session_store
+from probability import (DEFAULT_METHOD, DEFAULT_SIMULATIONS, date_ordinals, outcome_probabilities,
+                         outcome_state, extend_outcome_state, merge_outcome_states, state_probabilities,
+                         analytic_goal_markets, simulate_scorelines, scoreline_matrix, goal_markets, home_margin_above, price_markets, predict_batch)
+
+# Max number of fixtures of a /api/compare_batch call scraped at once
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+
+# True once the login form has been answered: either the Login button is gone or an error is shown
+LOGIN_SETTLED_JS = """
+() => !Array.from(document.querySelectorAll('a.btn.btn-confirm')).some(a => a.textContent.includes('Login'))
+    || Array.from(document.querySelectorAll('.errorTxt_login, .errorTxt_password_login')).some(e => e.textContent.trim())
+"""
+
+# Returns [{value, name}] for every <option> of a select in one round trip
+READ_OPTIONS_JS = "select => Array.from(select.options).map(o => ({value: o.getAttribute('value'), name: o.textContent.trim()}))"
+
+# Runs inside the page and returns {headers, rows} for table.data-table in one round trip.
+# Same rules as the old per-cell locator walk: hidden (display:none) headers are skipped,
+# td__exclude/td__details cells are dropped, a cell's first link text wins over its full text.
+EXTRACT_TABLE_JS = """
+table => {
+    const headerRow = table.querySelector("thead tr");
+    const headers = headerRow ? Array.from(headerRow.querySelectorAll("th"))
+        .filter(th => !(th.getAttribute("style") || "").includes("display:none"))
+        .map(th => th.textContent.trim()) : [];
+    const rows = [];
+    for (const tr of table.querySelectorAll("tbody.tableData tr.tr__main")) {
+        const row = [];
+        for (const td of tr.querySelectorAll("td")) {
+            const cls = td.getAttribute("class") || "";
+            if (cls.includes("td__exclude") || cls.includes("td__details")) continue;
+            const link = td.querySelector("a");
+            row.push((link ? link.textContent : td.textContent).trim());
+        }
+        if (row.length) rows.push(row); // Only add non-empty rows
+    }
+    return {headers, rows};
+}
+"""
+
+# Fetches several table pages at once from inside the page (so the browser's cookies apply)
+# and returns the raw response bodies; null for a failed request.
+FETCH_PAGES_JS = """
+async requests => Promise.all(requests.map(async r => {
+    try {
+        const response = await fetch(r.url, {method: r.method, body: r.body, headers: r.headers, credentials: "include"});
+        if (!response.ok) return null;
+        const text = await response.text();
+        if ((response.headers.get("content-type") || "").includes("json")) {
+            const payload = JSON.parse(text);
+            for (const key of ["html", "data", "table", "content"]) {
+                if (typeof payload[key] === "string") return payload[key];
+            }
+        }
+        return text;
+    } catch (e) {
+        return null;
+    }
+}))
+"""
 
 class CornerStatsSession:
-    def __init__(self, session_file="session_data.json"):
-        self.session_file = session_file
+    """One user's corner-stats.com session, kept in the shared session store (see cache_store.SessionStore)"""
+    def __init__(self, email=None, store=None):
+        self.email = email
+        self.store = store or get_session_store()
         self.headers = {
             "accept": "text/html, */*; q=0.01",
             "accept-encoding": "gzip, deflate, br, zstd",
@@ -17,40 +87,33 @@ class CornerStatsSession:
         }
 
     def save(self, page, email, password):
+        return self.save_cookies(page.context.cookies(), email, password)
+
+    def save_cookies(self, cookies, email, password):
+        """Store a fresh login made with these cookies (for callers that read them themselves)"""
         try:
             data = {
                 "email": email,
                 "password": password,
-                "cookies": page.context.cookies(),
+                "cookies": cookies,
                 "headers": self.headers,
                 "timestamp": datetime.now().isoformat(),
+                "verified_at": time.time(), # Just logged in, so known good
                 "expires": (datetime.now() + timedelta(hours=24)).isoformat()
             }
-            with open(self.session_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            self.store.save(email, data)
             return True
         except Exception as e:
             print(f"Failed to save session: {e}")
             return False
 
     def load(self):
-        """Load session data"""
-        if not os.path.exists(self.session_file):
+        """Load this user's session data (None if there is none or it expired)"""
+        if not self.email:
+            print("No user given to load a session for")
             return None
         try:
-            with open(self.session_file, 'r') as f:
-                data = json.load(f)
-            
-            # Basic expiry check (optional but good practice)
-            if 'expires' in data:
-                if datetime.now() > datetime.fromisoformat(data['expires']):
-                    print("Session expired")
-                    # Optionally remove the expired file
-                    # os.remove(self.session_file)
-                    return None
-
-            print("Session loaded successfully")
-            return data
+            return self.store.load(self.email)
         except Exception as e:
             print(f"Failed to load session: {e}")
             return None
@@ -80,7 +143,7 @@ class CornerStatsAuth: # Keep this for API 1 if needed, though login is now in C
             page.locator("#email_login").fill(email)
             page.locator("#password_login").fill(password)
             page.locator("button.btn__button.sign-in").click()
-            time.sleep(3)
+            StepWaiter(page).until("login_result", LOGIN_SETTLED_JS)
 
             if self._is_logged_in(page):
                 session_manager = CornerStatsSession()
@@ -96,129 +159,293 @@ class CornerStatsAuth: # Keep this for API 1 if needed, though login is now in C
         except Exception as e:
             print(f"Login error: {e}")
             return False
+
+    def login_with_pool(self, pool, email, password):
+        """Log in on a warm pooled browser; saves the session on success.
+
+        The login runs in the slot's own context, so afterwards the slot carries the
+        new session and is parked on the compare form for the user's next request.
+        """
+        def do_login(page):
+            page.goto("https://corner-stats.com")
+            page.wait_for_load_state("networkidle")
+            StepWaiter(page).until_selector("login_ready", 'a.btn.btn-confirm:has-text("Login")')
+            if not self.login(page, email, password):
+                return False, None
+            return True, CornerStatsSession(email).load()
+        return pool.login(do_login, email)
         
 class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting structure
     """Main scraper class for corner-stats.com, adapted for API use"""
-    def __init__(self):
-        self.session = CornerStatsSession() # <-- FIXED: Initialize session
+    def __init__(self, pool=None, mode=None, email=None):
+        self.session = CornerStatsSession(email) # The session of the user the API call is made for
         self.url = "https://corner-stats.com"
+        self.pool = pool or get_browser_pool() # Shared warm browsers, see browser_pool.py
+        # 'browser' drives every step in Playwright; 'xhr' replays the site's AJAX calls
+        # directly (see xhr_client.py) and only falls back to the browser to learn them
+        self.mode = mode or os.environ.get("SCRAPER_MODE", "browser")
+        self.recorder = XhrEndpointRecorder(get_xhr_endpoints())
+        # Event-driven waits (see waits.py); per-step budgets in ms can be overridden here
+        self.wait_telemetry = WaitTelemetry()
+        self.wait_budgets = {}
+        # Max table pages fetched at once once the paging request is known
+        self.page_concurrency = PAGINATION_CONCURRENCY
+        # Optional progress(stage, **info) callback, e.g. to keep a queued job's stage current
+        self.progress = None
+        self._partial = None # Pages of the compare being scraped, for provisional estimates
+
+    def _waiter(self, page):
+        return StepWaiter(page, self.wait_telemetry, self.wait_budgets)
+
+    def _stage(self, stage, **info):
+        """Report the step a compare is at to the progress callback, if any"""
+        if self.progress:
+            try:
+                self.progress(stage, **info)
+            except Exception as e:
+                print(f"Progress callback failed at '{stage}': {e}")
+
+    def _start_pages(self, entry=None):
+        """Start the provisional estimates (only when someone is listening), seeded with the
+        stored rows' estimator state on a delta refresh"""
+        self._partial = None
+        if not self.progress:
+            return
+        stored = None
+        if entry and entry["rows"]:
+            stored = entry.get("outcome_state") or outcome_state(*self._outcome_arrays(entry["headers"], entry["rows"]))
+        self._partial = {"entry": entry, "stored": stored, "scraped": None, "rows": [], "seen": set()}
+
+    def _page_extracted(self, page_num, headers, rows):
+        """Report a table page with a provisional estimate over the rows seen so far.
+
+        Only the page's own rows are processed: its estimator state is merged onto the
+        running one instead of re-estimating every row seen so far.
+        """
+        partial = self._partial
+        if partial is None:
+            return
+        rows = [row for row in rows if tuple(row) not in partial["seen"]]
+        partial["seen"].update(tuple(row) for row in rows)
+        partial["rows"].extend(rows)
+        entry = partial["entry"]
+        total_rows = len(partial["rows"]) + (len(entry["rows"]) if entry else 0)
+        self._stage("page_extracted", page=page_num, rows=len(rows), total_rows=total_rows,
+                    provisional=self._provisional_estimate(headers, rows))
+
+    def _provisional_estimate(self, headers, rows):
+        """Headline analytic probabilities once rows are added to the rows seen so far (None until they can be computed)"""
+        partial = self._partial
+        try:
+            page_state = outcome_state(*self._outcome_arrays(headers, rows))
+            # Each page lists older matches than the pages before it
+            scraped = page_state if partial["scraped"] is None else merge_outcome_states(partial["scraped"], page_state)
+            if scraped is None: # Pages fetched in parallel can arrive out of order
+                scraped = outcome_state(*self._outcome_arrays(headers, partial["rows"]))
+            partial["scraped"] = scraped
+            # A delta refresh scrapes the matches newer than the stored ones
+            state = scraped if partial["stored"] is None else merge_outcome_states(scraped, partial["stored"])
+            if state is None:
+                entry = partial["entry"]
+                state = outcome_state(*self._outcome_arrays(headers, partial["rows"] + entry["rows"]))
+            outcome = state_probabilities(state)
+            if outcome["host_win"] is None:
+                return None
+            goals = analytic_goal_markets(outcome["host_win"], outcome["draw"], outcome["guest_win"])
+        except Exception as e:
+            print(f"Provisional estimate failed: {e}")
+            return None
+        return {
+            "host_win": round(outcome["host_win"], 4),
+            "draw": round(outcome["draw"], 4),
+            "guest_win": round(outcome["guest_win"], 4),
+            "over_2_5": round(float(goals["over_25"]), 4),
+            "btts": round(float(goals["btts"]), 4),
+            "confidence": round(outcome["confidence"], 2),
+            "matches": state["matches_valid"],
+        }
+
+    def _capture_xhr(self, page, name, action, values, meta=None):
+        """Run a browser action, recording the XHR it triggers as a replay template if not known yet"""
+        if not self.recorder.endpoints.wants(name, meta):
+            return action()
+        return self.recorder.capture(page, name, action, values, meta)
 
     def _is_logged_in(self, page):
         """Check if user is logged in"""
         return page.locator('a.btn.btn-confirm:has-text("Login")').count() == 0
 
-    # --- Methods for API 2: /api/leagues_teams ---
-    def get_leagues_and_teams(self, country_name):
-        """Get leagues and teams for a given country"""
+    def _run_in_browser(self, session_data, work, label, error_prefix="Scraping failed"):
+        """Borrow a warm, pre-authenticated browser from the pool and run work(page) on it"""
+        try:
+            return self.pool.run(work, session_data=session_data)
+        except BrowserPoolTimeout as e:
+            print(f"Browser pool exhausted in {label}: {e}")
+            return {"error": "All browsers are busy. Please retry shortly."}, 503
+        except Exception as e:
+            print(f"Error in {label}: {e}")
+            traceback.print_exc() # Log the full traceback
+            return {"error": f"{error_prefix}: {str(e)}"}, 500
+
+    # --- Catalog steps shared by the catalog endpoints ---
+    def _read_options(self, select):
+        """Return [{'value', 'name'}] for the non-placeholder options of a select (one round trip)"""
+        options = select.evaluate(READ_OPTIONS_JS)
+        return [o for o in options if o['value'] and o['value'] != "0"]
+
+    def _read_countries(self, page):
+        # Wait for the team selection block to be visible
+        page.locator("#block1.team").first.wait_for(timeout=10000)
+        return self._read_options(page.locator("select.select-control_1").first)
+
+    def _select_country(self, page, country_name):
+        """Pick the country in the team block; returns its {'value', 'name'} or None if unknown"""
+        selected_country = None
+        for country in self._read_countries(page):
+            # Match by name (case-insensitive partial match might be needed depending on input)
+            if country['name'].lower() == country_name.lower():
+                selected_country = country
+                break
+        if not selected_country:
+            return None
+
+        # Select the country and wait for the league select to be refilled via AJAX
+        country_select = page.locator("select.select-control_1").first
+        self._waiter(page).on_mutation("leagues_loaded", "select.select-control_2", lambda: self._capture_xhr(
+            page, "leagues", lambda: country_select.select_option(selected_country['value']),
+            {"country_id": selected_country['value']}))
+        return selected_country
+
+    def _read_leagues(self, page):
+        leagues = self._read_options(page.locator("select.select-control_2").first)
+        return [{"id": league['value'], "name": league['name']} for league in leagues] # Using 'value' as ID
+
+    def _read_league_teams(self, page, league_id):
+        """Select a league and return its teams as [{'value', 'name'}]"""
+        league_select = page.locator("select.select-control_2").first
+        # Select the league and wait for the team select to be refilled via AJAX
+        self._waiter(page).on_mutation("teams_loaded", "select.select-control_3", lambda: self._capture_xhr(
+            page, "teams", lambda: league_select.select_option(str(league_id)),
+            {"league_id": league_id}))
+        return self._read_options(page.locator("select.select-control_3").first)
+
+    def _logged_in_or_401(self, page):
+        if not self._is_logged_in(page):
+            return {"error": "Session invalid or expired. Please log in again."}, 401
+        return None
+
+    # --- Methods for /api/countries, /api/leagues and /api/teams (one catalog level each) ---
+    def get_countries(self):
+        """List the countries of the team selector"""
         session_data = self.session.load()
         if not session_data:
              return {"error": "No valid session found. Please log in first."}, 401
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True, channel="msedge")
-            page = browser.new_page()
+        if self.mode == "xhr":
+            try:
+                return {"countries": get_xhr_client(session_data).get_countries()}, 200
+            except requests.RequestException as e:
+                print(f"XHR mode unavailable for countries ({e}), using the browser")
+
+        def work(page):
+            return self._logged_in_or_401(page) or ({"countries": self._read_countries(page)}, 200)
+        return self._run_in_browser(session_data, work, "get_countries")
 
+    def get_leagues(self, country_name):
+        """List the leagues of one country, without touching their teams"""
+        session_data = self.session.load()
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
+
+        if self.mode == "xhr":
             try:
-                # Apply session
-                self.session.apply(page, session_data)
-                page.goto(self.url)
-                page.wait_for_load_state("networkidle")
-                time.sleep(2)
-
-                if not self._is_logged_in(page):
-                     return {"error": "Session invalid or expired. Please log in again."}, 401
-
-                # --- Mimic the logic from _interactive_team_selection ---
-
-                # Wait for the team selection block to be visible
-                team_block = page.locator("#block1.team").first
-                team_block.wait_for(timeout=10000) # Adjust timeout as needed
-
-                # Get available countries
-                country_options = []
-                country_select = page.locator("select.select-control_1").first
-                options = country_select.locator("option")
-                for i in range(options.count()):
-                    option = options.nth(i)
-                    value = option.get_attribute("value")
-                    text = option.text_content().strip()
-                    if value and value != "0":
-                        country_options.append({"value": value, "name": text})
-
-                # Find the selected country
-                selected_country = None
-                for country in country_options:
-                    # Match by name (case-insensitive partial match might be needed depending on input)
-                    if country['name'].lower() == country_name.lower():
-                        selected_country = country
-                        break
+                return get_xhr_client(session_data).get_leagues_of(country_name)
+            except (XhrEndpointMissing, requests.RequestException) as e:
+                print(f"XHR mode unavailable for leagues ({e}), using the browser")
+
+        def work(page):
+            denied = self._logged_in_or_401(page)
+            if denied:
+                return denied
+            country = self._select_country(page, country_name)
+            if not country:
+                return {"error": f"Country '{country_name}' not found."}, 404
+            return {"country": country['name'], "leagues": self._read_leagues(page)}, 200
+        return self._run_in_browser(session_data, work, "get_leagues")
+
+    def get_teams(self, country_name, league_id):
+        """List the teams of one league"""
+        session_data = self.session.load()
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
 
-                if not selected_country:
-                    return {"error": f"Country '{country_name}' not found."}, 404
-
-                # Select the country
-                country_select.select_option(selected_country['value'])
-                time.sleep(2) # Wait for leagues to load via AJAX
-
-                # Get available leagues
-                league_options = []
-                league_select = page.locator("select.select-control_2").first
-                league_opts = league_select.locator("option")
-                for i in range(league_opts.count()):
-                    option = league_opts.nth(i)
-                    value = option.get_attribute("value")
-                    text = option.text_content().strip()
-                    if value and value != "0":
-                        league_options.append({"value": value, "name": text})
-
-                if not league_options:
-                     # Return empty structure if no leagues
-                     return {
-                        "country": selected_country['name'],
-                        "leagues": []
-                    }, 200
-
-                # --- Collect data for each league ---
-                result_data = {
-                    "country": selected_country['name'],
-                    "leagues": []
-                }
+        if self.mode == "xhr":
+            try:
+                return get_xhr_client(session_data).get_teams_of(country_name, league_id)
+            except (XhrEndpointMissing, requests.RequestException) as e:
+                print(f"XHR mode unavailable for teams ({e}), using the browser")
+
+        def work(page):
+            denied = self._logged_in_or_401(page)
+            if denied:
+                return denied
+            country = self._select_country(page, country_name)
+            if not country:
+                return {"error": f"Country '{country_name}' not found."}, 404
+            if not any(league['id'] == str(league_id) for league in self._read_leagues(page)):
+                return {"error": f"League '{league_id}' not found in {country['name']}."}, 404
+            return {
+                "country": country['name'],
+                "league_id": str(league_id),
+                "teams": self._read_league_teams(page, league_id) # Each team is {'value': '...', 'name': '...'}
+            }, 200
+        return self._run_in_browser(session_data, work, "get_teams")
+
+    # --- Methods for API 2: /api/leagues_teams ---
+    def get_leagues_and_teams(self, country_name):
+        """Get leagues and teams for a given country"""
+        session_data = self.session.load()
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
 
-                for league in league_options:
-                    # Select the league
-                    league_select.select_option(league['value'])
-                    time.sleep(2) # Wait for teams to load via AJAX
-
-                    # Get available teams for this league
-                    team_options = []
-                    team_select = page.locator("select.select-control_3").first
-                    team_opts = team_select.locator("option")
-                    for i in range(team_opts.count()):
-                        option = team_opts.nth(i)
-                        value = option.get_attribute("value")
-                        text = option.text_content().strip()
-                        if value and value != "0":
-                            team_options.append({"value": value, "name": text})
-
-                    # Add league and its teams to the result
-                    result_data["leagues"].append({
-                        "id": league['value'], # Using 'value' as ID
-                        "name": league['name'],
-                        "teams": team_options # Each team is {'value': '...', 'name': '...'}
-                    })
-
-                return result_data, 200
+        if self.mode == "xhr":
+            try:
+                return get_xhr_client(session_data).get_leagues_and_teams(country_name)
+            except (XhrEndpointMissing, requests.RequestException) as e:
+                print(f"XHR mode unavailable for leagues/teams ({e}), using the browser")
+
+        return self._run_in_browser(
+            session_data, lambda page: self._scrape_leagues_and_teams(page, country_name), "get_leagues_and_teams")
+
+    def _scrape_leagues_and_teams(self, page, country_name):
+        """Collect leagues and teams of a country on an already prepared page"""
+        denied = self._logged_in_or_401(page)
+        if denied:
+            return denied
+
+        selected_country = self._select_country(page, country_name)
+        if not selected_country:
+            return {"error": f"Country '{country_name}' not found."}, 404
+
+        # --- Collect data for each league ---
+        result_data = {
+            "country": selected_country['name'],
+            "leagues": []
+        }
+        for league in self._read_leagues(page):
+            # Add league and its teams to the result
+            league["teams"] = self._read_league_teams(page, league['id'])
+            result_data["leagues"].append(league)
 
-            except Exception as e:
-                print(f"Error in get_leagues_and_teams: {e}")
-                traceback.print_exc()
-                return {"error": f"Scraping failed: {str(e)}"}, 500
-            finally:
-                browser.close()
+        return result_data, 200
 
     # --- Methods for API 3: /api/compare_and_calculate ---
-    def _select_team_from_search_results(self, page, team_name, input_selector, results_container_selector):
-        """Helper method to select a team from search results (no user interaction)"""
+    def _select_team_from_search_results(self, page, team_name, input_selector, results_container_selector, pick_text=None):
+        """Helper method to select a team from search results (no user interaction)
+
+        Picks the result whose text is pick_text when given, otherwise the first one.
+        Returns the selected result's text, or False if nothing was selected.
+        """
         try:
             print(f"Searching for team: {team_name}")
             # Clear and type in the team name
@@ -228,39 +455,56 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             # Trigger the search by typing (simulate keyup event)
             input_field.press("Space")
             input_field.press("Backspace")
-            time.sleep(3)  # Wait longer for search results to populate
-
-            # Wait for search results container
-            results_container = page.locator(results_container_selector)
-            results_list = results_container.locator("li.match-creator-selectblock-searchresult-item")
 
-            # Wait a bit more for results to fully load and check multiple times
-            for attempt in range(3):
-                page.wait_for_timeout(1000)
-                if results_list.count() > 0:
-                    break
-                print(f"Attempt {attempt + 1}: Waiting for search results...")
+            # Wait until the search results show up (or the step budget runs out)
+            item_selector = f"{results_container_selector} li.match-creator-selectblock-searchresult-item"
+            waiter = self._waiter(page)
+            waiter.until("search_results", COUNT_AT_LEAST_JS, [item_selector, 1])
+            team_links = page.locator(item_selector).locator("a.team_row")
 
-            results_count = results_list.count()
-            print(f"Found {results_count} search results")
+            result_texts = [t.strip() for t in team_links.all_text_contents()]
+            print(f"Found {len(result_texts)} search results")
 
-            if results_count == 0:
+            if not result_texts:
                 print(f"No search results found for team: {team_name}")
                 return False
-            elif results_count >= 1: # Select the first result automatically
+            if pick_text is not None:
+                if pick_text not in result_texts:
+                    print(f"Indexed result '{pick_text}' not among the search results")
+                    return False
+                index = result_texts.index(pick_text)
+                print(f"Selected team (indexed match): {pick_text}")
+            else:
                 # Even if multiple, API picks the first one
-                team_link = results_list.first.locator("a.team_row")
-                team_text = team_link.text_content().strip()
-                print(f"Selected team (first match): {team_text}")
-                team_link.click()
-                time.sleep(2) # Wait after click
-                return True
+                index = 0
+                print(f"Selected team (first match): {result_texts[0]}")
+            team_links.nth(index).click()
+            # The result list closes once the pick is taken
+            waiter.until_selector("team_selected", item_selector, state="hidden")
+            return result_texts[index]
 
         except Exception as e:
             print(f"Error selecting team from search results: {e}")
             traceback.print_exc()
             return False # Return False on exception
 
+    def _team_searches(self, team, country_name):
+        """(query, pick_text) attempts for a team: the indexed exact pick first, if there is one,
+        then the name with the country suffix and finally the bare name"""
+        searches = [(f"{team['name']}({country_name})", None), (team['name'], None)]
+        indexed = get_team_index().lookup(team, country_name)
+        if indexed:
+            searches.insert(0, (indexed["query"], indexed["result_text"]))
+        return searches, indexed
+
+    def _team_resolved(self, team, country_name, indexed, query, pick_text, selected):
+        """Keep the team index in step with the search that worked"""
+        index = get_team_index()
+        if indexed and pick_text is None:
+            index.forget_stale(team, country_name) # The indexed pick failed, a fallback search worked
+        if pick_text is None:
+            index.remember(team, country_name, query, selected)
+
     def _enter_teams_in_compare_form(self, page, host_team, guest_team, country_name):
         """Enter the selected teams in the Compare Teams form"""
         try:
@@ -273,50 +517,23 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             compare_form = page.locator("form#match-form_1")
             compare_form.wait_for(timeout=10000)
 
-            # Prepare team names with country suffix
-            host_team_search = f"{host_team['name']}({country_name})"
-            guest_team_search = f"{guest_team['name']}({country_name})"
-
-            # Select host team
-            print(f"\nSelecting host team: {host_team_search}")
-            if not self._select_team_from_search_results(
-                page,
-                host_team_search,
-                "#input_team_1_1",
-                "#div_input_team_1_1 .match-creator-selectblock-searchresult"
-            ):
-                # Fallback: try without country name
-                print(f"Retrying host team without country: {host_team['name']}")
-                if not self._select_team_from_search_results(
-                    page,
-                    host_team['name'],
-                    "#input_team_1_1",
-                    "#div_input_team_1_1 .match-creator-selectblock-searchresult"
-                ):
-                    print("Failed to select host team")
-                    return False
-
-            # Select guest team
-            print(f"\nSelecting guest team: {guest_team_search}")
-            if not self._select_team_from_search_results(
-                page,
-                guest_team_search,
-                "#input_team_2_1",
-                "#div_input_team_2_1 .match-creator-selectblock-searchresult"
-            ):
-                # Fallback: try without country name
-                print(f"Retrying guest team without country: {guest_team['name']}")
-                if not self._select_team_from_search_results(
-                    page,
-                    guest_team['name'],
-                    "#input_team_2_1",
-                    "#div_input_team_2_1 .match-creator-selectblock-searchresult"
-                ):
-                    print("Failed to select guest team")
+            for team, side, label in ((host_team, 1, "host"), (guest_team, 2, "guest")):
+                print(f"\nSelecting {label} team: {team['name']}")
+                input_selector = f"#input_team_{side}_1"
+                results_selector = f"#div_input_team_{side}_1 .match-creator-selectblock-searchresult"
+                # Indexed exact pick first, then with the country suffix, then without it
+                searches, indexed = self._team_searches(team, country_name)
+                for query, pick_text in searches:
+                    selected = self._select_team_from_search_results(page, query, input_selector, results_selector, pick_text)
+                    if selected:
+                        self._team_resolved(team, country_name, indexed, query, pick_text, selected)
+                        break
+                else:
+                    print(f"Failed to select {label} team")
                     return False
 
-            # Wait a moment for the form to process the selections
-            time.sleep(3)
+            # Wait for the form to process the selections and reveal the match filters
+            self._waiter(page).until_selector("compare_ready", ".getmatches_filters", state="visible")
             print("Teams entered successfully in compare form")
             return True
         except Exception as e:
@@ -335,13 +552,14 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             print("Filters container is visible.")
             # --- END CRITICAL ---
 
-            # Set show results to maximum (100)
+            waiter = self._waiter(page)
+
+            # Set show results to maximum (100), unless the pooled page has it preset already
             show_select = page.locator("select.show_results")
-            if show_select.count() > 0:
-                show_select.select_option("100")
+            if show_select.count() > 0 and show_select.input_value() != "100":
+                # Wait for the table to be re-rendered with the bigger page size
+                waiter.on_mutation("results_per_page", "table.data-table", lambda: show_select.select_option("100"))
                 print("Set results display to 100")
-                # Wait a bit for the change to potentially trigger updates
-                page.wait_for_timeout(2000) 
 
             # --- Wait for filter elements to be attached to the DOM ---
             # This is often enough before interacting, visibility can be flaky
@@ -357,9 +575,6 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                 # Get locators for the specific checkboxes
                 league_checkbox = page.locator('input[name="filter_tourn[]"][value="1"]')
                 cups_checkbox = page.locator('input[name="filter_tourn[]"][value="2"]')
-                
-                # Small wait to ensure they are interactable
-                page.wait_for_timeout(1000) 
 
                 if tournament_choice == 'l':
                     # Goal: League only -> Uncheck Cups
@@ -368,7 +583,7 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                     try:
                         if cups_checkbox.is_checked(timeout=2000): # Shorter timeout for check
                             print("   Unchecking Cups...")
-                            cups_checkbox.uncheck()
+                            waiter.on_mutation("filter_applied", "table.data-table", cups_checkbox.uncheck)
                         else:
                             print("   Cups already unchecked.")
                     except playwright._impl._errors.TimeoutError:
@@ -382,7 +597,7 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                     try:
                         if league_checkbox.is_checked(timeout=2000):
                             print("   Unchecking League...")
-                            league_checkbox.uncheck()
+                            waiter.on_mutation("filter_applied", "table.data-table", league_checkbox.uncheck)
                         else:
                            print("   League already unchecked.")
                     except playwright._impl._errors.TimeoutError:
@@ -400,8 +615,6 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             # 2. Season Filter
             season_choice = filters.get('seasons', 'skip')
             if season_choice != 'skip':
-                 # Small wait before interacting with season filters
-                 page.wait_for_timeout(1000)
                  season_checkboxes = page.locator('input[name="filter_season[]"]')
                  seasons_available = []
                  # Extract season values and labels from the page
@@ -426,20 +639,18 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                          # Check if 'select all' is checked and uncheck it if so
                          try:
                              if all_seasons_checkbox.is_checked(timeout=2000):
-                                 all_seasons_checkbox.uncheck()
+                                 waiter.on_mutation("filter_applied", "table.data-table", all_seasons_checkbox.uncheck)
                                  print("   Unchecked 'Select All' seasons checkbox.")
                          except playwright._impl._errors.TimeoutError:
                               print("   Warning: Could not determine 'Select All' season checkbox state quickly.")
                               
                          # Uncheck all individual season checkboxes that might be checked
-                         # Small wait
-                         page.wait_for_timeout(500)
                          for season_value, _ in seasons_available:
                              season_checkbox = page.locator(f'input[name="filter_season[]"][value="{season_value}"]')
                              try:
                                  # Check state with a short timeout
                                  if season_checkbox.is_checked(timeout=1500):
-                                     season_checkbox.uncheck()
+                                     waiter.on_mutation("filter_applied", "table.data-table", season_checkbox.uncheck)
                                      # print(f"   Unchecked season {season_value}") # Optional verbose log
                              except playwright._impl._errors.TimeoutError:
                                   # If we can't check the state quickly, it might not be relevant or checkable right now
@@ -452,9 +663,8 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                               for s_val, s_label in seasons_available:
                                   if str(season_val_or_label) == str(s_val) or str(season_val_or_label).lower() == s_label.lower():
                                       season_checkbox = page.locator(f'input[name="filter_season[]"][value="{s_val}"]')
-                                      # Add a tiny wait before checking
-                                      page.wait_for_timeout(200)
-                                      season_checkbox.check() # Check the desired ones
+                                      # Check the desired ones and wait for the table refresh
+                                      waiter.on_mutation("filter_applied", "table.data-table", season_checkbox.check)
                                       selected_seasons.append(s_label)
                                       break
                          if selected_seasons:
@@ -471,16 +681,13 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                 # Get locators for the specific checkboxes
                 home_checkbox = page.locator('input[name="filter_home[]"][value="1"]')
                 away_checkbox = page.locator('input[name="filter_home[]"][value="2"]')
-                
-                # Small wait to ensure they are interactable
-                page.wait_for_timeout(1000) 
 
                 if venue_choice == 'h':
                     # Goal: Home only -> Uncheck Away
                     try:
                         if away_checkbox.is_checked(timeout=2000):
                             print("   Unchecking Away...")
-                            away_checkbox.uncheck()
+                            waiter.on_mutation("filter_applied", "table.data-table", away_checkbox.uncheck)
                         else:
                            print("   Away already unchecked.")
                     except playwright._impl._errors.TimeoutError:
@@ -492,7 +699,7 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                     try:
                         if home_checkbox.is_checked(timeout=2000):
                             print("   Unchecking Home...")
-                            home_checkbox.uncheck()
+                            waiter.on_mutation("filter_applied", "table.data-table", home_checkbox.uncheck)
                         else:
                            print("   Home already unchecked.")
                     except playwright._impl._errors.TimeoutError:
@@ -503,9 +710,7 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                     # Goal: Both Home and Away (usually default)
                     print("   → Selected: Both Home and Away") # Both are checked by default usually
 
-            # Wait for filters to apply (might involve AJAX)
-            print("\nApplying filters...")
-            time.sleep(3) # Keep this for now, might need adjustment
+            # Every filter change above already waited for its table refresh
             print("="*50)
             print("Filters configured successfully")
             return True
@@ -529,8 +734,7 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                         print("Reached start of table")
                         break
                     else:
-                        prev_button.click()
-                        time.sleep(2)  # Wait for page to load
+                        self._waiter(page).on_mutation("table_page", "table.data-table", prev_button.click)
                         print("Clicked Previous button")
                 else:
                     print("Previous button not found")
@@ -546,57 +750,119 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             # Wait for table to be present
             table = page.locator("table.data-table")
             table.wait_for(timeout=10000)
-            # Extract headers
-            headers = []
-            header_row = table.locator("thead tr").first
-            header_cells = header_row.locator("th")
-            for i in range(header_cells.count()):
-                cell = header_cells.nth(i)
-                # Skip hidden columns
-                if "display:none" not in (cell.get_attribute("style") or ""):
-                    headers.append(cell.text_content().strip())
-            # Extract data rows
-            rows_data = []
-            tbody = table.locator("tbody.tableData")
-            data_rows = tbody.locator("tr.tr__main")
-            for i in range(data_rows.count()):
-                row = data_rows.nth(i)
-                row_data = []
-                cells = row.locator("td")
-                for j in range(cells.count()):
-                    cell = cells.nth(j)
-                    # Skip hidden columns and exclude/details columns
-                    cell_class = cell.get_attribute("class") or ""
-                    if "td__exclude" not in cell_class and "td__details" not in cell_class:
-                        # Get text content, handling links
-                        if cell.locator("a").count() > 0:
-                            text = cell.locator("a").first.text_content().strip()
-                        else:
-                            text = cell.text_content().strip()
-                        row_data.append(text)
-                if row_data:  # Only add non-empty rows
-                    rows_data.append(row_data)
-            return headers, rows_data
+            # Headers and rows come back from a single in-page evaluation
+            data = table.evaluate(EXTRACT_TABLE_JS)
+            return data["headers"], data["rows"]
         except Exception as e:
             print(f"Error extracting table data: {e}")
             return [], []
 
-    def _extract_all_table_data(self, page):
-        """Extract all table data by paginating through all pages"""
+    def _click_next_page(self, page, next_button):
+        """Click Next, wait for the new rows and return the XHR request that fetched them (or None)"""
+        captured = {}
+        def click():
+            try:
+                with page.expect_request(lambda r: r.resource_type in ("xhr", "fetch") and r.url.startswith(self.url),
+                                         timeout=10000) as request_info:
+                    next_button.click()
+                captured["request"] = request_info.value
+            except playwright._impl._errors.TimeoutError:
+                print("Next click did not fire a request; paginating one page at a time")
+        # Wait for the next page of rows to be rendered
+        self._waiter(page).on_mutation("table_page", "table.data-table", click)
+        return captured.get("request")
+
+    def _paging_key(self, paging_requests):
+        """(parameter name, value for page 2, step per page) of the paging parameter, from the
+        requests of pages 2 and 3: the one numeric parameter that changed between them. None if unclear."""
+        first, second = ((r.url, r.post_data) for r in paging_requests)
+        changed = changed_params(first, second)
+        if len(changed) != 1:
+            print(f"Paging parameter unclear (changed: {changed}); paginating one page at a time")
+            return None
+        key = changed[0]
+        try:
+            start, following = (int(dict(request_params(*r))[key]) for r in (first, second))
+        except ValueError:
+            return None
+        if following == start:
+            return None
+        return key, start, following - start
+
+    def _fetch_pages_in_parallel(self, page, paging_requests, first_page, previous_rows, known=None, on_page=None):
+        """Replay the paging request for first_page onwards, several pages at a time.
+
+        paging_requests are the requests that fetched pages 2 and 3; the parameter that
+        differs between them is the only one turned into the page placeholder. Returns
+        the row lists in page order (up to the first known row), or None if the paging
+        parameter cannot be told (then the caller keeps clicking Next).
+        """
+        paging = self._paging_key(paging_requests)
+        if paging is None:
+            return None
+        key, start, step = paging
+        paging_request = paging_requests[-1]
+        template = templatize_request(paging_request.method, paging_request.url,
+                                      paging_request.post_data, keys={"page": key})
+        headers = {k: v for k, v in paging_request.headers.items()
+                   if k.lower() in ("content-type", "x-requested-with", "accept")}
+
+        def fetch_wave(page_numbers):
+            requests_ = []
+            for n in page_numbers:
+                method, url, body = fill_template(template, page=start + (n - 2) * step)
+                requests_.append({"method": method, "url": url, "body": body, "headers": headers})
+            bodies = page.evaluate(FETCH_PAGES_JS, requests_)
+            rows = [parse_table(body)[1] if body else None for body in bodies]
+            print(f"Fetched pages {page_numbers[0]}-{page_numbers[-1]} in parallel: "
+                  f"{[len(r) if r else 0 for r in rows]} rows")
+            return rows
+
+        return collect_pages(fetch_wave, first_page, self.page_concurrency, previous_rows=previous_rows,
+                             known=known, on_page=on_page)
+
+    def _extract_all_table_data(self, page, record_context=None, known=None):
+        """Extract all table data: page 1 and 2 from the DOM, the rest fetched in parallel
+
+        The requests fired by the first two Next clicks tell the paging parameter; it is
+        replayed for every later page, self.page_concurrency at a time, and results are
+        merged in order and de-duplicated. If it cannot be replayed, pagination falls
+        back to clicking Next page by page.
+
+        record_context = {"values": {...}, "meta": {...}} lets the paging request be
+        recorded as the 'table' XHR template. With known(row) given (a delta
+        refresh of the match history), paging stops at the first known row.
+        """
         try:
             print("\nExtracting table data from all pages...")
             all_headers = []
-            all_rows = []
+            pages = []
             page_num = 1
+            paging_requests = [] # Requests that fetched pages 2 and 3
+            parallel = True
             while True:
                 print(f"Extracting data from page {page_num}...")
                 # Extract data from current page
                 headers, rows_data = self._extract_table_data(page)
                 if headers and not all_headers:
                     all_headers = headers
-                if rows_data:
-                    all_rows.extend(rows_data)
-                    print(f"Extracted {len(rows_data)} rows from page {page_num}")
+                new_rows, reached_known = cut_at_known(rows_data, known)
+                if new_rows:
+                    pages.append(new_rows)
+                    print(f"Extracted {len(new_rows)} rows from page {page_num}")
+                    self._page_extracted(page_num, all_headers, new_rows)
+                if reached_known:
+                    print("Reached rows already in the match history")
+                    break
+                if parallel and len(paging_requests) == 2:
+                    remaining = self._fetch_pages_in_parallel(
+                        page, paging_requests, page_num + 1, rows_data, known,
+                        on_page=lambda n, rows: self._page_extracted(n, all_headers, rows))
+                    if remaining is not None:
+                        self._record_table_template(paging_requests, record_context)
+                        pages.extend(remaining)
+                        break
+                    parallel = False
                 # Check if Next button is available and active
                 next_button = page.locator("button.button_next_table")
                 if next_button.count() > 0:
@@ -604,31 +870,53 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                         print("Reached end of table")
                         break
                     else:
-                        next_button.click()
-                        time.sleep(3)  # Wait for page to load
+                        request = self._click_next_page(page, next_button)
+                        if parallel and page_num <= 2:
+                            if request is None:
+                                parallel = False
+                            else:
+                                paging_requests.append(request)
                         page_num += 1
                 else:
                     print("Next button not found")
                     break
+            all_rows = merge_pages(pages)
             print(f"\nTotal rows extracted: {len(all_rows)}")
             return all_headers, all_rows
         except Exception as e:
             print(f"Error extracting all table data: {e}")
             return [], []
 
+    def _record_table_template(self, paging_requests, record_context):
+        """Record the paging request as the 'table' XHR template when its page parameter is the page number"""
+        if not record_context or not self.recorder.endpoints.wants("table", record_context["meta"]):
+            return
+        paging = self._paging_key(paging_requests)
+        if paging is None or paging[1:] != (2, 1):
+            # The XHR client fills in plain page numbers
+            print("Paging parameter is not the page number, not recording the table template")
+            return
+        request = paging_requests[0]
+        self.recorder.endpoints.record("table", request.method, request.url, request.post_data,
+                                       record_context["values"], record_context["meta"], keys={"page": paging[0]})
+
+    def _table_columns(self, headers, first_row):
+        """Column names for the scraped rows: the headers, or fallback names"""
+        if len(headers) == len(first_row):
+            return headers
+        columns = ["Date", "Tournament", "Round", "Team1", "T1_Stats", "T2_Stats",
+                  "Team2", "Win", "Draw", "Loss", "Exclude", "Details"][:len(first_row)]
+        # Pad if needed
+        while len(columns) < len(first_row):
+            columns.append(f"Column_{len(columns)+1}")
+        return columns
+
     def _create_dataframe(self, headers, rows_data):
         """Create and format DataFrame"""
         if not rows_data:
             return None
         # Use headers or fallback names
-        if len(headers) == len(rows_data[0]):
-            columns = headers
-        else:
-            columns = ["Date", "Tournament", "Round", "Team1", "T1_Stats", "T2_Stats",
-                      "Team2", "Win", "Draw", "Loss", "Exclude", "Details"][:len(rows_data[0])]
-            # Pad if needed
-            while len(columns) < len(rows_data[0]):
-                columns.append(f"Column_{len(columns)+1}")
+        columns = self._table_columns(headers, rows_data[0])
         df = pd.DataFrame(rows_data, columns=columns)
         # Convert numeric columns
         numeric_keywords = ['win', 'draw', 'loss', 'stats']
@@ -637,158 +925,69 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
                 df[col] = pd.to_numeric(df[col], errors='coerce')
         return df
 
-    def _calculate_win_probability(self, df):
-        """Calculate various match probabilities using bookmaker odds and simulation"""
+    def _calculate_win_probability(self, df, simulations=None, seed=None, method=None, markets=None, outcome=None):
+        """Calculate various match probabilities using bookmaker odds and simulation
+
+        method "analytic" reads the goal markets off the exact scoreline matrix instead
+        of simulating them ("monte_carlo"). markets (see probability.normalize_markets)
+        lists extra lines to price off the same scoreline matrix. outcome is a ready
+        outcome_probabilities result (e.g. from the stored incremental estimator); df
+        is not read then.
+        """
         print("\nCalculating comprehensive match probabilities...")
 
-        # Handle empty or invalid data - Return an error message
-        if df is None or df.empty:
-            print("No match data provided.")
-            # Return a specific indicator that no data was found
-            return {
-                "error": "No match data available for the selected teams and filters. Cannot calculate probabilities."
-            }
+        if outcome is None:
+            # Handle empty or invalid data - Return an error message
+            if df is None or df.empty:
+                print("No match data provided.")
+                # Return a specific indicator that no data was found
+                return {
+                    "error": "No match data available for the selected teams and filters. Cannot calculate probabilities."
+                }
 
-        # Convert date to datetime and sort chronologically
-        df = df.copy()
-        df['Date'] = pd.to_datetime(df['Date'], format='%d/%m/%Y', errors='coerce')
-        df = df.dropna(subset=['Date']).sort_values('Date').reset_index(drop=True)
+            # pandas only adapts the table to float64 arrays; the calculation runs in probability.py
+            outcome = outcome_probabilities(
+                pd.to_numeric(df['Win'], errors='coerce').to_numpy(dtype=np.float64), # Host win odds
+                pd.to_numeric(df['Draw'], errors='coerce').to_numpy(dtype=np.float64),
+                pd.to_numeric(df['Loss'], errors='coerce').to_numpy(dtype=np.float64), # Guest win odds
+                date_ordinals(df['Date'].to_numpy()))
 
-        if df.empty:
+        if outcome["matches_dated"] == 0:
             print("No valid match data with dates found.")
             return {
                 "error": "No valid historical match data found for the selected teams. Cannot calculate probabilities."
             }
 
-        # Standardize perspective: Always treat Host as "Team A"
-        df['host_win_odds'] = df['Win']
-        df['guest_win_odds'] = df['Loss']
-        df['draw_odds'] = df['Draw']
-
-        # Convert odds to numeric and filter valid matches
-        for col in ['host_win_odds', 'guest_win_odds', 'draw_odds']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        valid = df[
-            (df['host_win_odds'] > 0) &
-            (df['guest_win_odds'] > 0) &
-            (df['draw_odds'] > 0)
-        ].copy()
-
-        if valid.empty:
+        if outcome["matches_valid"] == 0:
             print("No valid odds data found.")
             return {
                 "error": "Insufficient valid odds data found in the historical matches. Cannot calculate probabilities."
             }
 
-        print(f"Analyzing {len(valid)} valid matches out of {len(df)} total matches")
-
-        # Calculate normalized probabilities (remove bookmaker margin)
-        valid['inv_host_win'] = 1 / valid['host_win_odds']
-        valid['inv_guest_win'] = 1 / valid['guest_win_odds']
-        valid['inv_draw'] = 1 / valid['draw_odds']
-        valid['total_inv'] = valid['inv_host_win'] + valid['inv_guest_win'] + valid['inv_draw']
-
-        valid['p_host_win'] = valid['inv_host_win'] / valid['total_inv']
-        valid['p_guest_win'] = valid['inv_guest_win'] / valid['total_inv']
-        valid['p_draw'] = valid['inv_draw'] / valid['total_inv']
-
-        # Apply recency weighting (exponential decay)
-        valid = valid.sort_values('Date', ascending=False)
-        valid['weight'] = np.exp(-0.15 * np.arange(len(valid)))
-
-        # Calculate weighted probabilities
-        total_weight = valid['weight'].sum()
-        host_win_prob = (valid['p_host_win'] * valid['weight']).sum() / total_weight
-        guest_win_prob = (valid['p_guest_win'] * valid['weight']).sum() / total_weight
-        draw_prob = (valid['p_draw'] * valid['weight']).sum() / total_weight
-
-        # Normalize to ensure they sum to 1
-        total = host_win_prob + guest_win_prob + draw_prob
-        host_win_prob /= total
-        guest_win_prob /= total
-        draw_prob /= total
-
-        # Calculate confidence metrics
-        win_std = valid['p_host_win'].std()
-        confidence = max(0.3, 1 - win_std) if not pd.isna(win_std) else 0.5
-
-        # Bayesian adjustment with prior
-        BAYESIAN_PRIOR = 1/3  # Neutral prior for 3 outcomes
-        adjusted_host_win = (host_win_prob * confidence) + (BAYESIAN_PRIOR * (1 - confidence))
-        adjusted_guest_win = (guest_win_prob * confidence) + (BAYESIAN_PRIOR * (1 - confidence))
-        adjusted_draw = (draw_prob * confidence) + (BAYESIAN_PRIOR * (1 - confidence))
-
-        # Normalize again after Bayesian adjustment
-        total = adjusted_host_win + adjusted_guest_win + adjusted_draw
-        adjusted_host_win /= total
-        adjusted_guest_win /= total
-        adjusted_draw /= total
-
-        # --- Run Monte Carlo simulation for goal probabilities ---
-        num_simulations = 10000
-
-        # Estimate average goals scored/conceded from valid data for simulation
-        # This uses the implied probabilities to estimate goal expectations
-
-        # Simple heuristic to estimate goal expectations based on outcome probabilities
-        total_prob = adjusted_host_win + adjusted_draw + adjusted_guest_win
-        if total_prob > 0:
-            # Normalize probabilities for goal estimation
-            norm_host_win = adjusted_host_win / total_prob
-            norm_draw = adjusted_draw / total_prob
-            norm_guest_win = adjusted_guest_win / total_prob
-
-            # Estimate goal expectations based on outcome probabilities
-            expected_goals_home = 1.2 + (norm_host_win * 1.0) + (norm_draw * 0.3)
-            expected_goals_away = 1.0 + (norm_guest_win * 1.0) + (norm_draw * 0.3)
-
-            # Ensure a minimum expectation
-            expected_goals_home = max(expected_goals_home, 0.5)
-            expected_goals_away = max(expected_goals_away, 0.5)
+        print(f"Analyzing {outcome['matches_valid']} valid matches out of {outcome['matches_dated']} total matches")
+
+        adjusted_host_win = outcome["host_win"]
+        adjusted_draw = outcome["draw"]
+        adjusted_guest_win = outcome["guest_win"]
+        confidence = outcome["confidence"]
+
+        # --- Goal probabilities from the outcome-conditioned Poisson model (see probability.py) ---
+        # One home x away scoreline matrix feeds every goal-based market below
+        method = method or DEFAULT_METHOD
+        if method == "analytic":
+            scorelines = scoreline_matrix(adjusted_host_win, adjusted_draw, adjusted_guest_win)
+            calculation = {'method': 'analytic'}
         else:
-            # Fallback if probabilities are somehow invalid
-            expected_goals_home = 1.2
-            expected_goals_away = 1.0
-
-        # Run simulation
-        over_15 = 0
-        over_25 = 0
-        over_35 = 0
-        btts = 0
-
-        for _ in range(num_simulations):
-            # Determine match outcome based on adjusted probabilities
-            rand = np.random.random()
-            if rand < adjusted_host_win:
-                # Home win scenario - higher home goals likely
-                home_goals = np.random.poisson(expected_goals_home * 1.1)
-                away_goals = np.random.poisson(expected_goals_away * 0.9)
-            elif rand < adjusted_host_win + adjusted_draw:
-                # Draw scenario - more balanced goals
-                home_goals = np.random.poisson(expected_goals_home)
-                away_goals = np.random.poisson(expected_goals_away)
-            else:
-                # Away win scenario - higher away goals likely
-                home_goals = np.random.poisson(expected_goals_home * 0.9)
-                away_goals = np.random.poisson(expected_goals_away * 1.1)
-
-            # Calculate goal-based probabilities
-            total_goals = home_goals + away_goals
-            if total_goals > 1.5:
-                over_15 += 1
-            if total_goals > 2.5:
-                over_25 += 1
-            if total_goals > 3.5:
-                over_35 += 1
-            if home_goals > 0 and away_goals > 0:
-                btts += 1
-
-        # Calculate probabilities from simulation
-        over_15_prob = over_15 / num_simulations
-        over_25_prob = over_25 / num_simulations
-        over_35_prob = over_35 / num_simulations
-        btts_prob = btts / num_simulations
+            # Run Monte Carlo simulation, drawn in batches
+            num_simulations = simulations or DEFAULT_SIMULATIONS
+            scorelines = simulate_scorelines(adjusted_host_win, adjusted_draw, adjusted_guest_win,
+                                             num_simulations, seed)
+            calculation = {'method': 'monte_carlo', 'simulations': num_simulations, 'seed': seed}
+        main_markets = goal_markets(scorelines)
+        over_15_prob = main_markets["over_15"]
+        over_25_prob = main_markets["over_25"]
+        over_35_prob = main_markets["over_35"]
+        btts_prob = main_markets["btts"]
 
         # --- Calculate Asian Handicap Probabilities ---
         # AH -0.25 (Home) = 50% of AH 0.0 (Home) + 50% of AH -0.5 (Home)
@@ -810,10 +1009,10 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
         ah_m0_25_away_prob = (ah_0_0_away_prob + ah_m0_5_away_prob) / 2.0
 
         # --- Add Asian Handicap -2.5 Calculations ---
-        # AH -2.5 (Home) wins if Home Win
-        ah_m2_5_home_prob = adjusted_host_win
-        # AH -2.5 (Away) wins if Away Win or Draw
-        ah_m2_5_away_prob = adjusted_guest_win + adjusted_draw
+        # AH -2.5 (Home) wins only by 3+ goals, so it needs the goal margin, not just the 1X2
+        ah_m2_5_home_prob = float(home_margin_above(scorelines, 2.5))
+        # AH -2.5 (Away) wins on anything else
+        ah_m2_5_away_prob = 1 - ah_m2_5_home_prob
         # --- End Asian Handicap -2.5 Calculations ---
 
         # --- Calculate Asian Handicap Odds ---
@@ -854,7 +1053,9 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
             'ah_m2_5_away_odds': ah_m2_5_away_odds, # Use pre-calculated odds
             # --- End Asian Handicap ---
             'confidence': round(confidence, 2),
-            'total_matches': len(valid) # Include number of matches for context
+            'calculation': calculation,
+            'markets': price_markets(scorelines, markets) if markets else None,
+            'total_matches': outcome['matches_valid'] # Include number of matches for context
         }
         # --- End Format the results ---
         
@@ -865,117 +1066,400 @@ class CornerStatsDataScraper: # Renamed to DataScraper for clarity, inheriting s
         # print(f"\nOver/Under Probabilities:")
         # print(f"Over 1.5: {result['over_15_prob']:.2%} | Over 2.5: {result['over_25_prob']:.2%} | Over 3.5: {result['over_35_prob']:.2%}")
         # print(f"\nBoth Teams to Score: {result['btts_prob']:.2%}")
-        # print(f"\nConfidence: {confidence:.0%} (based on {len(valid)} matches)")
+        # print(f"\nConfidence: {confidence:.0%} (based on {outcome['matches_valid']} matches)")
         # print(f"{'='*60}")
         
         return result
 
-    def compare_and_calculate(self, host_team, guest_team, country_name, filters):
-        """API-facing method to perform comparison and calculation"""
+    def _calculate_win_probabilities_batch(self, histories, markets=None):
+        """_calculate_win_probability for many fixtures at once (analytic goal markets).
+
+        histories is a list of (headers, rows) scraped tables. They are packed straight
+        into ragged float64 arrays with offsets, without a DataFrame per fixture, and
+        priced in one vectorized pass (probability.predict_batch). Returns one result
+        dict per history, with the same keys as _calculate_win_probability or an "error".
+        """
+        # Pack the histories back to back; fixture i owns rows offsets[i]:offsets[i + 1]
+        offsets = np.zeros(len(histories) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for _, rows in histories], out=offsets[1:])
+        positions = [self._table_columns(headers, rows[0]) if rows else [] for headers, rows in histories]
+
+        def packed(name):
+            values = []
+            for columns, (_, rows) in zip(positions, histories):
+                if name in columns:
+                    index = columns.index(name)
+                    values.extend(row[index] for row in rows)
+                else:
+                    values.extend([None] * len(rows))
+            return np.array(values, dtype=object)
+
+        def packed_odds(name):
+            return pd.to_numeric(packed(name), errors='coerce').astype(np.float64)
+
+        batch = predict_batch(packed_odds('Win'), packed_odds('Draw'), packed_odds('Loss'), # Host win/draw/guest win
+                              date_ordinals(packed('Date')), offsets)
+
+        # AH -2.5 (Home) wins by 3+ goals
+        ah_m2_5_home = home_margin_above(batch["scorelines"], 2.5)
+
+        def probability_to_odds(prob):
+            return round(1 / prob, 2) if prob > 0 else float('inf')
+
+        results = []
+        for i, (_, rows) in enumerate(histories):
+            if not rows:
+                results.append({"error": "No match data available for the selected teams and filters. Cannot calculate probabilities."})
+                continue
+            if batch["matches_dated"][i] == 0:
+                results.append({"error": "No valid historical match data found for the selected teams. Cannot calculate probabilities."})
+                continue
+            if batch["matches_valid"][i] == 0:
+                results.append({"error": "Insufficient valid odds data found in the historical matches. Cannot calculate probabilities."})
+                continue
+            host_win, draw, guest_win = (float(batch[k][i]) for k in ("host_win", "draw", "guest_win"))
+            goal = {k: float(batch[k][i]) for k in ("over_15", "over_25", "over_35", "btts")}
+            # AH -0.25 = average of AH 0.0 and AH -0.5, as in _calculate_win_probability
+            ah_m0_25_home = (host_win + draw + host_win) / 2.0
+            ah_m0_25_away = (guest_win + guest_win + draw) / 2.0
+            ah_home = float(ah_m2_5_home[i])
+            results.append({
+                'host_win_prob': round(host_win, 4),
+                'draw_prob': round(draw, 4),
+                'guest_win_prob': round(guest_win, 4),
+                'over_15_prob': round(goal["over_15"], 4),
+                'over_25_prob': round(goal["over_25"], 4),
+                'over_35_prob': round(goal["over_35"], 4),
+                'btts_prob': round(goal["btts"], 4),
+                'host_win_odds': probability_to_odds(host_win),
+                'draw_odds': probability_to_odds(draw),
+                'guest_win_odds': probability_to_odds(guest_win),
+                'over_15_odds': probability_to_odds(goal["over_15"]),
+                'over_25_odds': probability_to_odds(goal["over_25"]),
+                'over_35_odds': probability_to_odds(goal["over_35"]),
+                'btts_odds': probability_to_odds(goal["btts"]),
+                'ah_m0_25_home_prob': round(ah_m0_25_home, 4),
+                'ah_m0_25_away_prob': round(ah_m0_25_away, 4),
+                'ah_m0_25_home_odds': probability_to_odds(ah_m0_25_home),
+                'ah_m0_25_away_odds': probability_to_odds(ah_m0_25_away),
+                'ah_m2_5_home_prob': round(ah_home, 4),
+                'ah_m2_5_away_prob': round(1 - ah_home, 4),
+                'ah_m2_5_home_odds': probability_to_odds(ah_home),
+                'ah_m2_5_away_odds': probability_to_odds(1 - ah_home),
+                'confidence': round(float(batch["confidence"][i]), 2),
+                'calculation': {'method': 'analytic'},
+                'markets': price_markets(batch["scorelines"][i], markets) if markets else None,
+                'total_matches': int(batch["matches_valid"][i]),
+            })
+        return results
+
+    def compare_and_calculate(self, host_team, guest_team, country_name, filters, refresh=False, calculation=None):
+        """API-facing method to perform comparison and calculation
+
+        Rows come from the match history when it is fresh; otherwise only the matches
+        newer than the stored ones are scraped (refresh=True forces a full scrape).
+        calculation holds _calculate_win_probability options (simulations, seed).
+        """
         session_data = self.session.load()
         if not session_data:
              return {"error": "No valid session found. Please log in first."}, 401
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True, channel="msedge") # Headless for API
-            page = browser.new_page()
+        table, status_code = self._match_table(session_data, host_team, guest_team, country_name, filters, refresh)
+        if status_code != 200:
+            return table, status_code
+        self._stage("calculating")
+        return self._build_result(host_team, guest_team, table["headers"], table["rows"], calculation,
+                                  table.get("outcome_state"))
 
-            try:
-                # Apply session
-                self.session.apply(page, session_data)
-                page.goto(self.url)
-                page.wait_for_load_state("networkidle")
-                time.sleep(2)
-
-                if not self._is_logged_in(page):
-                     return {"error": "Session invalid or expired. Please log in again."}, 401
-
-                 # --- Perform the scraping steps ---
-
-                # Enter teams in compare form
-                if not self._enter_teams_in_compare_form(page, host_team, guest_team, country_name):
-                    return {"error": "Failed to enter teams in compare form"}, 500
-
-                # Configure filters
-                if not self._configure_filters(page, filters):
-                    return {"error": "Failed to configure filters"}, 500
-
-                # Navigate to start of table
-                if not self._navigate_to_start_of_table(page):
-                    return {"error": "Failed to navigate to start of table"}, 500
-
-                # Extract all table data
-                headers, all_rows = self._extract_all_table_data(page)
-                if not headers or not all_rows:
-                    return {"error": "No data extracted from table"}, 404 # Not found might be appropriate
-
-                # Create DataFrame
-                df = self._create_dataframe(headers, all_rows)
-                if df is None:
-                    return {"error": "Failed to create DataFrame from scraped data"}, 500
-
-                # Calculate win probability
-                probabilities_result = self._calculate_win_probability(df)
-
-                # Check if probabilities calculation returned an error
-                if "error" in probabilities_result:
-                    # Return the error message to the API client
-                    return {
-                        "success": False,
-                        "host_team": host_team['name'],
-                        "guest_team": guest_team['name'],
-                        "error": probabilities_result["error"],
-                        "total_matches_analyzed": len(df) if df is not None else 0,
-                    }, 404 # Using 404 Not Found to indicate no data, or 200 OK with success=False
-
-                # If successful, probabilities_result contains the data
-                # Return successful result with all metrics
-                # Inside the compare_and_calculate method in scraper.py, within the successful result return block
-                return {
-                    "success": True,
-                    "host_team": host_team['name'],
-                    "guest_team": guest_team['name'],
-                    "probabilities": {
-                        "host_win": probabilities_result.get('host_win_prob', 0),
-                        "draw": probabilities_result.get('draw_prob', 0),
-                        "guest_win": probabilities_result.get('guest_win_prob', 0),
-                        "over_1_5": probabilities_result.get('over_15_prob', 0),
-                        "over_2_5": probabilities_result.get('over_25_prob', 0),
-                        "over_3_5": probabilities_result.get('over_35_prob', 0),
-                        "btts": probabilities_result.get('btts_prob', 0),
-                        # --- Asian Handicap Probabilities ---
-                        "ah_m0_25_home_prob": probabilities_result.get('ah_m0_25_home_prob', 0),
-                        "ah_m0_25_away_prob": probabilities_result.get('ah_m0_25_away_prob', 0),
-                        # Add AH -2.5 probabilities
-                        "ah_m2_5_home_prob": probabilities_result.get('ah_m2_5_home_prob', 0),
-                        "ah_m2_5_away_prob": probabilities_result.get('ah_m2_5_away_prob', 0)
-                        # --- End Asian Handicap Probabilities ---
-                    },
-                    "odds": {
-                        "host_win": probabilities_result.get('host_win_odds', float('inf')),
-                        "draw": probabilities_result.get('draw_odds', float('inf')),
-                        "guest_win": probabilities_result.get('guest_win_odds', float('inf')),
-                        "over_1_5": probabilities_result.get('over_15_odds', float('inf')),
-                        "over_2_5": probabilities_result.get('over_25_odds', float('inf')),
-                        "over_3_5": probabilities_result.get('over_35_odds', float('inf')),
-                        "btts": probabilities_result.get('btts_odds', float('inf')),
-                        # --- Asian Handicap Odds ---
-                        "ah_m0_25_home_odds": probabilities_result.get('ah_m0_25_home_odds', float('inf')),
-                        "ah_m0_25_away_odds": probabilities_result.get('ah_m0_25_away_odds', float('inf')),
-                        # Add AH -2.5 odds
-                        "ah_m2_5_home_odds": probabilities_result.get('ah_m2_5_home_odds', float('inf')),
-                        "ah_m2_5_away_odds": probabilities_result.get('ah_m2_5_away_odds', float('inf'))
-                        # --- End Asian Handicap Odds ---
-                    },
-                    "confidence": probabilities_result.get('confidence', 0),
-                    "total_matches_analyzed": probabilities_result.get('total_matches', len(df)),
-                    "message": "Calculation completed successfully."
-                }, 200
-                # --- End Construct Response ---
+    def compare_batch(self, fixtures, country_name, filters, refresh=False, calculation=None):
+        """API-facing method to price a slate of fixtures sharing country and filters
 
-            except Exception as e:
-                print(f"Error in compare_and_calculate: {e}")
-                traceback.print_exc() # Log the full traceback
-                return {"error": f"Scraping/calculation failed: {str(e)}"}, 500
-            finally:
-                browser.close()
\ No newline at end of file
+        Each distinct host/guest pair is fetched once, BATCH_CONCURRENCY at a time on the
+        shared browser pool (or XHR client), then all fixtures are calculated together.
+        """
+        session_data = self.session.load()
+        if not session_data:
+             return {"error": "No valid session found. Please log in first."}, 401
+
+        pairs = self._unique_pairs(fixtures)
+        print(f"Batch of {len(fixtures)} fixtures needs {len(pairs)} match histories")
+        self._stage("fetching_match_histories")
+        scrapers = {key: self._fixture_scraper() for key in pairs}
+        with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(pairs)))) as executor:
+            tables = dict(zip(pairs, executor.map(
+                lambda key: scrapers[key]._match_table(session_data, *pairs[key], country_name, filters, refresh, report=False),
+                pairs)))
+        self._stage("calculating")
+        telemetry = {key: scraper.wait_telemetry for key, scraper in scrapers.items()}
+        return self._batch_results(fixtures, tables, calculation, telemetry), 200
+
+    def _fixture_scraper(self):
+        """A copy of this scraper for one fixture of a batch.
+
+        Session, pool, mode, budgets and the XHR recorder (its endpoints are locked) are
+        shared; the wait telemetry is the fixture's own, so fetches running side by side
+        neither share a list nor report each other's waits.
+        """
+        scraper = copy.copy(self)
+        scraper.wait_telemetry = WaitTelemetry()
+        scraper.progress = None
+        scraper._partial = None
+        return scraper
+
+    def _unique_pairs(self, fixtures):
+        """{(host id, guest id): (host_team, guest_team)} for the distinct fixtures of a batch"""
+        pairs = {}
+        for fixture in fixtures:
+            key = (str(fixture['host_team']['id']), str(fixture['guest_team']['id']))
+            pairs.setdefault(key, (fixture['host_team'], fixture['guest_team']))
+        return pairs
+
+    def _batch_results(self, fixtures, tables, calculation=None, telemetry=None):
+        """Per-fixture responses for a batch; tables maps (host id, guest id) to _match_table's result
+        and telemetry to the WaitTelemetry of that fixture's fetch
+
+        The vectorized kernel prices every fixture at once unless Monte Carlo is asked for.
+        """
+        calculation = calculation or {}
+        keys = [(str(f['host_team']['id']), str(f['guest_team']['id'])) for f in fixtures]
+        priced = {}
+        if calculation.get('method', 'analytic') == 'analytic':
+            ready = [key for key in tables if tables[key][1] == 200]
+            histories = [(tables[key][0]["headers"], tables[key][0]["rows"]) for key in ready]
+            priced = dict(zip(ready, self._calculate_win_probabilities_batch(histories, calculation.get('markets'))))
+
+        results = []
+        for index, (fixture, key) in enumerate(zip(fixtures, keys)):
+            table, status_code = tables[key]
+            if status_code != 200:
+                data = dict(table)
+            elif key in priced:
+                data, status_code = self._result_response(fixture['host_team'], fixture['guest_team'], priced[key],
+                                                          len(table["rows"]))
+            else:
+                data, status_code = self._build_result(fixture['host_team'], fixture['guest_team'],
+                                                       table["headers"], table["rows"], calculation)
+            data.update(fixture=index, status=status_code)
+            if telemetry and key in telemetry:
+                data.update(wait_seconds=telemetry[key].total_seconds(), wait_seconds_per_step=telemetry[key].summary())
+            data.setdefault("host_team", fixture['host_team']['name'])
+            data.setdefault("guest_team", fixture['guest_team']['name'])
+            results.append(data)
+        return {
+            "success": True,
+            "fixtures": len(fixtures),
+            "match_histories": len(tables),
+            "failed": sum(1 for r in results if r["status"] != 200),
+            "results": results,
+        }
+
+    def _match_table(self, session_data, host_team, guest_team, country_name, filters, refresh=False, report=True):
+        """Get the fixture's match-history table: ({"headers", "rows"}, 200) or (error, status)
+
+        report=False keeps the per-step stages quiet (batch fetches run side by side).
+        """
+        if report:
+            self._stage("match_history")
+        entry = self._history_entry(host_team, guest_team, filters, refresh)
+        if entry and entry["fresh"]:
+            return self._stored_table(host_team, guest_team, filters, entry), 200
+        known = get_match_history().known_row_test(entry)
+
+        if self.mode == "xhr":
+            client = get_xhr_client(session_data)
+            if client.can_fetch_table(filters):
+                if report:
+                    self._stage("fetching_table")
+                    self._start_pages(entry)
+                try:
+                    headers, new_rows = client.get_all_table_data(host_team['id'], guest_team['id'], known=known,
+                                                                  on_page=self._page_extracted)
+                    if headers and (new_rows or entry):
+                        return self._update_history(host_team, guest_team, filters, headers, new_rows, entry), 200
+                    print("XHR table fetch returned no rows, using the browser")
+                except (XhrEndpointMissing, requests.RequestException) as e:
+                    print(f"XHR table fetch failed ({e}), using the browser")
+
+        if report:
+            self._stage("waiting_for_browser")
+            self._start_pages(entry)
+        return self._run_in_browser(
+            session_data,
+            lambda page: self._scrape_match_table(page, host_team, guest_team, country_name, filters, entry, report),
+            "compare_and_calculate", "Scraping/calculation failed")
+
+    def _history_entry(self, host_team, guest_team, filters, refresh=False):
+        """Look up the stored match history for this fixture (None on a forced refresh)"""
+        if refresh:
+            return None
+        history = get_match_history()
+        entry = history.get(host_team['id'], guest_team['id'], filters)
+        if entry and entry["fresh"]:
+            history.record_hit(entry)
+            print(f"Match history: {len(entry['rows'])} stored rows are fresh ({entry['age_seconds']}s old), skipping the scrape")
+        elif entry:
+            print(f"Match history: {len(entry['rows'])} stored rows, fetching matches after {entry['latest_date']}")
+        return entry
+
+    def _update_history(self, host_team, guest_team, filters, headers, new_rows, entry):
+        """Store newly scraped rows; returns the table {"headers", "rows", "outcome_state"} including the stored rows
+
+        The outcome estimator state is extended with just the new rows when they sit on
+        top of the stored ones, and rebuilt from every row otherwise.
+        """
+        print(f"Match history: {len(new_rows)} new rows scraped")
+        history = get_match_history()
+        headers, all_rows = history.update(host_team['id'], guest_team['id'], filters, headers, new_rows, entry)
+        state = None
+        if (entry and entry.get("outcome_state") and entry["headers"] == headers
+                and len(all_rows) == len(entry["rows"]) + len(new_rows)):
+            state = extend_outcome_state(entry["outcome_state"], *self._outcome_arrays(headers, new_rows))
+        extended = state is not None
+        if state is None and all_rows:
+            state = outcome_state(*self._outcome_arrays(headers, all_rows))
+        if headers and all_rows:
+            history.put_outcome_state(host_team['id'], guest_team['id'], filters, state, len(all_rows), extended)
+        return {"headers": headers, "rows": all_rows, "outcome_state": state}
+
+    def _stored_table(self, host_team, guest_team, filters, entry):
+        """The table of a fresh match-history entry, filling in its estimator state if it has none yet"""
+        state = entry.get("outcome_state")
+        if state is None and entry["rows"]:
+            state = outcome_state(*self._outcome_arrays(entry["headers"], entry["rows"]))
+            get_match_history().put_outcome_state(host_team['id'], guest_team['id'], filters, state, len(entry["rows"]))
+        return {"headers": entry["headers"], "rows": entry["rows"], "outcome_state": state}
+
+    def _outcome_arrays(self, headers, rows):
+        """(win odds, draw odds, loss odds, date ordinals) float64 arrays of scraped table rows"""
+        if not rows:
+            return (np.array([]),) * 4
+        columns = self._table_columns(headers, rows[0])
+
+        def column(name):
+            index = columns.index(name) if name in columns else None
+            return np.array([row[index] if index is not None and len(row) > index else None for row in rows], dtype=object)
+
+        odds = [pd.to_numeric(column(name), errors='coerce').astype(np.float64) for name in ('Win', 'Draw', 'Loss')]
+        return (*odds, date_ordinals(column('Date')))
+
+    def _scrape_match_table(self, page, host_team, guest_team, country_name, filters, entry=None, report=True):
+        """Run the compare scrape on an already prepared page (the calculation runs after the page is released)"""
+        stage = self._stage if report else (lambda name: None)
+        resources = get_request_filter().track(page.context)
+        denied = self._logged_in_or_401(page)
+        if denied:
+            return denied
+
+         # --- Perform the scraping steps ---
+
+        # Enter teams in compare form
+        stage("entering_teams")
+        if not self._enter_teams_in_compare_form(page, host_team, guest_team, country_name):
+            return {"error": "Failed to enter teams in compare form"}, 500
+        stage("teams_resolved")
+
+        # Configure filters
+        stage("configuring_filters")
+        if not self._configure_filters(page, filters):
+            return {"error": "Failed to configure filters"}, 500
+        stage("filters_applied")
+
+        # Navigate to start of table
+        if not self._navigate_to_start_of_table(page):
+            return {"error": "Failed to navigate to start of table"}, 500
+
+        # Extract all table data (learning the paging XHR for xhr mode on the way)
+        stage("extracting_table")
+        record_context = {
+            "values": {"host_id": host_team.get('id'), "guest_id": guest_team.get('id')},
+            "meta": {"filters": filters},
+        }
+        known = get_match_history().known_row_test(entry)
+        headers, new_rows = self._extract_all_table_data(page, record_context, known)
+        print(f"Wait time per step for {host_team['name']} vs {guest_team['name']}: "
+              f"{self.wait_telemetry.summary()} (total {self.wait_telemetry.total_seconds()}s)")
+        print(f"Requests blocked: {resources.summary()}")
+        if not headers or not (new_rows or entry):
+            return {"error": "No data extracted from table"}, 404 # Not found might be appropriate
+
+        return self._update_history(host_team, guest_team, filters, headers, new_rows, entry), 200
+
+    def _build_result(self, host_team, guest_team, headers, all_rows, calculation=None, outcome_state=None):
+        """Turn scraped table rows into the API response (shared by the sync and async scrapers)
+
+        With the history's outcome_state the 1X2 probabilities come straight from its
+        running sums and the rows are not reprocessed.
+        """
+        if outcome_state is not None and all_rows:
+            probabilities_result = self._calculate_win_probability(
+                None, outcome=state_probabilities(outcome_state), **(calculation or {}))
+            return self._result_response(host_team, guest_team, probabilities_result, len(all_rows))
+
+        # Create DataFrame
+        df = self._create_dataframe(headers, all_rows)
+        if df is None:
+            return {"error": "Failed to create DataFrame from scraped data"}, 500
+
+        # Calculate win probability
+        probabilities_result = self._calculate_win_probability(df, **(calculation or {}))
+        return self._result_response(host_team, guest_team, probabilities_result, len(df))
+
+    def _result_response(self, host_team, guest_team, probabilities_result, total_rows):
+        """Format a _calculate_win_probability result as the API response"""
+        # Check if probabilities calculation returned an error
+        if "error" in probabilities_result:
+            # Return the error message to the API client
+            return {
+                "success": False,
+                "host_team": host_team['name'],
+                "guest_team": guest_team['name'],
+                "error": probabilities_result["error"],
+                "total_matches_analyzed": total_rows,
+            }, 404 # Using 404 Not Found to indicate no data, or 200 OK with success=False
+
+        # If successful, probabilities_result contains the data
+        # Return successful result with all metrics
+        # Inside the compare_and_calculate method in scraper.py, within the successful result return block
+        return {
+            "success": True,
+            "host_team": host_team['name'],
+            "guest_team": guest_team['name'],
+            "probabilities": {
+                "host_win": probabilities_result.get('host_win_prob', 0),
+                "draw": probabilities_result.get('draw_prob', 0),
+                "guest_win": probabilities_result.get('guest_win_prob', 0),
+                "over_1_5": probabilities_result.get('over_15_prob', 0),
+                "over_2_5": probabilities_result.get('over_25_prob', 0),
+                "over_3_5": probabilities_result.get('over_35_prob', 0),
+                "btts": probabilities_result.get('btts_prob', 0),
+                # --- Asian Handicap Probabilities ---
+                "ah_m0_25_home_prob": probabilities_result.get('ah_m0_25_home_prob', 0),
+                "ah_m0_25_away_prob": probabilities_result.get('ah_m0_25_away_prob', 0),
+                # Add AH -2.5 probabilities
+                "ah_m2_5_home_prob": probabilities_result.get('ah_m2_5_home_prob', 0),
+                "ah_m2_5_away_prob": probabilities_result.get('ah_m2_5_away_prob', 0)
+                # --- End Asian Handicap Probabilities ---
+            },
+            "odds": {
+                "host_win": probabilities_result.get('host_win_odds', float('inf')),
+                "draw": probabilities_result.get('draw_odds', float('inf')),
+                "guest_win": probabilities_result.get('guest_win_odds', float('inf')),
+                "over_1_5": probabilities_result.get('over_15_odds', float('inf')),
+                "over_2_5": probabilities_result.get('over_25_odds', float('inf')),
+                "over_3_5": probabilities_result.get('over_35_odds', float('inf')),
+                "btts": probabilities_result.get('btts_odds', float('inf')),
+                # --- Asian Handicap Odds ---
+                "ah_m0_25_home_odds": probabilities_result.get('ah_m0_25_home_odds', float('inf')),
+                "ah_m0_25_away_odds": probabilities_result.get('ah_m0_25_away_odds', float('inf')),
+                # Add AH -2.5 odds
+                "ah_m2_5_home_odds": probabilities_result.get('ah_m2_5_home_odds', float('inf')),
+                "ah_m2_5_away_odds": probabilities_result.get('ah_m2_5_away_odds', float('inf'))
+                # --- End Asian Handicap Odds ---
+            },
+            "confidence": probabilities_result.get('confidence', 0),
+            "calculation": probabilities_result.get('calculation'),
+            "markets": probabilities_result.get('markets'),
+            "total_matches_analyzed": probabilities_result.get('total_matches', total_rows),
+            "message": "Calculation completed successfully."
+        }, 200
+        # --- End Construct Response ---
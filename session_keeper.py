@@ -0,0 +1,229 @@
+import hmac, os, threading, time, traceback
+from datetime import datetime
+import requests
+from async_scraper import AsyncCornerStatsAuth, get_async_engine
+from browser_pool import get_browser_pool
+from cache_store import get_session_store
+from scraper import CornerStatsAuth
+from xhr_client import get_xhr_client
+
+class SessionKeeper:
+    """Keeps stored site sessions usable so user requests never meet a cold or expired one.
+
+    ``reuse_for_login`` lets /api/login answer from a stored session that was
+    verified recently (or passes a quick HTTP probe) instead of driving the login
+    form. A background thread
+      - every ``warm_interval``: re-verifies the sessions of users active in the last
+        ``active_window`` and keeps one page per active user parked, logged in, on
+        the compare form of the configured engine (a pooled browser, or the async
+        engine's positioned pages), where ``login`` also runs;
+      - every ``interval``: probes sessions nearing their expiry; accepted ones move
+        their expiry only as far as the site's cookies confirm, and the rest log in again.
+    Sessions the site rejects are re-authenticated with the stored credentials in a
+    browser; if that fails too they are dropped so the next login runs the form.
+    """
+    def __init__(self, store=None, pool=None, interval=None, refresh_before=None, verify_ttl=None,
+                 warm_interval=None, active_window=None):
+        self.store = store or get_session_store()
+        self.pool = pool
+        self.interval = interval or int(os.environ.get("SESSION_PROBE_INTERVAL", 900))
+        self.refresh_before = refresh_before or int(os.environ.get("SESSION_REFRESH_BEFORE", 3 * 3600))
+        # A session verified less than this long ago is trusted without probing
+        self.verify_ttl = verify_ttl if verify_ttl is not None else int(os.environ.get("SESSION_VERIFY_TTL", 600))
+        self.warm_interval = warm_interval or int(os.environ.get("SESSION_WARM_INTERVAL", 60))
+        self.active_window = active_window or int(os.environ.get("SESSION_ACTIVE_WINDOW", 1800))
+        self.park_pages = os.environ.get("SESSION_PARK_PAGES", "1") == "1"
+        # Scraper engine that logs in and parks pages: 'sync' (browser pool) or 'async'
+        self.engine = "sync"
+        self._lock = threading.Lock()
+        self._thread = None
+        self._active = {} # email -> last request time
+        self._last_expiry_pass = time.monotonic()
+        self._stats = {"logins_reused": 0, "logins_probed": 0, "probes": 0, "probe_rejections": 0,
+                       "probe_errors": 0, "extended": 0, "reauthenticated": 0, "reauth_failures": 0,
+                       "pages_parked": 0}
+
+    def start(self):
+        """Start the background probe loop (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="session-keeper", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.warm_interval)
+            try:
+                self.keep_active_warm()
+                if time.monotonic() - self._last_expiry_pass >= self.interval:
+                    self._last_expiry_pass = time.monotonic()
+                    self.refresh_expiring()
+            except Exception as e:
+                print(f"Session keeper pass failed: {e}")
+                traceback.print_exc()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _pool(self):
+        return self.pool or get_browser_pool()
+
+    def login(self, email, password):
+        """Drive the login form on the configured engine; saves the session and keeps the
+        logged-in page parked there for the user. Returns whether the login succeeded."""
+        if self.engine == "async":
+            return AsyncCornerStatsAuth().login_with_engine(get_async_engine(), email, password)
+        return CornerStatsAuth().login_with_pool(self._pool(), email, password)
+
+    def touch(self, email):
+        """Note that the user just made a request"""
+        with self._lock:
+            self._active[(email or "").strip().lower()] = time.time()
+
+    def active_users(self):
+        """Emails seen within active_window, most recent first"""
+        cutoff = time.time() - self.active_window
+        with self._lock:
+            for email in [e for e, seen in self._active.items() if seen < cutoff]:
+                del self._active[email]
+            return [e for e, _ in sorted(self._active.items(), key=lambda kv: -kv[1])]
+
+    def recently_verified(self, session):
+        return time.time() - session.get("verified_at", 0) < self.verify_ttl
+
+    def verify(self, email, session):
+        """Probe the session over plain HTTP. True (and marked verified) if the site accepts it,
+        False if it shows the Login link, None if the probe itself failed."""
+        self._count("probes")
+        try:
+            client = get_xhr_client(session)
+            if not client.is_logged_in():
+                self._count("probe_rejections")
+                return False
+        except requests.RequestException as e:
+            print(f"Session probe for {email} failed: {e}")
+            self._count("probe_errors")
+            return None
+        self._mark_verified(email, session, client.cookie_values(), client.cookie_expiries())
+        return True
+
+    def _mark_verified(self, email, session, cookie_values, cookie_expiries):
+        """Store the session as verified now, with any rotated cookie values.
+
+        The stored expiry only moves when the site re-set the session's cookies with an
+        expiry, to the earliest of those; otherwise it stays and the session is logged
+        in again before it runs out.
+        """
+        cookies = []
+        for cookie in session.get("cookies", []):
+            cookie = dict(cookie, value=cookie_values.get(cookie["name"], cookie["value"]))
+            if cookie["name"] in cookie_expiries:
+                cookie["expires"] = cookie_expiries[cookie["name"]]
+            cookies.append(cookie)
+        data = dict(session, cookies=cookies, verified_at=time.time())
+        confirmed = [cookie_expiries[c["name"]] for c in session.get("cookies", []) if c["name"] in cookie_expiries]
+        if confirmed:
+            expires_at = min(min(confirmed), time.time() + self.store.DEFAULT_LIFETIME)
+            data["expires"] = datetime.fromtimestamp(expires_at).isoformat()
+            self._count("extended")
+        if cookies != session.get("cookies", []):
+            # A new stamp makes pooled browsers and XHR clients pick up the rotated cookies
+            data["timestamp"] = datetime.now().isoformat()
+        self.store.save(email, data)
+
+    def reuse_for_login(self, email, password):
+        """Return "cached" or "verified" if the stored session for these credentials can
+        answer a login without the browser, else None"""
+        session = self.store.load(email)
+        if not session or not hmac.compare_digest(str(session.get("password", "")).encode(), str(password).encode()):
+            return None
+        if self.recently_verified(session):
+            self._count("logins_reused")
+            return "cached"
+        if self.verify(email, session):
+            self._count("logins_probed")
+            return "verified"
+        return None
+
+    def reauthenticate(self, email, session):
+        """Log in again with the stored credentials; returns the new session or None (then it is dropped)"""
+        password = session.get("password")
+        logged_in = False
+        if password:
+            try:
+                logged_in = self.login(session.get("email") or email, password)
+            except Exception as e:
+                print(f"Re-authentication of {email} failed: {e}")
+        if not logged_in:
+            print(f"Could not re-authenticate {email}, dropping the stored session")
+            self._count("reauth_failures")
+            self.store.delete(email)
+            return None
+        print(f"Re-authenticated {email} ahead of expiry")
+        self._count("reauthenticated")
+        return self.store.load(email)
+
+    def refresh_expiring(self):
+        """Probe every session expiring within refresh_before; log in again unless the site confirmed a later expiry"""
+        for email, session in self.store.expiring(self.refresh_before):
+            result = self.verify(email, session)
+            if result:
+                session = self.store.load(email) or session
+            expires_at = datetime.fromisoformat(session["expires"]).timestamp() if session.get("expires") else 0
+            left = expires_at - time.time()
+            # Accepted but not confirmed for longer: log in again while the session still works.
+            # A failed probe is retried next pass, unless the session would be gone by then
+            if result is False or (result and left < self.refresh_before) or (result is None and left < self.interval):
+                self.reauthenticate(email, session)
+
+    def _park(self, session):
+        if self.engine == "async":
+            return get_async_engine().preposition(session)
+        return self._pool().park(session)
+
+    def keep_active_warm(self):
+        """Verify the sessions of active users and park one logged-in page for each (as many as there are pages)"""
+        users = self.active_users()
+        if self.park_pages:
+            if self.engine == "async":
+                users = users[:get_async_engine().positioned_pages]
+            else:
+                pool = self._pool()
+                users = users[:pool.size]
+                pool.set_parked_users(users)
+        for email in users:
+            session = self.store.load(email)
+            if session is None:
+                continue
+            if not self.recently_verified(session):
+                result = self.verify(email, session)
+                if result is False:
+                    session = self.reauthenticate(email, session)
+                elif result:
+                    session = self.store.load(email)
+            if session is not None and self.park_pages and self._park(session):
+                self._count("pages_parked")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({"running": self._thread is not None, "interval_seconds": self.interval,
+                      "refresh_before_seconds": self.refresh_before, "verify_ttl_seconds": self.verify_ttl,
+                      "warm_interval_seconds": self.warm_interval, "park_pages": self.park_pages,
+                      "engine": self.engine,
+                      "active_users": len(self.active_users())})
+        return stats
+
+_keeper = None
+_keeper_lock = threading.Lock()
+
+def get_session_keeper():
+    """Return the process-wide session keeper, creating and starting it on first use"""
+    global _keeper
+    with _keeper_lock:
+        if _keeper is None:
+            _keeper = SessionKeeper()
+            _keeper.start()
+        return _keeper
@@ -0,0 +1,94 @@
+import json, threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: the first caller for a key runs the work,
+    later callers for the same key wait for it and get the same result (or exception).
+
+    With a shareable(result) test, waiters only take results that pass it; on any
+    other result or an exception they run the work themselves (e.g. the first caller's
+    session had expired, theirs may not have).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"leaders": 0, "coalesced": 0, "failures": 0, "retried": 0}
+
+    def do(self, key, fn, on_wait=None, shareable=None):
+        """Return (fn() result, shared); on_wait() is called when this caller joins a running call"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                leader = True
+
+        if not leader:
+            if on_wait:
+                on_wait()
+            call.done.wait()
+            if shareable is not None and (call.error is not None or not shareable(call.result)):
+                with self._lock:
+                    self._stats["retried"] += 1
+                return fn(), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._stats["failures"] += 1
+            raise
+        finally:
+            # Forget the key first so callers arriving from now on start a new call
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            stats["waiting"] = sum(call.waiters for call in self._calls.values())
+        return stats
+
+def _normalize(value):
+    """Case/whitespace-insensitive form of a JSON-like value (lists keep their order)"""
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, dict):
+        return {str(k).strip().lower(): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def compare_key(host_team, guest_team, country_name, filters, **options):
+    """Single-flight key of a compare: host id, guest id, country, filters and the calculation options"""
+    return "compare:" + json.dumps(
+        [str(host_team['id']), str(guest_team['id']), _normalize(country_name), _normalize(filters), options],
+        sort_keys=True, default=str)
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight():
+    """Return the process-wide single-flight group, creating it on first use"""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
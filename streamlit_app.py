@@ -1,6 +1,7 @@
 # streamlit_app.py
 import streamlit as st
 import requests
+import json
 import time
 
 # --- Configuration ---
@@ -43,6 +44,60 @@ def make_api_request(method, endpoint, data=None, params=None):
                 error_msg += f" | Response text: {e.response.text}"
         return {"error": error_msg}, status_code
 
+def stream_api_request(endpoint, data):
+    """POST to a streaming (NDJSON) endpoint and yield its events as they arrive.
+
+    Request failures are yielded as a final {"event": "result"} carrying the error.
+    """
+    url = f"{FLASK_API_BASE_URL}{endpoint}"
+    headers = {"Content-Type": "application/json"}
+    if st.session_state.get('auth_token'):
+        headers["Authorization"] = f"Bearer {st.session_state['auth_token']}"
+
+    try:
+        with requests.post(url, headers=headers, json=data, stream=True) as response:
+            if response.status_code != 200:
+                try:
+                    error_data = response.json()
+                except ValueError:
+                    error_data = {"error": response.text}
+                yield {"event": "result", "status": response.status_code, "result": error_data}
+                return
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    except requests.exceptions.RequestException as e:
+        yield {"event": "result", "status": 500, "result": {"error": f"API request failed: {e}"}}
+
+# What the user sees for each stage event of a streamed compare
+STAGE_LABELS = {
+    "match_history": "🗄️ Checking stored match history...",
+    "waiting_for_identical_request": "⏳ Joining an identical request already in progress...",
+    "fetching_table": "📥 Fetching match table...",
+    "waiting_for_browser": "⏳ Waiting for a free browser...",
+    "entering_teams": "🔎 Looking up teams...",
+    "teams_resolved": "✅ Teams resolved",
+    "configuring_filters": "⚙️ Applying filters...",
+    "filters_applied": "✅ Filters applied",
+    "extracting_table": "📄 Reading match table...",
+    "calculating": "🧠 Calculating probabilities...",
+}
+
+def display_provisional(event, placeholder):
+    """Render the provisional estimate sent after a table page"""
+    provisional = event.get('provisional')
+    with placeholder.container():
+        st.caption(f"Page {event['page']} read: {event['total_rows']} matches so far. Provisional estimate, "
+                   "the final result follows when all pages are in.")
+        if not provisional:
+            return
+        cols = st.columns(5)
+        cols[0].metric("Host Win", f"{provisional['host_win']:.1%}")
+        cols[1].metric("Draw", f"{provisional['draw']:.1%}")
+        cols[2].metric("Guest Win", f"{provisional['guest_win']:.1%}")
+        cols[3].metric("Over 2.5", f"{provisional['over_2_5']:.1%}")
+        cols[4].metric("BTTS", f"{provisional['btts']:.1%}")
+
 def display_probability_card(label, probability, odds, column):
     """
     Helper to display a probability metric in a styled card using Streamlit elements.
@@ -117,13 +172,13 @@ def render_sidebar():
         st.info("Predict match outcomes using data from Corner-Stats.com.")
 
 def fetch_leagues_teams():
-    """Handles fetching leagues and teams."""
+    """Handles fetching the leagues of a country; teams are loaded per league when it is picked."""
     if not st.session_state['selected_country'].strip():
         st.warning("⚠️ Please enter a country name.")
         return
 
-    with st.spinner("Fetching data..."):
-        data, status = make_api_request('GET', '/api/leagues_teams', params={'country_name': st.session_state['selected_country']})
+    with st.spinner("Fetching leagues..."):
+        data, status = make_api_request('GET', '/api/leagues', params={'country_name': st.session_state['selected_country']})
 
     if status == 200 and data and 'leagues' in data:
         st.session_state['leagues_teams_data'] = data
@@ -141,6 +196,22 @@ def fetch_leagues_teams():
         st.error(f"❌ Failed to fetch data (Status: {status}). {error_detail}")
         st.session_state['leagues_teams_data'] = None
 
+def fetch_teams(country_name, league):
+    """Loads the teams of one league on demand and caches them on the league entry."""
+    with st.spinner(f"Fetching teams for {league['name']}..."):
+        data, status = make_api_request('GET', '/api/teams', params={'country_name': country_name, 'league_id': league['id']})
+
+    if status == 200 and data and 'teams' in data:
+        league['teams'] = data['teams']
+    elif status == 401:
+        st.error("❌ Session expired. Please log in again.")
+        st.session_state['logged_in'] = False
+        st.session_state['auth_token'] = None
+        st.rerun()
+    else:
+        error_detail = data.get('error', 'Unknown error') if isinstance(data, dict) else data
+        st.error(f"❌ Failed to fetch teams (Status: {status}). {error_detail}")
+
 def select_teams_and_filters():
     """Handles team selection and filter configuration UI."""
     data = st.session_state['leagues_teams_data']
@@ -155,6 +226,9 @@ def select_teams_and_filters():
     selected_league_name = st.selectbox("🏆 Select League:", league_names, key='league_select')
     selected_league = next((l for l in leagues if l['name'] == selected_league_name), None)
 
+    if selected_league and 'teams' not in selected_league:
+        fetch_teams(country_name, selected_league)
+
     if not selected_league or 'teams' not in selected_league:
         st.warning("⚠️ League data is incomplete.")
         return None, None, None, None, None, None, None
@@ -305,8 +379,22 @@ def handle_prediction():
     }
 
     st.header("4️⃣ Results")
-    with st.spinner("🧠 Calculating probabilities..."):
-        result_data, status_code = make_api_request('POST', '/api/compare_and_calculate', data=payload)
+    # Stream stage updates and provisional estimates instead of waiting on one final answer
+    stage_placeholder = st.empty()
+    provisional_placeholder = st.empty()
+    result_data, status_code = None, 500
+    stage_placeholder.info("🚀 Starting...")
+    for event in stream_api_request('/api/compare_and_calculate/stream', payload):
+        if event['event'] == 'stage':
+            if event['stage'] == 'page_extracted':
+                stage_placeholder.info(f"📄 Read table page {event['page']} ({event['rows']} matches)")
+                display_provisional(event, provisional_placeholder)
+            else:
+                stage_placeholder.info(STAGE_LABELS.get(event['stage'], event['stage']))
+        elif event['event'] == 'result':
+            result_data, status_code = event['result'], event['status']
+    stage_placeholder.empty()
+    provisional_placeholder.empty()
 
     display_results(result_data, status_code)
     
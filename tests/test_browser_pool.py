@@ -0,0 +1,103 @@
+import browser_pool
+import resource_filter
+from browser_pool import BrowserPool
+from resource_filter import RequestFilter
+
+THIRD_PARTY_SCRIPT = "https://www.captcha-provider.example/api.js"
+
+class FakeRequest:
+    def __init__(self, url, resource_type):
+        self.url = url
+        self.resource_type = resource_type
+
+class FakeRoute:
+    def __init__(self, url, resource_type):
+        self.request = FakeRequest(url, resource_type)
+        self.outcome = None
+
+    def continue_(self):
+        self.outcome = "continued"
+
+    def abort(self, reason=None):
+        self.outcome = "aborted"
+
+class FakeLocator:
+    def wait_for(self, **kwargs):
+        pass
+
+class FakePage:
+    def __init__(self, context):
+        self.context = context
+
+    def request(self, url, resource_type):
+        """What a page load of url would do: pass it through the context's route handlers"""
+        route = FakeRoute(url, resource_type)
+        for handler in self.context.handlers:
+            handler(route)
+        return route.outcome or "continued"
+
+    def goto(self, url):
+        self.request(url, "document")
+
+    def locator(self, selector):
+        return FakeLocator()
+
+    def evaluate(self, js):
+        return 1
+
+    def is_closed(self):
+        return False
+
+    def set_extra_http_headers(self, headers):
+        pass
+
+class FakeContext:
+    def __init__(self):
+        self.handlers = []
+
+    def route(self, pattern, handler):
+        self.handlers.append(handler)
+
+    def clear_cookies(self):
+        pass
+
+    def add_cookies(self, cookies):
+        pass
+
+    def new_page(self):
+        return FakePage(self)
+
+class FakeBrowser:
+    def new_context(self, **options):
+        return FakeContext()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+class FakePlaywright:
+    class chromium:
+        @staticmethod
+        def launch(**kwargs):
+            return FakeBrowser()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def test_login_lets_third_party_requests_through(monkeypatch):
+    monkeypatch.setattr(browser_pool, "sync_playwright", FakePlaywright)
+    monkeypatch.setattr(resource_filter, "_filter", RequestFilter(enabled=True))
+    pool = BrowserPool(size=1, health_check=False, channel="", position_timeout=1)
+    try:
+        def do_login(page):
+            return page.request(THIRD_PARTY_SCRIPT, "script") == "continued", {"email": "a@b.c", "timestamp": 1}
+        assert pool.login(do_login, "a@b.c") is True
+        # The same context filters again once the login is over
+        assert pool.run(lambda page: page.request(THIRD_PARTY_SCRIPT, "script")) == "aborted"
+    finally:
+        pool.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from probability import (analytic_goal_markets, extend_outcome_state, goal_markets, home_margin_above,
+                         merge_outcome_states, outcome_probabilities, outcome_state, price_markets,
+                         scoreline_matrix, simulate_scorelines, state_probabilities)
+
+def history(n, latest, seed):
+    """n matches newest first (one per day back from latest), as the table lists them"""
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(1.2, 6.0, n), rng.uniform(2.5, 4.5, n), rng.uniform(1.2, 6.0, n),
+            latest - np.arange(n, dtype=np.float64))
+
+def concat(newer, older):
+    return tuple(np.concatenate([a, b]) for a, b in zip(newer, older))
+
+def assert_same_state(got, expected):
+    assert got["matches_dated"] == expected["matches_dated"]
+    assert got["matches_valid"] == expected["matches_valid"]
+    assert got["weighted"] == pytest.approx(expected["weighted"], rel=1e-12)
+    assert got["mean"] == pytest.approx(expected["mean"], rel=1e-12)
+    assert got["m2"] == pytest.approx(expected["m2"], rel=1e-9)
+    assert (got["latest"], got["oldest"]) == (expected["latest"], expected["oldest"])
+
+def test_extended_state_equals_rebuild_after_delta():
+    stored = history(80, 19000.0, seed=1)
+    delta = history(12, 19012.0, seed=2) # Played after every stored match
+    extended = extend_outcome_state(outcome_state(*stored), *delta)
+    rebuilt = outcome_state(*concat(delta, stored))
+    assert_same_state(extended, rebuilt)
+    assert state_probabilities(extended) == pytest.approx(outcome_probabilities(*concat(delta, stored)))
+
+def test_extending_with_older_matches_needs_a_rebuild():
+    stored = history(20, 19000.0, seed=3)
+    assert extend_outcome_state(outcome_state(*stored), *history(5, 18990.0, seed=4)) is None
+
+def test_merging_older_pages_equals_rebuild():
+    first, second = history(40, 19000.0, seed=5), history(40, 18960.0, seed=6)
+    merged = merge_outcome_states(outcome_state(*first), outcome_state(*second))
+    assert_same_state(merged, outcome_state(*concat(first, second)))
+
+def settle(value, line, odds):
+    """Profit per unit stake of a bet winning when value > line (quarter lines split in two half stakes)"""
+    halves = (line - 0.25, line + 0.25) if round(line * 4) % 2 == 1 else (line,)
+    return np.mean([np.where(value > h, odds - 1, np.where(value == h, 0.0, -1.0)) for h in halves], axis=0)
+
+@pytest.fixture
+def matrix():
+    return scoreline_matrix(0.5, 0.27, 0.23)
+
+def test_quarter_line_fair_odds_have_zero_expected_value(matrix):
+    lines = [1.75, 2.25, 2.5, 2.75, 3.0]
+    handicaps = [-1.25, -0.75, -0.25, 0.0, 0.25, 0.75]
+    priced = price_markets(matrix, {"over_under": lines, "asian_handicap": handicaps})
+    goals = np.arange(matrix.shape[0])
+    totals = goals[:, None] + goals[None, :]
+    margins = goals[:, None] - goals[None, :]
+    probs = matrix / matrix.sum()
+    for line in lines:
+        market = priced["over_under"][f"{line:g}"]
+        # Odds are rounded to cents, so EV is zero up to that rounding
+        assert (settle(totals, line, market["over_odds"]) * probs).sum() == pytest.approx(0, abs=0.01)
+        assert (settle(-totals, -line, market["under_odds"]) * probs).sum() == pytest.approx(0, abs=0.01)
+    for handicap in handicaps:
+        market = priced["asian_handicap"][f"{handicap:g}"]
+        # Home covers when margin + handicap > 0; the away side takes the other half of the book
+        assert (settle(margins, -handicap, market["home_odds"]) * probs).sum() == pytest.approx(0, abs=0.01)
+        assert (settle(-margins, handicap, market["away_odds"]) * probs).sum() == pytest.approx(0, abs=0.01)
+
+def test_ah_minus_2_5_matches_home_margin_above(matrix):
+    market = price_markets(matrix, {"asian_handicap": [-2.5]})["asian_handicap"]["-2.5"]
+    expected = float(home_margin_above(matrix, 2.5))
+    assert market["home"] == round(expected, 4)
+    assert market["away"] == round(1 - expected, 4)
+    assert market["push"] == 0
+
+def test_seeded_monte_carlo_is_reproducible_and_close_to_analytic():
+    args = (0.46, 0.28, 0.26)
+    counts = simulate_scorelines(*args, num_simulations=1_000_000, seed=42)
+    assert np.array_equal(counts, simulate_scorelines(*args, num_simulations=1_000_000, seed=42))
+    assert counts.sum() == 1_000_000
+    simulated, analytic = goal_markets(counts), analytic_goal_markets(*args)
+    for market in ("over_15", "over_25", "over_35", "btts"):
+        assert simulated[market] == pytest.approx(analytic[market], abs=0.005)
+    assert counts / counts.sum() == pytest.approx(scoreline_matrix(*args), abs=0.003)
@@ -0,0 +1,47 @@
+import pytest
+from scraper import EXTRACT_TABLE_JS
+from xhr_client import parse_table
+
+TABLE_HTML = """
+<table class="data-table">
+  <thead><tr><th>Date</th><th>Team1</th><th style="display:none">Hidden</th><th>Score</th><th>Team2</th></tr></thead>
+  <tbody class="tableData">
+    <tr class="tr__main">
+      <td>12.03.2024</td>
+      <td><a href="/t/1">Levski <b>Sofia</b></a> <a href="/t/1/stats">stats</a></td>
+      <td class="td__exclude">x</td>
+      <td>2 : 1</td>
+      <td><a href="/t/2">CSKA</a><a href="/t/2/form">form</a></td>
+      <td class="td__details"><a href="/m/1">details</a></td>
+    </tr>
+    <tr class="tr__main">
+      <td>05.02.2024</td><td>Slavia</td><td>0 : 0</td><td><a href="/t/4">Lokomotiv</a> (Plovdiv)</td>
+    </tr>
+  </tbody>
+</table>
+"""
+
+EXPECTED_ROWS = [
+    ["12.03.2024", "Levski Sofia", "2 : 1", "CSKA"],
+    ["05.02.2024", "Slavia", "0 : 0", "Lokomotiv"],
+]
+
+def test_parser_takes_first_link_only():
+    headers, rows = parse_table(TABLE_HTML)
+    assert headers == ["Date", "Team1", "Score", "Team2"]
+    assert rows == EXPECTED_ROWS
+
+def test_parser_matches_browser_extraction():
+    sync_api = pytest.importorskip("playwright.sync_api")
+    with sync_api.sync_playwright() as p:
+        try:
+            browser = p.chromium.launch()
+        except Exception as e:
+            pytest.skip(f"No browser to run EXTRACT_TABLE_JS: {e}")
+        try:
+            page = browser.new_page()
+            page.set_content(TABLE_HTML)
+            extracted = page.locator("table.data-table").evaluate(EXTRACT_TABLE_JS)
+        finally:
+            browser.close()
+    assert (extracted["headers"], extracted["rows"]) == parse_table(TABLE_HTML)
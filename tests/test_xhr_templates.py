@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+from scraper import CornerStatsDataScraper
+from xhr_client import templatize_request, fill_template, has_placeholder, changed_params
+
+TABLE_URL = "https://corner-stats.com/ajax/matches"
+
+def _request(page, body_extra=""):
+    return SimpleNamespace(method="POST", url=f"{TABLE_URL}?lang=en", headers={},
+                           post_data=f"team1=12&team2=34&filter_home%5B%5D=2&filter_tourn%5B%5D=2&page={page}{body_extra}")
+
+def test_page_placeholder_only_on_paging_key():
+    template = templatize_request("POST", TABLE_URL, _request(2).post_data, keys={"page": "page"})
+    _, _, body = fill_template(template, page=7)
+    params = parse_qs(body)
+    assert params["page"] == ["7"]
+    # Filters that happen to equal the captured page number stay as they were
+    assert params["filter_home[]"] == ["2"]
+    assert params["filter_tourn[]"] == ["2"]
+
+def test_ambiguous_value_gets_no_placeholder():
+    template = templatize_request("POST", TABLE_URL, _request(2).post_data, {"page": 2, "host_id": 12})
+    assert not has_placeholder(template, "page")
+    assert has_placeholder(template, "host_id")
+    _, _, body = fill_template(template, host_id=99)
+    assert parse_qs(body)["filter_home[]"] == ["2"]
+    assert parse_qs(body)["team1"] == ["99"]
+
+def test_literal_braces_survive_format():
+    template = templatize_request("GET", TABLE_URL + "?q=%7Bx%7D&page=2", keys={"page": "page"})
+    _, url, _ = fill_template(template, page=3)
+    assert parse_qs(urlsplit(url).query) == {"q": ["{x}"], "page": ["3"]}
+
+def test_paging_key_from_two_requests():
+    first, second = _request(2), _request(3)
+    assert changed_params((first.url, first.post_data), (second.url, second.post_data)) == ["page"]
+    scraper = CornerStatsDataScraper.__new__(CornerStatsDataScraper)
+    assert scraper._paging_key([first, second]) == ("page", 2, 1)
+    # Offset-based paging (rows per page)
+    assert scraper._paging_key([_request(100), _request(200)]) == ("page", 100, 100)
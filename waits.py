@@ -0,0 +1,190 @@
+import itertools, threading, time
+
+# Per-step timeout budgets (ms). A step that runs out of budget is recorded as timed out
+# and the scrape carries on, just like the fixed sleeps it replaces did.
+DEFAULT_BUDGETS_MS = {
+    "leagues_loaded": 10000,
+    "teams_loaded": 10000,
+    "search_results": 8000,
+    "team_selected": 2000,
+    "compare_ready": 15000,
+    "results_per_page": 10000,
+    "filter_applied": 10000,
+    "table_page": 15000,
+    "login_ready": 10000,
+    "login_result": 10000,
+}
+
+# Signature of the data shown by the target: its data rows (table rows with more than one
+# cell, so a colspan "loading" row does not count) or real options (select), with the text
+# of the first and last one. The target is looked up again each time, so a wholesale
+# re-render is seen too.
+_DATA_SIGNATURE_JS = """
+selector => {
+    const el = document.querySelector(selector);
+    if (!el) return {count: -1, text: ''};
+    const items = el.matches('select')
+        ? Array.from(el.options).filter(o => o.value && o.value !== '0')
+        : Array.from(el.querySelectorAll('tr')).filter(r => r.cells.length > 1 && !r.closest('thead'));
+    const text = items.length ? items[0].textContent + '|' + items[items.length - 1].textContent : '';
+    return {count: items.length, text: items.length + '|' + text};
+}
+"""
+_SNAPSHOT_DATA_JS = """
+([selector, key]) => {
+    window.__csWatch = window.__csWatch || {};
+    // Resource timings tell when the site's XHRs answer; clearing keeps the buffer from filling up
+    performance.clearResourceTimings();
+    window.__csWatch[key] = {before: (%s)(selector).text, since: performance.now()};
+}
+""" % _DATA_SIGNATURE_JS
+# Time given to an answered XHR's handler to render its result
+XHR_RENDER_MS = 100
+# True once there are data rows differing from the snapshot, or once an XHR sent after the
+# action has answered and its handler had time to render (the same rows, or none, are a
+# result too). A cleared tbody or a loading row alone never counts.
+_DATA_CHANGED_JS = """
+([selector, key]) => {
+    const watch = window.__csWatch && window.__csWatch[key];
+    if (!watch) return false;
+    const now = (%s)(selector);
+    if (now.text !== watch.before && now.count > 0) return true;
+    const answered = performance.getEntriesByType('resource').filter(e =>
+        ['xmlhttprequest', 'fetch'].includes(e.initiatorType) && e.startTime >= watch.since && e.responseEnd > 0);
+    return answered.length > 0 && now.count >= 0
+        && performance.now() - Math.max(...answered.map(e => e.responseEnd)) >= %d;
+}
+""" % (_DATA_SIGNATURE_JS, XHR_RENDER_MS)
+_FORGET_DATA_JS = "key => { if (window.__csWatch) delete window.__csWatch[key]; }"
+COUNT_AT_LEAST_JS = "([selector, n]) => document.querySelectorAll(selector).length >= n"
+
+_watch_ids = itertools.count(1)
+
+class WaitTelemetry:
+    """Records how long each wait step really took, per scrape and process-wide"""
+    _global = {}
+    _global_lock = threading.Lock()
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, step, elapsed, timed_out):
+        self.records.append({"step": step, "seconds": round(elapsed, 3), "timed_out": timed_out})
+        with WaitTelemetry._global_lock:
+            agg = WaitTelemetry._global.setdefault(
+                step, {"count": 0, "timeouts": 0, "seconds_total": 0.0, "seconds_max": 0.0})
+            agg["count"] += 1
+            agg["timeouts"] += int(timed_out)
+            agg["seconds_total"] += elapsed
+            agg["seconds_max"] = max(agg["seconds_max"], elapsed)
+        if timed_out:
+            print(f"   Wait '{step}' used its whole budget ({elapsed:.2f}s)")
+
+    def total_seconds(self):
+        return round(sum(r["seconds"] for r in self.records), 3)
+
+    def summary(self):
+        """Per-step totals for this scrape, slowest first"""
+        totals = {}
+        for r in self.records:
+            totals[r["step"]] = totals.get(r["step"], 0.0) + r["seconds"]
+        return dict(sorted(((k, round(v, 3)) for k, v in totals.items()), key=lambda kv: -kv[1]))
+
+    @classmethod
+    def global_stats(cls):
+        with cls._global_lock:
+            return {
+                step: {
+                    "count": agg["count"],
+                    "timeouts": agg["timeouts"],
+                    "seconds_avg": round(agg["seconds_total"] / agg["count"], 3),
+                    "seconds_max": round(agg["seconds_max"], 3),
+                }
+                for step, agg in cls._global.items()
+            }
+
+class StepWaiter:
+    """Waits on the real condition behind a scraping step instead of a fixed sleep"""
+    def __init__(self, page, telemetry=None, budgets=None):
+        self.page = page
+        self.telemetry = telemetry if telemetry is not None else WaitTelemetry()
+        self.budgets = dict(DEFAULT_BUDGETS_MS, **(budgets or {}))
+
+    def _budget(self, step, budget_ms):
+        return budget_ms if budget_ms is not None else self.budgets.get(step, 10000)
+
+    def _timed(self, step, wait):
+        start = time.monotonic()
+        timed_out = False
+        try:
+            wait()
+        except Exception as e:
+            # Playwright raises TimeoutError when the budget runs out
+            if "Timeout" not in type(e).__name__:
+                raise
+            timed_out = True
+        self.telemetry.record(step, time.monotonic() - start, timed_out)
+        return not timed_out
+
+    def on_mutation(self, step, selector, action, budget_ms=None):
+        """Run action() and wait until the data in selector (table rows or select options) differs
+        from before it, or the XHR the action sent has answered and been rendered; spinners or a
+        cleared tbody alone do not count. Returns action()'s result."""
+        key = f"w{next(_watch_ids)}"
+        self.page.evaluate(_SNAPSHOT_DATA_JS, [selector, key])
+        try:
+            result = action()
+            self._timed(step, lambda: self.page.wait_for_function(
+                _DATA_CHANGED_JS, arg=[selector, key], timeout=self._budget(step, budget_ms)))
+        finally:
+            try:
+                self.page.evaluate(_FORGET_DATA_JS, key)
+            except Exception:
+                pass # The page may have navigated away
+        return result
+
+    def until(self, step, predicate_js, arg=None, budget_ms=None):
+        """Wait until predicate_js(arg) is truthy in the page. Returns False on timeout."""
+        return self._timed(step, lambda: self.page.wait_for_function(
+            predicate_js, arg=arg, timeout=self._budget(step, budget_ms)))
+
+    def until_selector(self, step, selector, state="visible", budget_ms=None):
+        """Wait for selector to reach state. Returns False on timeout."""
+        return self._timed(step, lambda: self.page.locator(selector).first.wait_for(
+            state=state, timeout=self._budget(step, budget_ms)))
+
+class AsyncStepWaiter(StepWaiter):
+    """StepWaiter for playwright.async_api pages"""
+    async def _timed(self, step, wait):
+        start = time.monotonic()
+        timed_out = False
+        try:
+            await wait()
+        except Exception as e:
+            if "Timeout" not in type(e).__name__:
+                raise
+            timed_out = True
+        self.telemetry.record(step, time.monotonic() - start, timed_out)
+        return not timed_out
+
+    async def on_mutation(self, step, selector, action, budget_ms=None):
+        key = f"w{next(_watch_ids)}"
+        await self.page.evaluate(_SNAPSHOT_DATA_JS, [selector, key])
+        try:
+            result = await action()
+            await self._timed(step, lambda: self.page.wait_for_function(
+                _DATA_CHANGED_JS, arg=[selector, key], timeout=self._budget(step, budget_ms)))
+        finally:
+            try:
+                await self.page.evaluate(_FORGET_DATA_JS, key)
+            except Exception:
+                pass
+        return result
+
+    async def until(self, step, predicate_js, arg=None, budget_ms=None):
+        return await self._timed(step, lambda: self.page.wait_for_function(
+            predicate_js, arg=arg, timeout=self._budget(step, budget_ms)))
+
+    async def until_selector(self, step, selector, state="visible", budget_ms=None):
+        return await self._timed(step, lambda: self.page.locator(selector).first.wait_for(
+            state=state, timeout=self._budget(step, budget_ms)))
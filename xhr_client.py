@@ -0,0 +1,500 @@
+import json, os, threading
+from string import Formatter
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = "https://corner-stats.com"
+ENDPOINTS_FILE = os.environ.get("CORNER_STATS_XHR_ENDPOINTS", "xhr_endpoints.json")
+# Max number of table pages requested at once when paginating in parallel
+PAGINATION_CONCURRENCY = int(os.environ.get("PAGINATION_CONCURRENCY", 4))
+
+class XhrEndpointMissing(Exception):
+    """Raised when no replayable template has been recorded for an endpoint yet"""
+
+# --- HTML fragment parsing (stdlib only, mirrors the Playwright extraction rules) ---
+class _OptionsParser(HTMLParser):
+    """Collect <option> value/name pairs, optionally only inside <select class="...select_class...">"""
+    def __init__(self, select_class=None):
+        super().__init__()
+        self.select_class = select_class
+        self.options = []
+        self._in_select = select_class is None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "select" and self.select_class:
+            self._in_select = self.select_class in (attrs.get("class") or "").split()
+        elif tag == "option" and self._in_select:
+            self._option = {"value": attrs.get("value"), "text": []}
+
+    def handle_endtag(self, tag):
+        if tag == "option" and self._option is not None:
+            value = self._option["value"]
+            name = "".join(self._option["text"]).strip()
+            if value and value != "0":
+                self.options.append({"value": value, "name": name})
+            self._option = None
+        elif tag == "select" and self.select_class:
+            self._in_select = False
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option["text"].append(data)
+
+class _TableParser(HTMLParser):
+    """Extract visible headers and tr.tr__main rows the same way _extract_table_data does"""
+    def __init__(self):
+        super().__init__()
+        self.headers = []
+        self.rows = []
+        self._in_thead = False
+        self._header_done = False
+        self._th = None
+        self._th_hidden = False
+        self._row = None
+        self._td = None
+        self._td_skip = False
+        self._link = None # Text of the cell's first link, as td.querySelector("a") sees it
+        self._link_done = False
+        self._a_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        cls = attrs.get("class") or ""
+        if tag == "thead":
+            self._in_thead = True
+        elif tag == "th" and self._in_thead and not self._header_done:
+            self._th = []
+            self._th_hidden = "display:none" in (attrs.get("style") or "")
+        elif tag == "tr" and "tr__main" in cls.split():
+            self._row = []
+        elif tag == "td" and self._row is not None and self._td is None:
+            self._td = []
+            self._td_skip = "td__exclude" in cls or "td__details" in cls
+            self._link = None
+            self._link_done = False
+        elif tag == "a" and self._td is not None and not self._link_done:
+            if self._link is None:
+                self._link = []
+            self._a_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == "thead":
+            self._in_thead = False
+            self._header_done = True
+        elif tag == "tr" and self._in_thead:
+            self._header_done = True
+        elif tag == "th" and self._th is not None:
+            if not self._th_hidden:
+                self.headers.append("".join(self._th).strip())
+            self._th = None
+        elif tag == "a" and self._a_depth:
+            self._a_depth -= 1
+            # Later links in the cell are not part of its value
+            self._link_done = self._a_depth == 0
+        elif tag == "td" and self._td is not None:
+            if not self._td_skip:
+                text = self._link if self._link is not None else self._td
+                self._row.append("".join(text).strip())
+            self._td = None
+            self._a_depth = 0
+        elif tag == "tr" and self._row is not None:
+            if self._row: # Only add non-empty rows
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._th is not None:
+            self._th.append(data)
+        if self._td is not None:
+            self._td.append(data)
+            if self._a_depth and self._link is not None:
+                self._link.append(data)
+
+class _LoginButtonParser(HTMLParser):
+    """Spots the a.btn.btn-confirm "Login" link the site only shows to logged-out visitors"""
+    def __init__(self):
+        super().__init__()
+        self.found = False
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        classes = (dict(attrs).get("class") or "").split()
+        if tag == "a" and "btn" in classes and "btn-confirm" in classes:
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._text is not None:
+            if "Login" in "".join(self._text):
+                self.found = True
+            self._text = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+def parse_options(html, select_class=None):
+    parser = _OptionsParser(select_class)
+    parser.feed(html)
+    return parser.options
+
+def parse_table(html):
+    parser = _TableParser()
+    parser.feed(html)
+    return parser.headers, parser.rows
+
+def has_login_button(html):
+    parser = _LoginButtonParser()
+    parser.feed(html)
+    return parser.found
+
+def _html_from_response(response):
+    """XHRs return either an HTML fragment or JSON wrapping one"""
+    if "json" in response.headers.get("content-type", ""):
+        payload = response.json()
+        if isinstance(payload, dict):
+            for key in ("html", "data", "table", "content"):
+                if isinstance(payload.get(key), str):
+                    return payload[key]
+        return response.text
+    return response.text
+
+# --- Paging helpers ---
+def merge_pages(pages):
+    """Concatenate pages of rows in order, dropping rows already seen on an earlier page"""
+    seen = set()
+    merged = []
+    for rows in pages:
+        for row in rows:
+            key = tuple(row)
+            if key not in seen:
+                seen.add(key)
+                merged.append(row)
+    return merged
+
+def cut_at_known(rows, known=None):
+    """Split off the rows before the first one known(row) recognises.
+
+    Returns (new_rows, reached_known). The table lists the newest matches first, so
+    everything from the first known row onwards is already stored.
+    """
+    if known is None:
+        return rows, False
+    for i, row in enumerate(rows):
+        if known(row):
+            return rows[:i], True
+    return rows, False
+
+def collect_pages(fetch_wave, first_page, concurrency=None, max_pages=200, previous_rows=None, known=None, on_page=None):
+    """Fetch pages first_page, first_page+1, ... in waves of `concurrency` parallel requests.
+
+    fetch_wave(page_numbers) returns one row list per page (None for a failed page).
+    Stops at the first empty/failed page or one repeating the page before it, since the
+    site keeps serving the last page past the end, and at the first row known(row)
+    recognises. Returns the row lists in page order; on_page(page_num, rows) sees each
+    one as it is accepted.
+    """
+    concurrency = max(1, concurrency or PAGINATION_CONCURRENCY)
+    pages = []
+    page_num = first_page
+    while page_num < first_page + max_pages:
+        wave = list(range(page_num, min(page_num + concurrency, first_page + max_pages)))
+        for number, rows in zip(wave, fetch_wave(wave)):
+            if not rows or rows == previous_rows:
+                return pages
+            new_rows, reached_known = cut_at_known(rows, known)
+            if new_rows:
+                pages.append(new_rows)
+                if on_page:
+                    on_page(number, new_rows)
+            if reached_known:
+                return pages
+            previous_rows = rows
+        page_num += len(wave)
+    return pages
+
+# --- Endpoint templates ---
+def _escape(text):
+    """Protect literal braces from str.format"""
+    return text.replace("{", "{{").replace("}", "}}")
+
+def request_params(url, body=None):
+    """All query and form parameters of a request as (name, value) pairs"""
+    pairs = parse_qsl(urlsplit(url).query, keep_blank_values=True)
+    if body:
+        pairs += parse_qsl(body, keep_blank_values=True)
+    return pairs
+
+def _placeholder_keys(pairs, values, keys):
+    """Map placeholder -> parameter name: the given keys, else the one parameter holding the value.
+
+    A value held by several parameters (e.g. page 2 and filter_home[]=2) is ambiguous
+    and gets no placeholder, rather than corrupting the other parameters.
+    """
+    resolved = dict(keys or {})
+    for placeholder, value in values.items():
+        if placeholder in resolved:
+            continue
+        names = [k for k, v in pairs if v == str(value)]
+        if len(names) == 1:
+            resolved[placeholder] = names[0]
+        elif names:
+            print(f"XHR template: '{placeholder}' value {value} is held by {names}, leaving it literal")
+    return resolved
+
+def _templatize_params(pairs, keys):
+    by_name = {name: f"{{{placeholder}}}" for placeholder, name in keys.items()}
+    return [(k, by_name[k] if k in by_name else _escape(v)) for k, v in pairs]
+
+def templatize_request(method, url, body=None, values=None, keys=None):
+    """Turn a captured request into a template with {placeholders}.
+
+    keys maps a placeholder to the parameter name it replaces; placeholders in values
+    without a key go to the single parameter whose value equals theirs.
+    """
+    parts = urlsplit(url)
+    query_pairs = parse_qsl(parts.query, keep_blank_values=True)
+    body_pairs = parse_qsl(body, keep_blank_values=True) if body else []
+    keys = _placeholder_keys(query_pairs + body_pairs, values or {}, keys)
+    query = urlencode(_templatize_params(query_pairs, keys), safe="{}")
+    template = {
+        "method": method,
+        "url": urlunsplit((parts.scheme, parts.netloc, _escape(parts.path), query, "")),
+        "body": None,
+    }
+    if body:
+        template["body"] = urlencode(_templatize_params(body_pairs, keys), safe="{}")
+    return template
+
+def changed_params(first, second):
+    """Names of the parameters whose values differ between two captured (url, body) requests"""
+    a, b = dict(request_params(*first)), dict(request_params(*second))
+    return [name for name in b if name in a and a[name] != b[name]]
+
+def fill_template(template, **values):
+    """Return (method, url, body) with the placeholders filled in"""
+    body = template["body"].format(**values) if template.get("body") else None
+    return template["method"], template["url"].format(**values), body
+
+def has_placeholder(template, name):
+    fields = lambda text: {field for _, field, _, _ in Formatter().parse(text or "") if field is not None}
+    return name in fields(template["url"]) or name in fields(template.get("body"))
+
+class XhrEndpoints:
+    """Replayable request templates keyed by endpoint name, persisted as JSON.
+
+    A template is {"method", "url", "body", "meta"} where parameter values may be
+    "{placeholder}" strings. Templates are learned from the browser with
+    ``record`` or can be edited by hand in the endpoints file.
+    """
+    def __init__(self, path=ENDPOINTS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._templates = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._templates = json.load(f)
+            except Exception as e:
+                print(f"Failed to load XHR endpoints: {e}")
+
+    def has(self, name):
+        return name in self._templates
+
+    def get(self, name):
+        if name not in self._templates:
+            raise XhrEndpointMissing(f"No recorded XHR template for '{name}'")
+        return self._templates[name]
+
+    def wants(self, name, meta=None):
+        """True if name has no template yet, or one recorded for different meta"""
+        return name not in self._templates or (meta is not None and self._templates[name].get("meta") != meta)
+
+    def record(self, name, method, url, body=None, values=None, meta=None, keys=None):
+        """Store a captured request as a template (see templatize_request)"""
+        template = templatize_request(method, url, body, values, keys)
+        template["meta"] = meta or {}
+        with self._lock:
+            self._templates[name] = template
+            try:
+                with open(self.path, "w") as f:
+                    json.dump(self._templates, f, indent=2)
+            except Exception as e:
+                print(f"Failed to save XHR endpoints: {e}")
+        return template
+
+class XhrEndpointRecorder:
+    """Captures the XHR a browser action triggers and stores it as a template"""
+    def __init__(self, endpoints):
+        self.endpoints = endpoints
+
+    def capture(self, page, name, action, values=None, meta=None, timeout=5000):
+        """Run action() on the page; if it fires an XHR, record it under name. Returns action()'s result."""
+        done = False
+        result = None
+        try:
+            with page.expect_request(lambda r: r.resource_type == "xhr", timeout=timeout) as request_info:
+                result = action()
+                done = True
+        except Exception as e:
+            if not done:
+                raise # The action itself failed
+            print(f"XHR recorder: nothing captured for '{name}': {e}")
+            return result
+        request = request_info.value
+        self.endpoints.record(name, request.method, request.url, request.post_data, values, meta)
+        print(f"XHR recorder: captured '{name}' -> {request.method} {request.url}")
+        return result
+
+_endpoints = None
+
+def get_xhr_endpoints():
+    global _endpoints
+    if _endpoints is None:
+        _endpoints = XhrEndpoints()
+    return _endpoints
+
+# --- Client ---
+class CornerStatsXhrClient:
+    """Browserless client that replays the site's AJAX calls with a saved session.
+
+    Uses one pooled keep-alive ``requests.Session`` per login, so catalog and
+    table fetches cost a few MB and one HTTP round trip each.
+    """
+    def __init__(self, session_data, endpoints=None, pool_size=10, timeout=15):
+        self.endpoints = endpoints or get_xhr_endpoints()
+        self.timeout = timeout
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        headers = dict(session_data.get("headers", {}))
+        # requests can only decode gzip/deflate without extra packages
+        headers["accept-encoding"] = "gzip, deflate"
+        headers.setdefault("referer", BASE_URL + "/")
+        self.http.headers.update(headers)
+        for cookie in session_data.get("cookies", []):
+            self.http.cookies.set(cookie["name"], cookie["value"],
+                                  domain=cookie.get("domain"), path=cookie.get("path", "/"))
+
+    def _call(self, name, **values):
+        method, url, body = fill_template(self.endpoints.get(name), **values)
+        response = self.http.request(
+            method, url, data=body, timeout=self.timeout,
+            headers={"content-type": "application/x-www-form-urlencoded; charset=UTF-8"} if body else None,
+        )
+        response.raise_for_status()
+        return _html_from_response(response)
+
+    def is_logged_in(self):
+        """Cheap session probe: fetch the home page and check that the Login link is gone"""
+        response = self.http.get(BASE_URL, timeout=self.timeout)
+        response.raise_for_status()
+        return not has_login_button(response.text)
+
+    def cookie_values(self):
+        """{name: value} of the client's cookies (the site may have rotated some since login)"""
+        return {cookie.name: cookie.value for cookie in self.http.cookies}
+
+    def cookie_expiries(self):
+        """{name: expiry epoch} of the cookies the site set with an expiry (stored cookies are loaded without one)"""
+        return {cookie.name: cookie.expires for cookie in self.http.cookies if cookie.expires}
+
+    def get_countries(self):
+        response = self.http.get(BASE_URL, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_options(response.text, "select-control_1")
+
+    def get_leagues(self, country_id):
+        return parse_options(self._call("leagues", country_id=country_id))
+
+    def get_teams(self, league_id):
+        return parse_options(self._call("teams", league_id=league_id))
+
+    def _find_country(self, country_name):
+        return next((c for c in self.get_countries() if c["name"].lower() == country_name.lower()), None)
+
+    def get_leagues_of(self, country_name):
+        """Same (data, status) contract as CornerStatsDataScraper.get_leagues"""
+        country = self._find_country(country_name)
+        if not country:
+            return {"error": f"Country '{country_name}' not found."}, 404
+        leagues = [{"id": l["value"], "name": l["name"]} for l in self.get_leagues(country["value"])]
+        return {"country": country["name"], "leagues": leagues}, 200
+
+    def get_teams_of(self, country_name, league_id):
+        """Same (data, status) contract as CornerStatsDataScraper.get_teams"""
+        country = self._find_country(country_name)
+        if not country:
+            return {"error": f"Country '{country_name}' not found."}, 404
+        return {"country": country["name"], "league_id": str(league_id), "teams": self.get_teams(league_id)}, 200
+
+    def get_leagues_and_teams(self, country_name):
+        """Same (data, status) contract as CornerStatsDataScraper.get_leagues_and_teams"""
+        selected_country = self._find_country(country_name)
+        if not selected_country:
+            return {"error": f"Country '{country_name}' not found."}, 404
+        result_data = {"country": selected_country["name"], "leagues": []}
+        for league in self.get_leagues(selected_country["value"]):
+            result_data["leagues"].append({
+                "id": league["value"],
+                "name": league["name"],
+                "teams": self.get_teams(league["value"]),
+            })
+        return result_data, 200
+
+    def can_fetch_table(self, filters):
+        """The table template bakes in the filter state it was recorded with"""
+        if not self.endpoints.has("table"):
+            return False
+        return self.endpoints.get("table").get("meta", {}).get("filters") == filters
+
+    def get_table_page(self, host_id, guest_id, page_num):
+        return parse_table(self._call("table", host_id=host_id, guest_id=guest_id, page=page_num))
+
+    def get_all_table_data(self, host_id, guest_id, first_page=1, max_pages=200, concurrency=None, known=None, on_page=None):
+        """Fetch every page, `concurrency` at a time, merged in order without duplicates.
+
+        With known(row) given, only the rows before the first known one are returned.
+        on_page(page_num, headers, rows) is called for each page as it arrives.
+        """
+        headers, first_rows = self.get_table_page(host_id, guest_id, first_page)
+        if not first_rows:
+            return headers, []
+        new_rows, reached_known = cut_at_known(first_rows, known)
+        if on_page and new_rows:
+            on_page(first_page, headers, new_rows)
+        if reached_known:
+            return headers, new_rows
+        if not has_placeholder(self.endpoints.get("table"), "page"):
+            return headers, first_rows # Paging parameter unknown: only the first page is reachable
+
+        def fetch_wave(page_numbers):
+            with ThreadPoolExecutor(max_workers=len(page_numbers)) as executor:
+                results = executor.map(lambda n: self.get_table_page(host_id, guest_id, n)[1], page_numbers)
+                return list(results)
+
+        pages = collect_pages(fetch_wave, first_page + 1, concurrency, max_pages - 1, previous_rows=first_rows,
+                              known=known, on_page=(lambda n, rows: on_page(n, headers, rows)) if on_page else None)
+        return headers, merge_pages([first_rows] + pages)
+
+    def close(self):
+        self.http.close()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_xhr_client(session_data):
+    """Reuse one pooled client per session so keep-alive connections survive across requests"""
+    key = (session_data.get("email"), session_data.get("timestamp"))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            for old_key in [k for k in _clients if k[0] == key[0]]:
+                _clients.pop(old_key).close()
+            client = _clients[key] = CornerStatsXhrClient(session_data)
+        return client